@@ -0,0 +1,92 @@
+"""Benchmark utils.compute_diff (line_diff engine) against the previous difflib version.
+
+Builds ~1 MB documents dominated by repeated navigation and table rows, applies
+a few scattered edits, and times both implementations.
+
+Usage: python scripts/bench_diff.py [--size-mb 1] [--edits 50] [--repeat 3]
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import utils, line_diff
+
+
+def difflib_compute_diff(old_text, new_text):
+    # the implementation utils.compute_diff used before line_diff
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    diff = list(difflib.unified_diff(old_lines, new_lines, lineterm=''))
+    added = []
+    removed = []
+    for line in diff:
+        if line.startswith('+') and not line.startswith('+++'):
+            added.append(line[1:])
+        elif line.startswith('-') and not line.startswith('---'):
+            removed.append(line[1:])
+    return '\n'.join(added), '\n'.join(removed)
+
+
+def make_docs(size_mb, edits, seed=1):
+    rnd = random.Random(seed)
+    nav = ['Home', 'News', 'About', 'Contact', 'Archive', 'Subscribe']
+    lines = []
+    size = 0
+    i = 0
+    while size < size_mb * 1_000_000:
+        if i % 40 < 6:
+            line = nav[i % 6]
+        elif i % 7 == 0:
+            line = '| cell | cell | cell | cell |'
+        else:
+            line = f'Paragraph {i} ' + ' '.join(rnd.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet']) for _ in range(12))
+        lines.append(line)
+        size += len(line) + 1
+        i += 1
+    new = list(lines)
+    for _ in range(edits):
+        pos = rnd.randrange(len(new))
+        r = rnd.random()
+        if r < 0.4:
+            new[pos] = new[pos] + ' (edited)'
+        elif r < 0.7:
+            new.insert(pos, 'Inserted line %d' % pos)
+        else:
+            del new[pos]
+    return '\n'.join(lines), '\n'.join(new)
+
+
+def timeit(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size-mb', type=float, default=1.0)
+    ap.add_argument('--edits', type=int, default=50)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+    old, new = make_docs(args.size_mb, args.edits)
+    print(f'documents: {len(old) / 1e6:.2f} MB / {len(old.splitlines())} lines, {args.edits} edits')
+    t_new, out_new = timeit(lambda: utils.compute_diff(old, new), args.repeat)
+    mode = line_diff.diff_texts(old, new)['mode']
+    print(f'line_diff ({mode}): {t_new * 1000:.1f} ms')
+    t_old, out_old = timeit(lambda: difflib_compute_diff(old, new), args.repeat)
+    print(f'difflib:           {t_old * 1000:.1f} ms')
+    print(f'speedup:           {t_old / t_new:.1f}x')
+    same = sorted(out_new[0].splitlines()) == sorted(out_old[0].splitlines()) and sorted(out_new[1].splitlines()) == sorted(out_old[1].splitlines())
+    print('added/removed line sets identical:', same)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark batch and multi-proof generation in src/merkle.py.
+
+Compares:
+- the previous per-index merkle_proof, which rebuilt every level for each
+  index (timed on a sample and extrapolated, since all 100k would take
+  hours),
+- merkle_proofs over all leaves from a single tree build,
+- merkle_multiproof for all leaves and for a 1% sample, with proof sizes,
+- verify_proofs and verify_multiproof.
+
+Usage: python scripts/bench_merkle_proofs.py [--leaves 100000] [--sample 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import merkle
+from src.merkle import sha256
+
+
+def legacy_merkle_proof(leaves, index):
+    # the implementation merkle.merkle_proof used before merkle_levels
+    nodes = [sha256(l) for l in leaves]
+    proof = []
+    idx = index
+    while len(nodes) > 1:
+        next_nodes = []
+        for i in range(0, len(nodes), 2):
+            a = nodes[i]
+            b = nodes[i+1] if i+1 < len(nodes) else nodes[i]
+            next_nodes.append(sha256(a + b))
+        sibling_index = idx ^ 1
+        proof.append(nodes[sibling_index] if sibling_index < len(nodes) else nodes[idx])
+        idx = idx // 2
+        nodes = next_nodes
+    return proof
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--leaves', type=int, default=100_000)
+    ap.add_argument('--sample', type=int, default=50)
+    args = ap.parse_args()
+    n = args.leaves
+    leaves = [f'content-hash-{i}'.encode() for i in range(n)]
+    root = merkle.merkle_root(leaves)
+    rnd = random.Random(1)
+
+    sample = rnd.sample(range(n), args.sample)
+    dt, legacy = timed(lambda: {i: legacy_merkle_proof(leaves, i) for i in sample})
+    print(f'legacy per-index proofs: {dt / len(sample) * 1000:.1f} ms/proof -> ~{dt / len(sample) * n:.0f} s for all {n}')
+
+    dt, proofs = timed(lambda: merkle.merkle_proofs(leaves))
+    print(f'merkle_proofs (all {n}):  {dt:.2f} s')
+    assert all(proofs[i] == legacy[i] for i in sample)
+    dt, ok = timed(lambda: merkle.verify_proofs(dict(enumerate(leaves)), proofs, root))
+    print(f'verify_proofs (all):      {dt:.2f} s ok={ok}')
+
+    per_proof = sum(len(p) for p in proofs.values())
+    for label, idx in (('all leaves', list(range(n))), ('1% sample', sorted(rnd.sample(range(n), n // 100)))):
+        dt, mp = timed(lambda: merkle.merkle_multiproof(leaves, idx))
+        singles = per_proof if len(idx) == n else sum(len(proofs[i]) for i in idx)
+        vt, ok = timed(lambda: merkle.verify_multiproof({i: leaves[i] for i in idx}, mp, root))
+        print(f'multiproof ({label}): {dt:.2f} s build, {vt:.2f} s verify ok={ok}, {len(mp["hashes"])} hashes vs {singles} in separate proofs')
+
+
+if __name__ == '__main__':
+    main()
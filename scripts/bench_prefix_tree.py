@@ -0,0 +1,65 @@
+"""Benchmark per-site root maintenance: prefix tree (src/prefix_tree.py) vs full rebuild.
+
+Fills a throw-away database with N knowledge-node hashes, then times:
+- the legacy compute_tree_root_from_blob over all nodes (sort + full rebuild),
+- reading the cached tree root,
+- appending one more delta of 10 nodes,
+- generating and verifying an inclusion proof.
+
+Usage: python scripts/bench_prefix_tree.py [--nodes 1000000] [--db /tmp/bench_prefix_tree.db]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from hashlib import sha256
+from src import db, prefix_tree
+from src.merkle_distributed import compute_tree_root_from_blob
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=1_000_000)
+    ap.add_argument('--db', default='/tmp/bench_prefix_tree.db')
+    args = ap.parse_args()
+    path = Path(args.db)
+    if path.exists():
+        path.unlink()
+    db.DB_PATH = path
+    db.init_db()
+    hashes = [sha256(str(i).encode()).hexdigest() for i in range(args.nodes)]
+
+    t0 = time.perf_counter()
+    compute_tree_root_from_blob({'nodes': [{'node_hash': h} for h in hashes]})
+    print(f'full rebuild root ({args.nodes} nodes): {time.perf_counter() - t0:.2f} s')
+
+    r = prefix_tree.PrefixTree(1)
+    t0 = time.perf_counter()
+    for i in range(0, len(hashes), 100_000):
+        r.append(hashes[i:i + 100_000])
+    print(f'initial tree load:                  {time.perf_counter() - t0:.2f} s')
+
+    t0 = time.perf_counter()
+    r = prefix_tree.PrefixTree(1)
+    root = r.root()
+    print(f'tree root (root row read):          {(time.perf_counter() - t0) * 1e6:.0f} us')
+
+    extra = [sha256(str(args.nodes + i).encode()).hexdigest() for i in range(10)]
+    t0 = time.perf_counter()
+    r.preview_root(extra)
+    print(f'tree preview_root, 10-node delta:   {(time.perf_counter() - t0) * 1e3:.2f} ms')
+    t0 = time.perf_counter()
+    root = r.append(extra)
+    print(f'tree append, 10-node delta:         {(time.perf_counter() - t0) * 1e3:.2f} ms')
+
+    t0 = time.perf_counter()
+    p = r.proof(hashes[args.nodes // 3])
+    ok = prefix_tree.verify_inclusion(hashes[args.nodes // 3], p, root)
+    print(f'tree proof + verify:                {(time.perf_counter() - t0) * 1e3:.2f} ms ({len(p["path"])} levels, ok={ok})')
+
+
+if __name__ == '__main__':
+    main()
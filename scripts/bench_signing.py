@@ -0,0 +1,105 @@
+"""Benchmark signatures per second through src/crypto_asym.py.
+
+Compares, for a local Ed25519 key and for a mocked KMS stand-in:
+- the previous sign_bytes, which looked up the KMS provider (constructing a
+  client) and re-read the key file on every call,
+- the cached process-wide Signer (sign in a loop),
+- Signer.sign_many (a plain loop locally; pipelined provider calls, or one
+  call to a provider-side batch API, for KMS).
+
+The KMS stand-in charges a fixed client-construction cost and a per-request
+round trip, both configurable.
+
+Usage: python scripts/bench_signing.py [--n 5000] [--kms-n 500] [--rtt-ms 5] [--client-ms 20] [--concurrency 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import crypto_asym
+
+
+class MockKMS:
+    """Remote-KMS stand-in: sleeps `rtt` per request, returns an HMAC-like tag."""
+
+    def __init__(self, rtt, client_cost):
+        time.sleep(client_cost)  # boto3/hvac client construction
+        self.rtt = rtt
+
+    def sign(self, key_id, data):
+        time.sleep(self.rtt)
+        return b'kms' + data[:29]
+
+    def verify(self, key_id, data, signature):
+        time.sleep(self.rtt)
+        return signature == b'kms' + data[:29]
+
+
+class MockBatchKMS(MockKMS):
+    """Same, with a batch endpoint that signs up to 100 messages per round trip."""
+
+    def sign_many(self, key_id, items):
+        time.sleep(self.rtt * ((len(items) + 99) // 100))
+        return [b'kms' + d[:29] for d in items]
+
+
+def legacy_sign_bytes(data, provider_factory):
+    # the implementation crypto_asym.sign_bytes used before Signer
+    provider = provider_factory()
+    key_id = os.environ.get('WPS_KMS_KEY_ID') or os.environ.get('AWS_KMS_KEY_ID')
+    if provider and key_id:
+        try:
+            sig = provider.sign(key_id, data)
+            return sig.hex() if isinstance(sig, (bytes, bytearray)) else sig
+        except Exception:
+            pass
+    sk, vk = crypto_asym.ensure_keypair()
+    return sk.sign(data).signature.hex()
+
+
+def rate(label, n, fn):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f'{label:<44} {n / dt:>10.0f} sig/s')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=5000)
+    ap.add_argument('--kms-n', type=int, default=500)
+    ap.add_argument('--rtt-ms', type=float, default=5)
+    ap.add_argument('--client-ms', type=float, default=20)
+    ap.add_argument('--concurrency', type=int, default=16)
+    args = ap.parse_args()
+    keys = Path(tempfile.mkdtemp())
+    crypto_asym.KEY_DIR, crypto_asym.SK_PATH, crypto_asym.VK_PATH = keys, keys / 'ed25519_sk.hex', keys / 'ed25519_vk.hex'
+    msgs = [f'page version text {i} '.encode() * 50 for i in range(args.n)]
+
+    print('local Ed25519')
+    os.environ.pop('WPS_KMS_KEY_ID', None)
+    crypto_asym.reset_signer()
+    rate('  legacy sign_bytes (lookup + key read/call)', args.n, lambda: [legacy_sign_bytes(m, crypto_asym._get_kms_provider) for m in msgs])
+    rate('  cached Signer.sign', args.n, lambda: [crypto_asym.sign_bytes(m) for m in msgs])
+    rate('  Signer.sign_many', args.n, lambda: crypto_asym.sign_many(msgs))
+
+    rtt, client = args.rtt_ms / 1000, args.client_ms / 1000
+    kms_msgs = msgs[:args.kms_n]
+    print(f'mocked KMS ({args.rtt_ms} ms round trip, {args.client_ms} ms client setup)')
+    os.environ['WPS_KMS_KEY_ID'] = 'bench'
+    rate('  legacy sign_bytes (new client/call)', len(kms_msgs), lambda: [legacy_sign_bytes(m, lambda: MockKMS(rtt, client)) for m in kms_msgs])
+    signer = crypto_asym.Signer(MockKMS(rtt, client), 'bench')
+    rate('  cached Signer.sign', len(kms_msgs), lambda: [signer.sign(m) for m in kms_msgs])
+    rate(f'  Signer.sign_many (pipelined x{args.concurrency})', len(kms_msgs), lambda: signer.sign_many(kms_msgs, concurrency=args.concurrency))
+    batch = crypto_asym.Signer(MockBatchKMS(rtt, client), 'bench')
+    rate('  Signer.sign_many (provider batch API)', len(kms_msgs), lambda: batch.sign_many(kms_msgs))
+    os.environ.pop('WPS_KMS_KEY_ID', None)
+    crypto_asym.reset_signer()
+
+
+if __name__ == '__main__':
+    main()
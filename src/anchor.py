@@ -7,7 +7,7 @@ or direct blockchain anchoring services.
 import os
 import time
 from pathlib import Path
-from . import anchor_ots
+from . import anchor_ots, segment_store
 
 
 ANCHOR_DIR = Path(os.environ.get('WPS_ANCHOR_DIR', 'anchors'))
@@ -18,9 +18,11 @@ def anchor_hash(content_hash: str) -> str:
     """Anchor a content hash; return a witness id.
 
     This will attempt to create an OpenTimestamps (.ots) proof using the `ots`
-    CLI (via `src/anchor_ots.py`). If unavailable, a local anchor file is created
-    and its path returned. The returned string is suitable for storing in the DB
-    as `witness_tx_id` (it may be a filesystem path or an ots filename).
+    CLI (via `src/anchor_ots.py`). If unavailable, a local anchor record is
+    created instead. Proof bytes and anchor records are appended to the
+    segment store (`src/segment_store.py`) rather than written as one file
+    each; the returned proof path is a `seg:` reference. The witness id is
+    the ots filename or OTSD path, suitable for `witness_tx_id`.
     """
     # Try OTS stamp via CLI wrapper
     ots_path = anchor_ots.stamp_hash(content_hash, ANCHOR_DIR)
@@ -30,19 +32,12 @@ def anchor_hash(content_hash: str) -> str:
         # stamp_hash returned an ots path or identifier; try to fetch proof bytes and persist locally
         proof_bytes = anchor_ots.fetch_proof(ots_path, ANCHOR_DIR)
         if proof_bytes:
-            ts = int(time.time())
-            fname = ANCHOR_DIR / f"ots.remote.{content_hash}.{ts}.ots"
-            with open(fname, 'wb') as f:
-                f.write(proof_bytes)
-            local_proof_path = str(fname)
+            local_proof_path = segment_store.put(f"ots/{content_hash}", proof_bytes, kind='proof')
         # use ots_path as witness id if provided
         witness = str(ots_path)
 
-    # If we didn't obtain an OTS proof, create a local anchor file
+    # If we didn't obtain an OTS proof, store a local anchor record
     if not local_proof_path:
         ts = int(time.time())
-        fname = ANCHOR_DIR / f"anchor.{content_hash}.{ts}.txt"
-        with open(fname, 'w') as f:
-            f.write(f"anchor:{content_hash}\ncreated:{ts}\n")
-        local_proof_path = str(fname)
+        local_proof_path = segment_store.put(f"anchor/{content_hash}", f"anchor:{content_hash}\ncreated:{ts}\n".encode('utf-8'), kind='anchor')
     return (witness, local_proof_path)
@@ -0,0 +1,109 @@
+"""Per-cycle batched anchoring of content hashes.
+
+At the end of each crawl cycle, `enqueue_pending` collects every PageVersion
+that is not batched or anchored yet and builds one Merkle tree over their
+content hashes (see merkle.py). It stores each version's batch id, leaf
+index and sibling path, and queues the root for workers/anchor_worker.py,
+which anchors it once. A version can then be checked offline from its own
+row and the batch root (`verify_version`); the root's anchor proof covers
+the whole batch.
+"""
+import json
+import logging
+from datetime import datetime
+from . import db, merkle
+
+logger = logging.getLogger(__name__)
+
+
+def _leaf(content_hash):
+    return content_hash.encode('utf-8')
+
+
+BATCH_MAX = 10000
+
+
+def _enqueue(cur, items, now):
+    leaves = [_leaf(h) for _, h in items]
+    root = merkle.merkle_root(leaves).hex()
+    proofs = merkle.merkle_proofs(leaves)
+    cur.execute('INSERT INTO AnchorBatches (root, leaf_count, created_at) VALUES (?, ?, ?)', (root, len(items), now))
+    batch_id = cur.lastrowid
+    cur.executemany('UPDATE PageVersions SET anchor_batch_id=?, anchor_leaf_index=?, anchor_proof=? WHERE id=?',
+                    [(batch_id, i, json.dumps([p.hex() for p in proofs[i]]), vid) for i, (vid, _) in enumerate(items)])
+    cur.execute("INSERT INTO AnchorQueue (batch_id, status, attempts, next_attempt_at, created_at) VALUES (?, 'pending', 0, ?, ?)",
+                (batch_id, now, now))
+    logger.info('Queued %s versions under root %s (batch %s)', len(items), root, batch_id)
+    return batch_id
+
+
+def enqueue_pending(batch_max=BATCH_MAX):
+    """Batch every version that has neither an anchor batch nor a witness; return the batch ids.
+
+    The pending set is read from PageVersions, not kept by the caller, so
+    versions from a crashed cycle or a failed earlier call are picked up by
+    the next one. Selecting and batching share one BEGIN IMMEDIATE
+    transaction, so two crawlers cannot batch the same version.
+    """
+    batch_ids = []
+    while True:
+        conn = db.get_conn()
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            items = [(r['id'], r['content_hash']) for r in cur.execute(
+                'SELECT id, content_hash FROM PageVersions WHERE anchor_batch_id IS NULL AND witness_tx_id IS NULL ORDER BY id LIMIT ?',
+                (batch_max,)).fetchall()]
+            if items:
+                batch_ids.append(_enqueue(cur, items, datetime.utcnow().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        if len(items) < batch_max:
+            return batch_ids
+
+
+def record_anchor(cur, batch_id, witness, proof_path):
+    """Store an anchored root's witness on the batch and on every version in it."""
+    cur.execute('UPDATE AnchorBatches SET witness_tx_id=?, proof_path=? WHERE id=?', (witness, proof_path, batch_id))
+    cur.execute('UPDATE PageVersions SET witness_tx_id=?, proof_path=?, proof_verified=0 WHERE anchor_batch_id=?', (witness, proof_path, batch_id))
+
+
+def version_proof(version_id):
+    """Everything needed to check one version offline, or None if it is not batched."""
+    conn = db.get_conn()
+    row = conn.execute('''SELECT v.id, v.content_hash, v.anchor_batch_id, v.anchor_leaf_index, v.anchor_proof,
+                                 b.root, b.leaf_count, b.witness_tx_id, b.proof_path
+                          FROM PageVersions v JOIN AnchorBatches b ON b.id = v.anchor_batch_id
+                          WHERE v.id=?''', (version_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {
+        'version_id': row['id'],
+        'content_hash': row['content_hash'],
+        'batch_id': row['anchor_batch_id'],
+        'leaf_index': row['anchor_leaf_index'],
+        'path': json.loads(row['anchor_proof']),
+        'root': row['root'],
+        'leaf_count': row['leaf_count'],
+        'witness_tx_id': row['witness_tx_id'],
+        'proof_path': row['proof_path'],
+    }
+
+
+def verify_inclusion(content_hash, proof):
+    """Check a version_proof result against a content hash without touching the DB."""
+    try:
+        path = [bytes.fromhex(p) for p in proof['path']]
+        return merkle.verify_proof(_leaf(content_hash), path, bytes.fromhex(proof['root']), proof['leaf_index'])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def verify_version(version_id):
+    proof = version_proof(version_id)
+    return bool(proof) and verify_inclusion(proof['content_hash'], proof)
@@ -8,28 +8,26 @@ left to operator integration and dedicated modules.
 import logging
 from pathlib import Path
 import time
-from .db import get_conn
+from . import segment_store
 
 logger = logging.getLogger(__name__)
 
 
-def anchor_bitcoin(content_hash: str, anchor_dir: Path) -> str:
-    # Placeholder: create a local record indicating intent and return a witness id
+def _record(chain: str, label: str, content_hash: str) -> str:
+    # anchor intents are appended to the segment store; the reference is the witness id
     ts = int(time.time())
-    fname = anchor_dir / f"btc.{content_hash}.{ts}.anchor"
-    fname.write_text(f"bitcoin_anchor:{content_hash}\ncreated:{ts}\n")
-    return str(fname)
+    return segment_store.put(f"{chain}/{content_hash}/{ts}", f"{label}:{content_hash}\ncreated:{ts}\n".encode('utf-8'), kind='anchor')
 
 
-def anchor_ethereum(content_hash: str, anchor_dir: Path) -> str:
-    ts = int(time.time())
-    fname = anchor_dir / f"eth.{content_hash}.{ts}.anchor"
-    fname.write_text(f"ethereum_anchor:{content_hash}\ncreated:{ts}\n")
-    return str(fname)
+def anchor_bitcoin(content_hash: str, anchor_dir: Path = None) -> str:
+    # Placeholder: record the intent and return a witness id.
+    # anchor_dir is kept for callers of the file-based version; records live in segments now.
+    return _record('btc', 'bitcoin_anchor', content_hash)
 
 
-def anchor_arweave(content_hash: str, anchor_dir: Path) -> str:
-    ts = int(time.time())
-    fname = anchor_dir / f"ar.{content_hash}.{ts}.anchor"
-    fname.write_text(f"arweave_anchor:{content_hash}\ncreated:{ts}\n")
-    return str(fname)
+def anchor_ethereum(content_hash: str, anchor_dir: Path = None) -> str:
+    return _record('eth', 'ethereum_anchor', content_hash)
+
+
+def anchor_arweave(content_hash: str, anchor_dir: Path = None) -> str:
+    return _record('ar', 'arweave_anchor', content_hash)
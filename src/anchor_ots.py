@@ -19,6 +19,11 @@ def _has_ots_cli() -> bool:
     return shutil.which('ots') is not None
 
 
+def has_backend() -> bool:
+    """True when stamping can produce a real witness (ots CLI or OTSD_URL)."""
+    return _has_ots_cli() or bool(os.environ.get('OTSD_URL'))
+
+
 def create_temp_file_for_hash(content_hash: str, out_dir: Path) -> Path:
     out_dir.mkdir(parents=True, exist_ok=True)
     p = out_dir / f"{content_hash}.txt"
@@ -30,11 +35,12 @@ def stamp_hash(content_hash: str, anchor_dir: Path) -> Optional[str]:
     """Stamp a content hash using the ots CLI. Returns path to .ots file or None.
 
     This writes a small file containing the hex hash, runs `ots stamp` to produce
-    a .ots file and returns its path. If the ots CLI is unavailable, returns None.
+    a .ots file and returns its path. If the ots CLI is unavailable, the OTSD
+    service is tried (no local file is written); otherwise returns None.
     """
-    # Prefer local ots CLI if available
-    tf = create_temp_file_for_hash(content_hash, anchor_dir)
+    # Prefer local ots CLI if available; only it needs the hash on disk
     if _has_ots_cli():
+        tf = create_temp_file_for_hash(content_hash, anchor_dir)
         try:
             res = subprocess.run(['ots', 'stamp', str(tf)], capture_output=True, text=True)
             if res.returncode == 0:
@@ -0,0 +1,121 @@
+"""In-process change bus feeding the `/api/changes/stream` SSE endpoint.
+
+Every subscriber gets a bounded queue. Publishing never blocks: if a slow
+client's queue is full, the subscriber is marked `lagged` and its queue is
+dropped. The stream then replays from the `Changes` table starting at the last
+id it delivered. The same replay serves `Last-Event-ID` resumption, so an
+event id is always a `Changes.id`.
+
+Changes reach the bus in two ways. `db.insert_change` notifies it directly
+when the crawler runs in the same process. A single watcher thread per process
+also tails `Changes` by primary key while anyone is subscribed, which picks up
+rows written by a crawler running in another process. Both paths advance one
+shared `last_id`, so an event is never published twice.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional
+from . import db
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get('WPS_SSE_QUEUE_SIZE', '256'))
+POLL_SECONDS = float(os.environ.get('WPS_CHANGE_POLL_SECONDS', '1'))
+BATCH = 500
+
+
+class Subscription:
+    def __init__(self, site_id: Optional[int] = None, maxsize: int = QUEUE_SIZE):
+        self.site_id = site_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def offer(self, event: dict):
+        if self.site_id is not None and event.get('site_id') != self.site_id:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # backpressure: drop buffered events; the reader catches up from the DB
+            self.lagged = True
+            with self.queue.mutex:
+                self.queue.queue.clear()
+
+
+class ChangeBus:
+    def __init__(self, poll_seconds: float = POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._watcher = None
+        self.last_id = None
+
+    def subscribe(self, site_id: Optional[int] = None) -> Subscription:
+        sub = Subscription(site_id)
+        # same lock order as pump (fetch, then subscribers)
+        with self._fetch_lock, self._lock:
+            if not self._subs:
+                # nothing was pumped while nobody listened; start from the current tail
+                self.last_id = db.max_change_id()
+            self._subs.add(sub)
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name='change-bus-watcher', daemon=True)
+                self._watcher.start()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, event: dict):
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub.offer(event)
+
+    def pump(self):
+        """Publish every change row newer than `last_id`; returns how many were published."""
+        if not self._subs:
+            return 0
+        published = 0
+        with self._fetch_lock:
+            while True:
+                rows = db.changes_since(self.last_id or 0, limit=BATCH)
+                for ev in rows:
+                    self.publish(ev)
+                    self.last_id = ev['id']
+                published += len(rows)
+                if len(rows) < BATCH:
+                    return published
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            with self._lock:
+                if not self._subs:
+                    self._watcher = None
+                    return
+            try:
+                self.pump()
+            except Exception as e:
+                logger.warning('change bus poll failed: %s', e)
+
+
+_bus: Optional[ChangeBus] = None
+
+
+def get_bus() -> ChangeBus:
+    global _bus
+    if _bus is None:
+        _bus = ChangeBus()
+    return _bus
+
+
+def notify_change(change_id: int):
+    """Hook for db.insert_change: push new rows to local subscribers right away."""
+    if _bus is not None:
+        _bus.pump()
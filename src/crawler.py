@@ -3,6 +3,8 @@ import logging
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
 import time
+import os
+from collections import OrderedDict
 from datetime import datetime
 import json
 try:
@@ -16,9 +18,10 @@ from . import utils
 from . import db
 from .archivebox_interface import archive_url, get_archived_html
 from .http_client import get as http_get
-from . import crypto_asym, merkle
+from . import crypto_asym, merkle, fingerprint, masking, anchor_batch
 
 USER_AGENT = 'LocalSiteWatcher/1.0 (+https://example.org)'
+EXTRACT_CACHE_SIZE = int(os.environ.get('WPS_EXTRACT_CACHE_SIZE', '256'))
 
 def fetch_robots(root_url):
     try:
@@ -75,6 +78,8 @@ class SiteWatcher:
         db.init_db()
         # track last request time per site to respect crawl-delay
         self._last_request_time = {}
+        # raw digest -> (readable text, raw img srcs); identical HTML skips extraction
+        self._extract_cache = OrderedDict()
 
     def _get_site_user_agent(self, site_id):
         conn = db.get_conn()
@@ -140,6 +145,8 @@ class SiteWatcher:
         return site_id
 
     def crawl_site(self, site_row):
+        # accept sqlite3.Row from run_cycle as well as plain dicts
+        site_row = dict(site_row)
         root = site_row['normalized_root']
         site_id = site_row['id']
         # load robots and crawl_delay
@@ -198,9 +205,14 @@ class SiteWatcher:
         conn = db.get_conn()
         cur = conn.cursor()
         rows = cur.execute("SELECT * FROM Pages WHERE site_id=?", (site_id,)).fetchall()
+        # warm cache of each page's latest version validators (no content_text)
+        latest = db.latest_versions_for_site(site_id)
+        # volatile-region mask rules, compiled once per crawl
+        masks = masking.load_site_masks(site_id)
         for row in rows:
             page_id = row['id']
             url = row['url']
+            last_ver = latest.get(page_id)
             # check robots for this specific url
             ua = site_row.get('user_agent') or USER_AGENT
             if parser:
@@ -224,6 +236,7 @@ class SiteWatcher:
             # try to locate HTML inside ArchiveBox output if metadata contains path
             # fallback: fetch live content (less ideal)
             html = ''
+            etag = None
             # if ArchiveBox returned metadata dict, try to read archived HTML
             if isinstance(meta, dict) and meta:
                 try:
@@ -237,9 +250,10 @@ class SiteWatcher:
                 lm = None
                 if last_ver:
                     lm = last_ver.get('archived_at')
-                status, resp_headers, body = http_get(url, headers={'User-Agent': ua}, last_modified=lm, retries=2)
+                status, resp_headers, body = http_get(url, headers={'User-Agent': ua}, etag=last_ver.get('etag') if last_ver else None, last_modified=lm, retries=2)
                 if status == 200 and body:
                     html = body
+                    etag = resp_headers.get('ETag')
                 elif status == 304:
                     # not modified
                     db.mark_page_archived(page_id, archived_at)
@@ -247,18 +261,34 @@ class SiteWatcher:
                 else:
                     logger.info('No archived HTML and live fetch failed for %s, skipping', url)
                     continue
+            # fast path: byte-identical body (under the same mask rules) as last time
+            raw_digest = utils.hash_text(masks.signature + html)
+            if last_ver and row['raw_digest'] == raw_digest:
+                db.mark_page_archived(page_id, archived_at)
+                logger.info('Raw body unchanged for %s', url)
+                continue
             try:
-                text = utils.extract_readable_text(html)
+                text, image_srcs = self._extract(raw_digest, html, masks)
             except Exception as e:
                 logger.exception('Failed to extract readable text for %s: %s', url, e)
                 continue
             h = utils.hash_text(text)
-            images = utils.extract_image_urls(html, url)
-            last_ver = db.latest_page_version(page_id)
+            images = utils.resolve_image_urls(image_srcs, url)
             if last_ver and last_ver['content_hash'] == h:
-                db.mark_page_archived(page_id, archived_at)
+                db.mark_page_archived(page_id, archived_at, raw_digest=raw_digest)
                 logger.info('No meaningful change for %s', url)
                 continue
+            # near-duplicate gate: trivial drift (timestamps, counters, ad slots)
+            # is logged as a minor change and skips the store/sign/anchor path
+            sh = fingerprint.simhash(text)
+            threshold = site_row.get('near_dup_threshold')
+            if last_ver and threshold:
+                sim = fingerprint.similarity(last_ver.get('simhash'), sh)
+                if sim >= threshold:
+                    db.insert_minor_change(site_id, page_id, last_ver['id'], h, sh, sim)
+                    db.mark_page_archived(page_id, archived_at, raw_digest=raw_digest)
+                    logger.info('Minor change for %s (similarity %.3f >= %.3f)', url, sim, threshold)
+                    continue
             # compute content hash chain (prototype: merkle root of previous and current)
             if last_ver:
                 prev_hash = last_ver.get('content_hash') or ''
@@ -271,18 +301,8 @@ class SiteWatcher:
             except Exception:
                 signature = None
             # include archived entry metadata as provenance if available
-            new_vid = db.insert_page_version(site_id, page_id, archived_at, text, h, images, signature=signature, content_hash_chain=chain_root)
-            # anchor the content hash and store witness id (best-effort)
-            try:
-                from .anchor import anchor_hash
-                witness, proof_path = anchor_hash(h)
-                conn2 = db.get_conn()
-                cur2 = conn2.cursor()
-                cur2.execute('UPDATE PageVersions SET witness_tx_id=?, proof_path=?, proof_verified=? WHERE id=?', (witness, proof_path, 0, new_vid))
-                conn2.commit()
-                conn2.close()
-            except Exception:
-                pass
+            blocks = fingerprint.block_hashes(text)
+            new_vid = db.insert_page_version(site_id, page_id, archived_at, text, h, images, signature=signature, content_hash_chain=chain_root, etag=etag, simhash=sh, block_hashes=blocks)
             # try to store archive provenance (best-effort)
             try:
                 if 'archive_entry' in locals() and archive_entry:
@@ -295,18 +315,57 @@ class SiteWatcher:
                 pass
             logger.info('Stored new PageVersion id=%s for page=%s', new_vid, page_id)
             if last_ver:
-                added, removed = utils.compute_diff(last_ver['content_text'], text)
-                old_images = []
-                try:
-                    old_images = json.loads(last_ver['image_urls']) if last_ver['image_urls'] else []
-                except Exception:
-                    old_images = []
-                new_images = [i for i in images if i not in old_images]
-                db.insert_change(last_ver['id'], new_vid, added, removed, new_images)
-            db.mark_page_archived(page_id, archived_at)
+                old_row = db.get_version_blocks(last_ver['id'])
+                added, removed, ranges = self._diff_against(last_ver['id'], old_row['block_hashes'], text, blocks)
+                new_images = []
+                if last_ver['images_digest'] != db.images_digest(images):
+                    try:
+                        old_images = json.loads(old_row['image_urls']) if old_row['image_urls'] else []
+                    except Exception:
+                        old_images = []
+                    new_images = [i for i in images if i not in old_images]
+                db.insert_change(last_ver['id'], new_vid, added, removed, new_images, changed_blocks=ranges)
+            db.mark_page_archived(page_id, archived_at, raw_digest=raw_digest)
             time.sleep(1)
         conn.close()
 
+    def _extract(self, raw_digest, html, masks):
+        """Return (text, image_srcs) for `html`, memoized by its raw digest."""
+        cached = self._extract_cache.get(raw_digest)
+        if cached is not None:
+            self._extract_cache.move_to_end(raw_digest)
+            return cached
+        text = masks.apply_text(utils.extract_readable_text(masks.apply_html(html)))
+        result = (text, utils.extract_image_srcs(html))
+        self._extract_cache[raw_digest] = result
+        while len(self._extract_cache) > EXTRACT_CACHE_SIZE:
+            self._extract_cache.popitem(last=False)
+        return result
+
+    def _diff_against(self, old_vid, old_blocks, text, blocks):
+        """Return (added, removed, changed_block_ranges) for `text` against version `old_vid`.
+
+        Block fingerprints localize the change; the old full text is loaded
+        only when blocks were removed (or the old version predates block
+        fingerprints).
+        """
+        if old_blocks is None:
+            old_text = db.get_page_version(old_vid)['content_text'] or ''
+            added, removed = utils.compute_diff(old_text, text)
+            return added, removed, None
+        ranges = fingerprint.changed_blocks(old_blocks, blocks)
+        new_lines = fingerprint.text_blocks(text)
+        old_lines = None
+        if any(r['old_count'] for r in ranges):
+            old_lines = fingerprint.text_blocks(db.get_page_version(old_vid)['content_text'])
+        added, removed = [], []
+        for r in ranges:
+            if r['new_count']:
+                added.extend(new_lines[r['new_start']:r['new_start'] + r['new_count']])
+            if r['old_count']:
+                removed.extend(old_lines[r['old_start']:r['old_start'] + r['old_count']])
+        return '\n'.join(added), '\n'.join(removed), ranges
+
     def run_cycle(self):
         conn = db.get_conn()
         cur = conn.cursor()
@@ -320,6 +379,19 @@ class SiteWatcher:
                 cur.execute("UPDATE Sites SET status='error' WHERE id=?", (s['id'],))
                 conn.commit()
         conn.close()
+        self.flush_anchors()
+
+    def flush_anchors(self):
+        """Queue every version not yet batched or anchored; return the new batch ids.
+
+        Pending versions are read back from PageVersions, so a crash mid-cycle
+        or a failed flush only delays them to the next cycle.
+        """
+        try:
+            return anchor_batch.enqueue_pending()
+        except Exception as e:
+            logger.exception('Failed to queue versions for anchoring (retried next cycle): %s', e)
+            return []
 
     def _maybe_sleep(self, site_id, crawl_delay):
         """Ensure we respect per-site crawl_delay by sleeping if needed."""
@@ -2,10 +2,16 @@
 
 If a KMS provider is available via `src/keys_kms.get_provider()`, use it
 for sign/verify operations; otherwise fall back to local Ed25519 keys via
-PyNaCl or a file-backed HMAC fallback.
+PyNaCl or a file-backed HMAC fallback. The provider and keys are loaded once
+per process by `get_signer()`.
 """
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, List, Optional
+import hashlib
+import hmac
 import os
+import threading
 try:
     from nacl.signing import SigningKey, VerifyKey
     from nacl.encoding import HexEncoder
@@ -16,6 +22,7 @@ except Exception:
 KEY_DIR = Path(os.environ.get('WPS_KEY_DIR', 'keys'))
 SK_PATH = KEY_DIR / 'ed25519_sk.hex'
 VK_PATH = KEY_DIR / 'ed25519_vk.hex'
+KMS_SIGN_CONCURRENCY = int(os.environ.get('WPS_KMS_SIGN_CONCURRENCY', '8'))
 
 
 def ensure_keypair():
@@ -40,14 +47,7 @@ def ensure_keypair():
 
 def get_public_key_bytes(key_id: str = None) -> bytes:
     """Return public key bytes for local keypair. If KMS provider is used, this should be adapted to request public key from provider."""
-    if _HAS_LIBSODIUM:
-        sk, vk = ensure_keypair()
-        return vk.encode()
-    else:
-        # fallback: return a deterministic value derived from HMAC key
-        kp = ensure_keypair()
-        import hashlib
-        return hashlib.sha256(kp).digest()
+    return get_signer().public_key_bytes()
 
 
 def verify_with_public_key(data: bytes, sig_hex: str, pub_bytes: bytes) -> bool:
@@ -72,6 +72,26 @@ def verify_with_public_key(data: bytes, sig_hex: str, pub_bytes: bytes) -> bool:
             return False
 
 
+def public_key_verifier(pub_bytes: bytes):
+    """Return verify(data, sig_hex) -> bool bound to one public key.
+
+    Same checks as verify_with_public_key, but the key is parsed once, for
+    callers that verify many signatures from the same signer.
+    """
+    if _HAS_LIBSODIUM:
+        from nacl.signing import VerifyKey
+        vk = VerifyKey(pub_bytes)
+
+        def verify(data: bytes, sig_hex: str) -> bool:
+            try:
+                vk.verify(data, bytes.fromhex(sig_hex))
+                return True
+            except Exception:
+                return False
+        return verify
+    return lambda data, sig_hex: verify_with_public_key(data, sig_hex, pub_bytes)
+
+
 def _get_kms_provider():
     try:
         from .keys_kms import get_provider
@@ -80,53 +100,143 @@ def _get_kms_provider():
         return None
 
 
-def sign_bytes(data: bytes) -> str:
-    # Prefer KMS provider if available
-    provider = _get_kms_provider()
-    key_id = os.environ.get('WPS_KMS_KEY_ID') or os.environ.get('AWS_KMS_KEY_ID')
-    if provider and key_id:
-        try:
-            sig = provider.sign(key_id, data)
-            # provider.sign may return bytes
-            return sig.hex() if isinstance(sig, (bytes, bytearray)) else sig
-        except Exception:
-            pass
-    # local fallback
-    kp = ensure_keypair()
-    if _HAS_LIBSODIUM:
-        sk, vk = kp
-        sig = sk.sign(data).signature
-        return sig.hex()
-    else:
-        # fallback: HMAC-SHA256 hex
-        import hmac, hashlib
-        key = kp
-        return hmac.new(key, data, hashlib.sha256).hexdigest()
+def _sig_hex(sig) -> str:
+    # provider.sign may return bytes
+    return sig.hex() if isinstance(sig, (bytes, bytearray)) else sig
 
 
-def verify_bytes(data: bytes, sig_hex: str) -> bool:
-    # Prefer KMS provider verify if available
-    provider = _get_kms_provider()
-    key_id = os.environ.get('WPS_KMS_KEY_ID') or os.environ.get('AWS_KMS_KEY_ID')
-    if provider and key_id:
-        try:
-            # provider.verify should return True/False
-            return provider.verify(key_id, data, bytes.fromhex(sig_hex) if isinstance(sig_hex, str) else sig_hex)
-        except Exception:
-            pass
-    kp = ensure_keypair()
-    if _HAS_LIBSODIUM:
-        sk, vk = kp
+class Signer:
+    """Signing keys and KMS provider resolved once and reused.
+
+    The provider is looked up only if a key id is configured
+    (WPS_KMS_KEY_ID or AWS_KMS_KEY_ID), and the local keypair is read from
+    disk on first use. Both are then kept for the life of the object. Use
+    get_signer() for the process-wide instance and reset_signer() after
+    rotating keys or changing the KMS environment.
+    """
+
+    def __init__(self, provider=None, key_id: Optional[str] = None):
+        self.provider = provider if key_id else None
+        self.key_id = key_id
+        self._local = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'Signer':
+        key_id = os.environ.get('WPS_KMS_KEY_ID') or os.environ.get('AWS_KMS_KEY_ID')
+        return cls(_get_kms_provider() if key_id else None, key_id)
+
+    def _local_key(self):
+        if self._local is None:
+            with self._lock:
+                if self._local is None:
+                    self._local = ensure_keypair()
+        return self._local
+
+    def _sign_local(self, data: bytes) -> str:
+        kp = self._local_key()
+        if _HAS_LIBSODIUM:
+            sk, vk = kp
+            return sk.sign(data).signature.hex()
+        # fallback: HMAC-SHA256 hex
+        return hmac.new(kp, data, hashlib.sha256).hexdigest()
+
+    def _provider_sign(self, data: bytes):
         try:
-            vk.verify(data, bytes.fromhex(sig_hex))
-            return True
+            return self.provider.sign(self.key_id, data)
         except Exception:
-            return False
-    else:
-        import hmac, hashlib
-        key = kp
-        expected = hmac.new(key, data, hashlib.sha256).hexdigest()
+            return None
+
+    def sign(self, data: bytes) -> str:
+        # Prefer KMS provider if available, local key if it fails
+        if self.provider:
+            sig = self._provider_sign(data)
+            if sig is not None:
+                return _sig_hex(sig)
+        return self._sign_local(data)
+
+    def sign_many(self, items: Iterable[bytes], concurrency: Optional[int] = None) -> List[str]:
+        """Signatures for many messages, in input order.
+
+        With a local key this is a plain loop over the loaded key. A provider
+        that has its own `sign_many(key_id, items)` gets the whole batch in
+        one call. Otherwise `provider.sign` calls are pipelined over
+        `concurrency` threads (WPS_KMS_SIGN_CONCURRENCY). As in `sign`, an
+        item the provider fails on is signed with the local key.
+        """
+        items = list(items)
+        if not self.provider:
+            return [self._sign_local(d) for d in items]
+        sigs = None
+        batch = getattr(self.provider, 'sign_many', None)
+        if batch:
+            try:
+                sigs = list(batch(self.key_id, items))
+            except Exception:
+                sigs = None
+        if sigs is None or len(sigs) != len(items):
+            workers = max(1, concurrency or KMS_SIGN_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=min(workers, max(1, len(items)))) as pool:
+                sigs = list(pool.map(self._provider_sign, items))
+        return [self._sign_local(d) if sig is None else _sig_hex(sig) for d, sig in zip(items, sigs)]
+
+    def verify(self, data: bytes, sig_hex: str) -> bool:
+        # Prefer KMS provider verify if available
+        if self.provider:
+            try:
+                # provider.verify should return True/False
+                return self.provider.verify(self.key_id, data, bytes.fromhex(sig_hex) if isinstance(sig_hex, str) else sig_hex)
+            except Exception:
+                pass
+        kp = self._local_key()
+        if _HAS_LIBSODIUM:
+            sk, vk = kp
+            try:
+                vk.verify(data, bytes.fromhex(sig_hex))
+                return True
+            except Exception:
+                return False
+        expected = hmac.new(kp, data, hashlib.sha256).hexdigest()
         try:
             return hmac.compare_digest(expected, sig_hex)
         except Exception:
             return False
+
+    def public_key_bytes(self) -> bytes:
+        kp = self._local_key()
+        if _HAS_LIBSODIUM:
+            return kp[1].encode()
+        # fallback: return a deterministic value derived from HMAC key
+        return hashlib.sha256(kp).digest()
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer() -> Signer:
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = Signer.from_env()
+    return _signer
+
+
+def reset_signer():
+    """Forget the cached signer; the next call reloads keys and provider."""
+    global _signer
+    with _signer_lock:
+        _signer = None
+
+
+def sign_bytes(data: bytes) -> str:
+    return get_signer().sign(data)
+
+
+def sign_many(items: Iterable[bytes]) -> List[str]:
+    return get_signer().sign_many(items)
+
+
+def verify_bytes(data: bytes, sig_hex: str) -> bool:
+    return get_signer().verify(data, sig_hex)
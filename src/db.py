@@ -1,5 +1,6 @@
 import sqlite3
 import json
+import hashlib
 from pathlib import Path
 from datetime import datetime
 
@@ -14,6 +15,11 @@ def init_db():
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     conn = get_conn()
     cur = conn.cursor()
+    # WAL lets UI readers run concurrently with crawler writes
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+    except Exception:
+        pass
     cur.executescript("""
     PRAGMA foreign_keys=ON;
     CREATE TABLE IF NOT EXISTS Sites (
@@ -185,9 +191,383 @@ def init_db():
             cur.execute("ALTER TABLE PageVersions ADD COLUMN proof_verified INTEGER DEFAULT 0")
         except Exception:
             pass
+    # validators for the crawler's warm latest-version cache
+    if 'etag' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN etag TEXT")
+        except Exception:
+            pass
+    if 'images_digest' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN images_digest TEXT")
+        except Exception:
+            pass
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pv_page_archived ON PageVersions(page_id, archived_at)")
+    except Exception:
+        pass
+    # near-duplicate gate: per-version SimHash and per-site similarity threshold
+    if 'simhash' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN simhash TEXT")
+        except Exception:
+            pass
+    # digest of the last fetched raw body, checked before any extraction
+    page_cols = [r[1] for r in cur.execute("PRAGMA table_info(Pages)").fetchall()]
+    if 'raw_digest' not in page_cols:
+        try:
+            cur.execute("ALTER TABLE Pages ADD COLUMN raw_digest TEXT")
+        except Exception:
+            pass
+    # per-block fingerprints (fingerprint.block_hashes) and changed block ranges
+    if 'block_hashes' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN block_hashes BLOB")
+        except Exception:
+            pass
+    ch_cols = [r[1] for r in cur.execute("PRAGMA table_info(Changes)").fetchall()]
+    if 'changed_blocks' not in ch_cols:
+        try:
+            cur.execute("ALTER TABLE Changes ADD COLUMN changed_blocks TEXT")
+        except Exception:
+            pass
+    if 'near_dup_threshold' not in cols:
+        try:
+            cur.execute("ALTER TABLE Sites ADD COLUMN near_dup_threshold REAL")
+        except Exception:
+            pass
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS MinorChanges (
+            id INTEGER PRIMARY KEY,
+            site_id INTEGER,
+            page_id INTEGER,
+            base_version_id INTEGER,
+            content_hash TEXT,
+            simhash TEXT,
+            similarity REAL,
+            detected_at TEXT,
+            FOREIGN KEY(page_id) REFERENCES Pages(id) ON DELETE CASCADE,
+            FOREIGN KEY(base_version_id) REFERENCES PageVersions(id)
+        );
+        ''')
+    except Exception:
+        pass
+    # per-site volatile-region mask rules (see masking.py)
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS SiteMaskRules (
+            id INTEGER PRIMARY KEY,
+            site_id INTEGER,
+            kind TEXT,
+            pattern TEXT,
+            enabled INTEGER DEFAULT 1,
+            created_at TEXT,
+            FOREIGN KEY(site_id) REFERENCES Sites(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_mask_rules_site ON SiteMaskRules(site_id);
+        ''')
+    except Exception:
+        pass
+    # webhook endpoints and the transactional outbox drained by workers/webhook_dispatcher.py
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS WebhookEndpoints (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            site_id INTEGER,
+            secret TEXT,
+            max_concurrency INTEGER DEFAULT 2,
+            enabled INTEGER DEFAULT 1,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS WebhookOutbox (
+            id INTEGER PRIMARY KEY,
+            endpoint_id INTEGER NOT NULL,
+            change_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            created_at TEXT,
+            delivered_at TEXT,
+            FOREIGN KEY(endpoint_id) REFERENCES WebhookEndpoints(id) ON DELETE CASCADE,
+            FOREIGN KEY(change_id) REFERENCES Changes(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON WebhookOutbox(status, next_attempt_at);
+        ''')
+    except Exception:
+        pass
+    # delta ordering checks read MAX(sequence)/MAX(lamport) per site on every push/apply;
+    # incremental pulls page by (site_id, sequence) and resolve since_root via new_root
+    md_cols = [r[1] for r in cur.execute("PRAGMA table_info(MerkleDeltas)").fetchall()]
+    if 'new_root' not in md_cols:
+        try:
+            cur.execute("ALTER TABLE MerkleDeltas ADD COLUMN new_root TEXT")
+            cur.execute("UPDATE MerkleDeltas SET new_root=json_extract(delta_json, '$.new_root')")
+        except Exception:
+            pass
+    try:
+        cur.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_merkle_deltas_site_seq ON MerkleDeltas(site_id, sequence);
+        CREATE INDEX IF NOT EXISTS idx_merkle_deltas_site_lamport ON MerkleDeltas(site_id, lamport);
+        CREATE INDEX IF NOT EXISTS idx_merkle_deltas_site_root ON MerkleDeltas(site_id, new_root);
+        ''')
+    except Exception:
+        pass
+    # normalized forest storage: MerkleForest rows become small root snapshots
+    mf_cols = [r[1] for r in cur.execute("PRAGMA table_info(MerkleForest)").fetchall()]
+    if 'node_count' not in mf_cols:
+        try:
+            cur.execute("ALTER TABLE MerkleForest ADD COLUMN node_count INTEGER")
+        except Exception:
+            pass
+    kn_cols = [r[1] for r in cur.execute("PRAGMA table_info(KnowledgeNodes)").fetchall()]
+    if 'meta' not in kn_cols:
+        try:
+            cur.execute("ALTER TABLE KnowledgeNodes ADD COLUMN meta TEXT")
+        except Exception:
+            pass
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_merkle_forest_site ON MerkleForest(site_id, last_updated)")
+    except Exception:
+        pass
+    # per-site hash tree over node-hash prefixes (see prefix_tree.py)
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS ForestLeaves (
+            site_id INTEGER NOT NULL,
+            node_hash TEXT NOT NULL,
+            PRIMARY KEY(site_id, node_hash)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ForestPrefixes (
+            site_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            prefix TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            digest BLOB NOT NULL,
+            PRIMARY KEY(site_id, depth, prefix)
+        ) WITHOUT ROWID;
+        ''')
+    except Exception:
+        pass
+    # per-cycle anchoring: one anchored Merkle root per batch, each version's
+    # leaf index and sibling path under it (see anchor_batch.py), and the queue
+    # drained by workers/anchor_worker.py
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS AnchorBatches (
+            id INTEGER PRIMARY KEY,
+            root TEXT NOT NULL,
+            leaf_count INTEGER,
+            witness_tx_id TEXT,
+            proof_path TEXT,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS AnchorQueue (
+            id INTEGER PRIMARY KEY,
+            batch_id INTEGER NOT NULL UNIQUE,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            created_at TEXT,
+            anchored_at TEXT,
+            FOREIGN KEY(batch_id) REFERENCES AnchorBatches(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_anchor_queue_due ON AnchorQueue(status, next_attempt_at);
+        ''')
+    except Exception:
+        pass
+    for col, decl in (('anchor_batch_id', 'INTEGER'), ('anchor_leaf_index', 'INTEGER'), ('anchor_proof', 'TEXT')):
+        if col not in pv_cols:
+            try:
+                cur.execute(f"ALTER TABLE PageVersions ADD COLUMN {col} {decl}")
+            except Exception:
+                pass
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pv_anchor_batch ON PageVersions(anchor_batch_id)")
+    except Exception:
+        pass
+    # versions still waiting for an anchor batch (anchor_batch.enqueue_pending)
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pv_unanchored ON PageVersions(id) WHERE anchor_batch_id IS NULL AND witness_tx_id IS NULL")
+    except Exception:
+        pass
+    # append-only proof/anchor record segments and their offset index (see segment_store.py)
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS Segments (
+            id INTEGER PRIMARY KEY,
+            size INTEGER DEFAULT 0,
+            live_bytes INTEGER DEFAULT 0,
+            sealed INTEGER DEFAULT 0,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS SegmentRecords (
+            key TEXT PRIMARY KEY,
+            kind TEXT,
+            segment_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            crc INTEGER NOT NULL,
+            created_at TEXT
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_segment_records_segment ON SegmentRecords(segment_id, offset);
+        ''')
+    except Exception:
+        pass
+    # proof upgrader backoff (see workers/proof_upgrader.py)
+    if 'next_check_at' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN next_check_at TEXT")
+        except Exception:
+            pass
+    if 'proof_attempts' not in pv_cols:
+        try:
+            cur.execute("ALTER TABLE PageVersions ADD COLUMN proof_attempts INTEGER DEFAULT 0")
+        except Exception:
+            pass
+    try:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pv_proof_due ON PageVersions(proof_verified, next_check_at)")
+    except Exception:
+        pass
+    # monotonically increasing write counters used to invalidate read caches
+    try:
+        cur.executescript('''
+        CREATE TABLE IF NOT EXISTS Watermarks (
+            name TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        );
+        ''')
+    except Exception:
+        pass
+    # trigger-maintained counters so index/status/metrics views avoid COUNT(*) scans
+    stats_existed = cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='GlobalStats'").fetchone() is not None
+    try:
+        cur.executescript(STATS_SCHEMA)
+    except Exception:
+        pass
+    if not stats_existed:
+        rebuild_stats(cur)
     conn.commit()
     conn.close()
 
+
+STATS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS SiteStats (
+    site_id INTEGER PRIMARY KEY,
+    page_count INTEGER DEFAULT 0,
+    version_count INTEGER DEFAULT 0,
+    change_count INTEGER DEFAULT 0,
+    last_version_at TEXT
+);
+CREATE TABLE IF NOT EXISTS PageStats (
+    page_id INTEGER PRIMARY KEY,
+    version_count INTEGER DEFAULT 0,
+    last_version_at TEXT
+);
+CREATE TABLE IF NOT EXISTS GlobalStats (
+    name TEXT PRIMARY KEY,
+    value INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_pages_site ON Pages(site_id);
+
+CREATE TRIGGER IF NOT EXISTS trg_sites_ins AFTER INSERT ON Sites BEGIN
+    INSERT OR IGNORE INTO SiteStats (site_id) VALUES (NEW.id);
+    UPDATE GlobalStats SET value=value+1 WHERE name='sites';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sites_del AFTER DELETE ON Sites BEGIN
+    DELETE FROM SiteStats WHERE site_id=OLD.id;
+    UPDATE GlobalStats SET value=value-1 WHERE name='sites';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_pages_ins AFTER INSERT ON Pages BEGIN
+    INSERT INTO SiteStats (site_id, page_count) VALUES (NEW.site_id, 1)
+        ON CONFLICT(site_id) DO UPDATE SET page_count=page_count+1;
+    INSERT OR IGNORE INTO PageStats (page_id) VALUES (NEW.id);
+    UPDATE GlobalStats SET value=value+1 WHERE name='pages';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_pages_del AFTER DELETE ON Pages BEGIN
+    UPDATE SiteStats SET page_count=page_count-1 WHERE site_id=OLD.site_id;
+    DELETE FROM PageStats WHERE page_id=OLD.id;
+    UPDATE GlobalStats SET value=value-1 WHERE name='pages';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_page_versions_ins AFTER INSERT ON PageVersions BEGIN
+    INSERT INTO SiteStats (site_id, version_count, last_version_at) VALUES (NEW.site_id, 1, NEW.archived_at)
+        ON CONFLICT(site_id) DO UPDATE SET version_count=version_count+1,
+            last_version_at=MAX(COALESCE(last_version_at, excluded.last_version_at), COALESCE(excluded.last_version_at, last_version_at));
+    INSERT INTO PageStats (page_id, version_count, last_version_at) VALUES (NEW.page_id, 1, NEW.archived_at)
+        ON CONFLICT(page_id) DO UPDATE SET version_count=version_count+1,
+            last_version_at=MAX(COALESCE(last_version_at, excluded.last_version_at), COALESCE(excluded.last_version_at, last_version_at));
+    UPDATE GlobalStats SET value=value+1 WHERE name='page_versions';
+END;
+-- recreated on every init_db so databases with the older definition pick up this one
+DROP TRIGGER IF EXISTS trg_page_versions_del;
+CREATE TRIGGER trg_page_versions_del AFTER DELETE ON PageVersions BEGIN
+    -- last_version_at is only recomputed when the newest version goes: the page
+    -- via idx_pv_page_archived, then the site from its pages' PageStats
+    UPDATE PageStats SET version_count=version_count-1,
+            last_version_at=CASE WHEN last_version_at=OLD.archived_at
+                THEN (SELECT MAX(archived_at) FROM PageVersions WHERE page_id=OLD.page_id) ELSE last_version_at END
+        WHERE page_id=OLD.page_id;
+    UPDATE SiteStats SET version_count=version_count-1,
+            last_version_at=CASE WHEN last_version_at=OLD.archived_at
+                THEN (SELECT MAX(ps.last_version_at) FROM PageStats ps JOIN Pages p ON p.id=ps.page_id WHERE p.site_id=OLD.site_id)
+                ELSE last_version_at END
+        WHERE site_id=OLD.site_id;
+    UPDATE GlobalStats SET value=value-1 WHERE name='page_versions';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_changes_ins AFTER INSERT ON Changes BEGIN
+    UPDATE SiteStats SET change_count=change_count+1
+        WHERE site_id=(SELECT site_id FROM PageVersions WHERE id=NEW.page_version_new_id);
+    UPDATE GlobalStats SET value=value+1 WHERE name='changes';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_changes_del AFTER DELETE ON Changes BEGIN
+    UPDATE SiteStats SET change_count=change_count-1
+        WHERE site_id=(SELECT site_id FROM PageVersions WHERE id=OLD.page_version_new_id);
+    UPDATE GlobalStats SET value=value-1 WHERE name='changes';
+END;
+'''
+
+
+def rebuild_stats(cur=None):
+    """Recompute the stats tables from scratch (first migration or repair)."""
+    own = cur is None
+    if own:
+        conn = get_conn()
+        cur = conn.cursor()
+    cur.execute("DELETE FROM SiteStats")
+    cur.execute("DELETE FROM PageStats")
+    cur.execute("DELETE FROM GlobalStats")
+    cur.execute("INSERT INTO SiteStats (site_id) SELECT id FROM Sites")
+    cur.execute("UPDATE SiteStats SET page_count=(SELECT COUNT(*) FROM Pages p WHERE p.site_id=SiteStats.site_id)")
+    cur.execute("UPDATE SiteStats SET version_count=(SELECT COUNT(*) FROM PageVersions pv WHERE pv.site_id=SiteStats.site_id), last_version_at=(SELECT MAX(archived_at) FROM PageVersions pv WHERE pv.site_id=SiteStats.site_id)")
+    cur.execute("UPDATE SiteStats SET change_count=(SELECT COUNT(*) FROM Changes c JOIN PageVersions pv ON pv.id=c.page_version_new_id WHERE pv.site_id=SiteStats.site_id)")
+    cur.execute("INSERT INTO PageStats (page_id, version_count, last_version_at) SELECT p.id, COUNT(pv.id), MAX(pv.archived_at) FROM Pages p LEFT JOIN PageVersions pv ON pv.page_id=p.id GROUP BY p.id")
+    for name, table in (('sites', 'Sites'), ('pages', 'Pages'), ('page_versions', 'PageVersions'), ('changes', 'Changes')):
+        cur.execute(f"INSERT INTO GlobalStats (name, value) SELECT ?, COUNT(*) FROM {table}", (name,))
+    if own:
+        conn.commit()
+        conn.close()
+
+
+def global_stats():
+    """Return {'sites', 'pages', 'page_versions', 'changes'} totals in O(1)."""
+    conn = get_conn()
+    rows = conn.execute("SELECT name, value FROM GlobalStats").fetchall()
+    conn.close()
+    out = {'sites': 0, 'pages': 0, 'page_versions': 0, 'changes': 0}
+    out.update({r['name']: r['value'] for r in rows})
+    return out
+
+
+def site_stats():
+    """Return one row per site joined with its materialized counters."""
+    conn = get_conn()
+    rows = conn.execute("SELECT s.id, s.normalized_root, s.last_crawled, s.status, COALESCE(st.page_count, 0) as page_count, COALESCE(st.version_count, 0) as version_count, COALESCE(st.change_count, 0) as change_count, st.last_version_at FROM Sites s LEFT JOIN SiteStats st ON st.site_id=s.id ORDER BY s.id").fetchall()
+    conn.close()
+    return rows
+
 def add_site(root_url, normalized_root, user_agent=None):
     conn = get_conn()
     cur = conn.cursor()
@@ -211,19 +591,26 @@ def upsert_page(site_id, url, normalized_url):
     conn.close()
     return row[0]
 
-def mark_page_archived(page_id, archived_at):
+def mark_page_archived(page_id, archived_at, raw_digest=None):
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("UPDATE Pages SET last_archived=?, status='archived' WHERE id=?", (archived_at, page_id))
+    if raw_digest:
+        cur.execute("UPDATE Pages SET last_archived=?, status='archived', raw_digest=? WHERE id=?", (archived_at, raw_digest, page_id))
+    else:
+        cur.execute("UPDATE Pages SET last_archived=?, status='archived' WHERE id=?", (archived_at, page_id))
     conn.commit()
     conn.close()
 
-def insert_page_version(site_id, page_id, archived_at, content_text, content_hash, image_urls, signature=None, content_hash_chain=None, witness_tx_id=None, proof_path=None, proof_verified=0):
+def images_digest(image_urls):
+    return hashlib.sha256(json.dumps(image_urls or []).encode('utf-8')).hexdigest()
+
+
+def insert_page_version(site_id, page_id, archived_at, content_text, content_hash, image_urls, signature=None, content_hash_chain=None, witness_tx_id=None, proof_path=None, proof_verified=0, etag=None, simhash=None, block_hashes=None):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO PageVersions (site_id, page_id, archived_at, content_text, content_hash, archive_source, signature, content_hash_chain, image_urls, witness_tx_id, proof_path, proof_verified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (site_id, page_id, archived_at, content_text, content_hash, None, signature, content_hash_chain, json.dumps(image_urls), witness_tx_id, proof_path, proof_verified))
+        "INSERT INTO PageVersions (site_id, page_id, archived_at, content_text, content_hash, archive_source, signature, content_hash_chain, image_urls, witness_tx_id, proof_path, proof_verified, etag, images_digest, simhash, block_hashes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (site_id, page_id, archived_at, content_text, content_hash, None, signature, content_hash_chain, json.dumps(image_urls), witness_tx_id, proof_path, proof_verified, etag, images_digest(image_urls), simhash, block_hashes))
     conn.commit()
     vid = cur.lastrowid
     # also insert into FTS index if available
@@ -232,10 +619,38 @@ def insert_page_version(site_id, page_id, archived_at, content_text, content_has
         conn.commit()
     except Exception:
         pass
+    bump_watermark(cur, 'page_versions')
+    conn.commit()
     conn.close()
     return vid
 
 
+# count of watermark bumps made by this process; lets in-process caches notice
+# local writes without a DB round-trip
+LOCAL_WATERMARK_BUMPS = 0
+
+
+def bump_watermark(cur, name):
+    """Increment the named watermark inside the caller's transaction."""
+    global LOCAL_WATERMARK_BUMPS
+    try:
+        cur.execute("INSERT INTO Watermarks (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value=value+1", (name,))
+    except sqlite3.OperationalError:
+        # table missing on a DB that has not been migrated yet
+        pass
+    LOCAL_WATERMARK_BUMPS += 1
+
+
+def get_watermark(name):
+    conn = get_conn()
+    try:
+        row = conn.execute("SELECT value FROM Watermarks WHERE name=?", (name,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    conn.close()
+    return row[0] if row else 0
+
+
 def search_page_versions(query_text, limit=10):
     conn = get_conn()
     cur = conn.cursor()
@@ -252,6 +667,92 @@ def search_page_versions(query_text, limit=10):
         conn.close()
         return rows
 
+SEARCH_ESTIMATE_CAP = 1000
+
+
+def _search_clauses(query_text, site_id=None, date_from=None, date_to=None, fts=True):
+    """Build the FROM/WHERE part shared by the search page, count and facet queries."""
+    if fts:
+        sql = "FROM PageVersionsFTS WHERE PageVersionsFTS MATCH ?"
+        params = [query_text]
+    else:
+        sql = "FROM PageVersions WHERE content_text LIKE ?"
+        params = [f'%{query_text}%']
+    if site_id is not None:
+        sql += " AND site_id = ?"
+        params.append(int(site_id))
+    if date_from:
+        sql += " AND archived_at >= ?"
+        params.append(date_from)
+    if date_to:
+        sql += " AND archived_at < ?"
+        params.append(date_to)
+    return sql, params
+
+
+def _search_pass(cur, query_text, site_id, date_from, date_to, page, per_page, exact_total, facets, fts):
+    where, params = _search_clauses(query_text, site_id, date_from, date_to, fts=fts)
+    offset = (page - 1) * per_page
+    if fts:
+        q = "SELECT page_version_id, content_hash, site_id, archived_at, snippet(PageVersionsFTS, 0, '<b>', '</b>', '...', 10) as snippet " + where + " ORDER BY bm25(PageVersionsFTS), rowid LIMIT ? OFFSET ?"
+    else:
+        q = "SELECT id as page_version_id, content_hash, site_id, archived_at, substr(content_text, 1, 200) as snippet " + where + " ORDER BY id LIMIT ? OFFSET ?"
+    rows = cur.execute(q, params + [per_page, offset]).fetchall()
+    if exact_total:
+        total = cur.execute("SELECT COUNT(*) " + where, params).fetchone()[0]
+        estimated = False
+    else:
+        # count at most SEARCH_ESTIMATE_CAP matches; a capped total is a lower bound
+        total = cur.execute("SELECT COUNT(*) FROM (SELECT 1 " + where + " LIMIT ?)", params + [SEARCH_ESTIMATE_CAP]).fetchone()[0]
+        estimated = total >= SEARCH_ESTIMATE_CAP
+        total = max(total, offset + len(rows))
+    site_facets = {}
+    date_facets = {}
+    if facets:
+        for r in cur.execute("SELECT site_id, COUNT(*) as c " + where + " GROUP BY site_id ORDER BY c DESC", params).fetchall():
+            site_facets[r['site_id']] = r['c']
+        for r in cur.execute("SELECT COALESCE(substr(archived_at, 1, 7), 'unknown') as ym, COUNT(*) as c " + where + " GROUP BY ym ORDER BY ym DESC", params).fetchall():
+            date_facets[r['ym']] = r['c']
+    return {
+        'results': [dict(r) for r in rows],
+        'total': total,
+        'total_estimated': estimated,
+        'page': page,
+        'per_page': per_page,
+        'site_facets': site_facets,
+        'date_facets': date_facets,
+    }
+
+
+def search_page_versions_paged(query_text, site_id=None, date_from=None, date_to=None, page=1, per_page=10, exact_total=True, facets=True, conn=None):
+    """Search PageVersions with filters, pagination, totals and facets computed in SQL.
+
+    `date_from` is inclusive and `date_to` exclusive; both compare against the
+    ISO `archived_at` string so prefixes like '2025-11' work. With
+    `exact_total=False` matches are only counted up to SEARCH_ESTIMATE_CAP and
+    `total_estimated` is set when the cap was hit. Facet counts are GROUP BY
+    aggregates over the whole filtered match set, not just the returned page.
+    A caller-supplied `conn` (e.g. one from query_guard) is used and left open.
+    """
+    page = max(int(page or 1), 1)
+    per_page = max(int(per_page or 10), 1)
+    own = conn is None
+    if own:
+        conn = get_conn()
+    cur = conn.cursor()
+    try:
+        try:
+            return _search_pass(cur, query_text, site_id, date_from, date_to, page, per_page, exact_total, facets, fts=True)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                # aborted by a progress handler; a LIKE scan would cost even more
+                raise
+            # FTS5 unavailable or query syntax rejected: fall back to LIKE
+            return _search_pass(cur, query_text, site_id, date_from, date_to, page, per_page, exact_total, facets, fts=False)
+    finally:
+        if own:
+            conn.close()
+
 def latest_page_version(page_id):
     conn = get_conn()
     cur = conn.cursor()
@@ -259,10 +760,107 @@ def latest_page_version(page_id):
     conn.close()
     return row
 
-def insert_change(old_vid, new_vid, added_text, removed_text, new_image_urls):
+def latest_versions_for_site(site_id):
+    """Return {page_id: {id, content_hash, etag, images_digest, simhash, archived_at}} for a site.
+
+    One query: each page's latest version is found with a single seek on
+    idx_pv_page_archived and content_text is never read.
+    """
+    conn = get_conn()
+    rows = conn.execute(
+        "SELECT p.id as page_id, pv.id, pv.content_hash, pv.etag, pv.images_digest, pv.simhash, pv.archived_at FROM Pages p "
+        "JOIN PageVersions pv ON pv.id = (SELECT id FROM PageVersions WHERE page_id=p.id ORDER BY archived_at DESC, id DESC LIMIT 1) "
+        "WHERE p.site_id=?", (site_id,)).fetchall()
+    conn.close()
+    return {r['page_id']: {'id': r['id'], 'content_hash': r['content_hash'], 'etag': r['etag'], 'images_digest': r['images_digest'], 'simhash': r['simhash'], 'archived_at': r['archived_at']} for r in rows}
+
+def get_page_version(version_id):
+    conn = get_conn()
+    row = conn.execute("SELECT * FROM PageVersions WHERE id=?", (version_id,)).fetchone()
+    conn.close()
+    return row
+
+def get_version_blocks(version_id):
+    """Return (block_hashes, image_urls) for a version without loading content_text."""
+    conn = get_conn()
+    row = conn.execute("SELECT block_hashes, image_urls FROM PageVersions WHERE id=?", (version_id,)).fetchone()
+    conn.close()
+    return row
+
+def changed_blocks_between(old_vid, new_vid):
+    """Locate changed block ranges between two versions from their fingerprints alone."""
+    from .fingerprint import changed_blocks
+    conn = get_conn()
+    rows = {r['id']: r['block_hashes'] for r in conn.execute("SELECT id, block_hashes FROM PageVersions WHERE id IN (?, ?)", (old_vid, new_vid)).fetchall()}
+    conn.close()
+    return changed_blocks(rows.get(old_vid), rows.get(new_vid))
+
+def insert_change(old_vid, new_vid, added_text, removed_text, new_image_urls, changed_blocks=None):
+    conn = get_conn()
+    cur = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    cur.execute("INSERT INTO Changes (page_version_old_id, page_version_new_id, added_text, removed_text, new_image_urls, detected_at, changed_blocks) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (old_vid, new_vid, added_text, removed_text, json.dumps(new_image_urls), now, json.dumps(changed_blocks) if changed_blocks is not None else None))
+    cid = cur.lastrowid
+    # outbox rows commit atomically with the change, so a crash can never drop a notification
+    cur.execute("INSERT INTO WebhookOutbox (endpoint_id, change_id, status, attempts, next_attempt_at, created_at) "
+                "SELECT e.id, ?, 'pending', 0, ?, ? FROM WebhookEndpoints e WHERE e.enabled=1 "
+                "AND (e.site_id IS NULL OR e.site_id=(SELECT site_id FROM PageVersions WHERE id=?))",
+                (cid, now, now, new_vid))
+    conn.commit()
+    conn.close()
+    # push to SSE subscribers in this process (no-op when nobody is listening)
+    try:
+        from .change_bus import notify_change
+        notify_change(cid)
+    except Exception:
+        pass
+    return cid
+
+def max_change_id():
+    conn = get_conn()
+    row = conn.execute("SELECT MAX(id) FROM Changes").fetchone()
+    conn.close()
+    return row[0] or 0
+
+CHANGE_EVENT_SELECT = ("SELECT c.id, pv.site_id, pv.page_id, p.url, c.page_version_old_id, c.page_version_new_id, c.detected_at, c.changed_blocks "
+                       "FROM Changes c JOIN PageVersions pv ON pv.id=c.page_version_new_id LEFT JOIN Pages p ON p.id=pv.page_id")
+
+def _change_events(rows):
+    out = []
+    for r in rows:
+        ev = dict(r)
+        ev['changed_blocks'] = json.loads(ev['changed_blocks']) if ev['changed_blocks'] else None
+        out.append(ev)
+    return out
+
+def changes_since(after_id, site_id=None, limit=500):
+    """Return change events with id > after_id in id order (PK range scan)."""
+    q = CHANGE_EVENT_SELECT + " WHERE c.id > ?"
+    params = [after_id]
+    if site_id is not None:
+        q += " AND pv.site_id = ?"
+        params.append(site_id)
+    q += " ORDER BY c.id LIMIT ?"
+    params.append(limit)
+    conn = get_conn()
+    rows = conn.execute(q, params).fetchall()
+    conn.close()
+    return _change_events(rows)
+
+def changes_by_ids(ids):
+    if not ids:
+        return []
+    conn = get_conn()
+    rows = conn.execute(CHANGE_EVENT_SELECT + " WHERE c.id IN (%s) ORDER BY c.id" % ','.join('?' * len(ids)), list(ids)).fetchall()
+    conn.close()
+    return _change_events(rows)
+
+def insert_minor_change(site_id, page_id, base_version_id, content_hash, simhash, similarity):
+    """Record a near-duplicate fetch that was not stored as a new PageVersion."""
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("INSERT INTO Changes (page_version_old_id, page_version_new_id, added_text, removed_text, new_image_urls, detected_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (old_vid, new_vid, added_text, removed_text, json.dumps(new_image_urls), datetime.utcnow().isoformat()))
+    cur.execute("INSERT INTO MinorChanges (site_id, page_id, base_version_id, content_hash, simhash, similarity, detected_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (site_id, page_id, base_version_id, content_hash, simhash, similarity, datetime.utcnow().isoformat()))
     conn.commit()
     conn.close()
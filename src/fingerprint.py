@@ -0,0 +1,77 @@
+"""Content fingerprints.
+
+`simhash(text)` returns a 64-bit SimHash (hex) over word 3-gram shingles; two
+texts that differ only in a timestamp, counter or ad slot land a few bits
+apart, so `similarity(a, b)` (1 - hamming/64) stays close to 1.0 where the
+exact SHA-256 in `utils.hash_text` would already differ.
+
+`block_hashes(text)` packs one 8-byte hash per block (a line of extracted
+text, i.e. roughly one paragraph or heading) into a compact blob, and
+`changed_blocks(old, new)` compares two blobs to locate the changed block
+ranges without touching the texts themselves.
+"""
+import hashlib
+import re
+import struct
+from typing import List, Optional
+from .line_diff import diff_lines
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _shingles(text: str):
+    words = _WORD.findall((text or '').lower())
+    if len(words) < SHINGLE_SIZE:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def simhash(text: str) -> str:
+    feats = _shingles(text)
+    if not feats:
+        return '0' * (SIMHASH_BITS // 4)
+    # one 64-char bit string per feature; column b of the concatenation is
+    # bit (63 - b) of every feature hash, so each column can be counted in C
+    bits = ''.join(format(int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'big'), '064b') for f in feats)
+    half = len(feats) / 2.0
+    out = 0
+    for b in range(SIMHASH_BITS):
+        out = (out << 1) | (1 if bits[b::SIMHASH_BITS].count('1') > half else 0)
+    return format(out, '016x')
+
+
+def hamming(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def similarity(a: Optional[str], b: Optional[str]) -> float:
+    """1.0 for identical fingerprints, 0.0 if either is missing or all bits differ."""
+    if not a or not b:
+        return 0.0
+    return 1.0 - hamming(a, b) / float(SIMHASH_BITS)
+
+
+BLOCK_HASH_SIZE = 8
+
+
+def text_blocks(text: str) -> List[str]:
+    # extracted text is one block element per line (see utils.extract_readable_text)
+    return (text or '').splitlines()
+
+
+def block_hashes(text: str) -> bytes:
+    return b''.join(hashlib.blake2b(b.encode('utf-8'), digest_size=BLOCK_HASH_SIZE).digest() for b in text_blocks(text))
+
+
+def unpack_blocks(blob: Optional[bytes]) -> List[int]:
+    if not blob:
+        return []
+    return [v for (v,) in struct.iter_unpack('>Q', blob)]
+
+
+def changed_blocks(old_blob: Optional[bytes], new_blob: Optional[bytes]) -> List[dict]:
+    """Return line_diff-style hunks over block indices (no `removed`/`added` text)."""
+    hunks = diff_lines(unpack_blocks(old_blob), unpack_blocks(new_blob))['hunks']
+    return [{k: h[k] for k in ('old_start', 'old_count', 'new_start', 'new_count')} for h in hunks]
@@ -0,0 +1,154 @@
+"""Line diff engine used for change detection.
+
+Lines are interned to small integers so comparisons are O(1), the common
+prefix and suffix are trimmed, and the remaining middle is diffed with Myers'
+O(ND) algorithm. When the trimmed inputs are too large, or the edit distance
+exceeds the budget, the engine falls back to a multiset difference that still
+reports which lines were added and removed, but not how they align.
+
+`diff_lines` returns {'mode': 'myers'|'set', 'hunks': [...]}; each hunk is a
+dict with 0-based `old_start`/`new_start`, `old_count`/`new_count` and the
+`removed`/`added` lines. In set mode a hunk touches only one side and the
+other side's start is None.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+MAX_DIFF_LINES = 500_000
+# upper bound on (n + m) * d work before giving up on an aligned diff
+MAX_DIFF_COST = 20_000_000
+MIN_EDIT_BUDGET = 64
+
+
+def _intern(old_lines: List[str], new_lines: List[str]) -> Tuple[List[int], List[int]]:
+    ids: Dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in old_lines]
+    b = [ids.setdefault(line, len(ids)) for line in new_lines]
+    return a, b
+
+
+def _myers(a: List[int], b: List[int], max_d: int) -> Optional[List[Tuple[str, int, int]]]:
+    """Return edit ops ('-', i, j) / ('+', i, j) in order, or None if d > max_d."""
+    n, m = len(a), len(b)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace, x: int, y: int) -> List[Tuple[str, int, int]]:
+    ops = []
+    for d in range(len(trace) - 1, 0, -1):
+        vd = trace[d]
+        base = d + 1  # vd[base + k] is V[k] for -d-1 <= k <= d+1
+        k = x - y
+        if k == -d or (k != d and vd[base + k - 1] < vd[base + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = vd[base + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+        if x == prev_x:
+            ops.append(('+', prev_x, prev_y))
+        else:
+            ops.append(('-', prev_x, prev_y))
+        x, y = prev_x, prev_y
+    ops.reverse()
+    return ops
+
+
+def _hunks_from_ops(ops, old_lines, new_lines, base: int) -> List[dict]:
+    hunks = []
+    cur = None
+    for op, i, j in ops:
+        contiguous = cur is not None and i == cur['old_start'] - base + cur['old_count'] and j == cur['new_start'] - base + cur['new_count']
+        if not contiguous:
+            cur = {'old_start': i + base, 'old_count': 0, 'new_start': j + base, 'new_count': 0, 'removed': [], 'added': []}
+            hunks.append(cur)
+        if op == '-':
+            cur['old_count'] += 1
+            cur['removed'].append(old_lines[i])
+        else:
+            cur['new_count'] += 1
+            cur['added'].append(new_lines[j])
+    return hunks
+
+
+def _runs(indices: List[int]) -> List[Tuple[int, int]]:
+    runs = []
+    for i in indices:
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1][1] += 1
+        else:
+            runs.append([i, 1])
+    return [(s, c) for s, c in runs]
+
+
+def _set_diff(old_lines: List[str], new_lines: List[str], base: int) -> List[dict]:
+    """Multiset difference: lines whose count dropped are removed, rose are added."""
+    old_c, new_c = Counter(old_lines), Counter(new_lines)
+    removed_budget = old_c - new_c
+    added_budget = new_c - old_c
+    rem_idx, add_idx = [], []
+    for i, line in enumerate(old_lines):
+        if removed_budget.get(line):
+            removed_budget[line] -= 1
+            rem_idx.append(i)
+    for j, line in enumerate(new_lines):
+        if added_budget.get(line):
+            added_budget[line] -= 1
+            add_idx.append(j)
+    hunks = []
+    for s, c in _runs(rem_idx):
+        hunks.append({'old_start': s + base, 'old_count': c, 'new_start': None, 'new_count': 0, 'removed': old_lines[s:s + c], 'added': []})
+    for s, c in _runs(add_idx):
+        hunks.append({'old_start': None, 'old_count': 0, 'new_start': s + base, 'new_count': c, 'removed': [], 'added': new_lines[s:s + c]})
+    return hunks
+
+
+def diff_lines(old_lines: List[str], new_lines: List[str], max_lines: int = MAX_DIFF_LINES, max_cost: int = MAX_DIFF_COST) -> dict:
+    # trim common prefix / suffix; most page edits are local
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    old_mid = old_lines[prefix:len(old_lines) - suffix]
+    new_mid = new_lines[prefix:len(new_lines) - suffix]
+    if not old_mid and not new_mid:
+        return {'mode': 'myers', 'hunks': []}
+    total = len(old_mid) + len(new_mid)
+    if total <= max_lines:
+        if not old_mid or not new_mid:
+            ops = [('-', i, 0) for i in range(len(old_mid))] + [('+', 0, j) for j in range(len(new_mid))]
+            return {'mode': 'myers', 'hunks': _hunks_from_ops(ops, old_mid, new_mid, prefix)}
+        a, b = _intern(old_mid, new_mid)
+        max_d = min(total, max(MIN_EDIT_BUDGET, max_cost // total))
+        ops = _myers(a, b, max_d)
+        if ops is not None:
+            return {'mode': 'myers', 'hunks': _hunks_from_ops(ops, old_mid, new_mid, prefix)}
+    return {'mode': 'set', 'hunks': _set_diff(old_mid, new_mid, prefix)}
+
+
+def diff_texts(old_text: str, new_text: str, **kwargs) -> dict:
+    return diff_lines((old_text or '').splitlines(), (new_text or '').splitlines(), **kwargs)
@@ -29,13 +29,52 @@ def main():
     ai = sub.add_parser('archive-index-set')
     ai.add_argument('path')
     runp = sub.add_parser('run')
-    sub.add_parser('proof-worker')
+    segp = sub.add_parser('segments', help='Proof/anchor segment store: stats, compaction, migration of proof files')
+    segp.add_argument('--migrate', action='store_true', help='Move file-backed proof_path values into segments')
+    segp.add_argument('--compact', action='store_true', help='Rewrite segments that are mostly superseded records')
+    segp.add_argument('--min-garbage', type=float, default=0.5)
+    proofw = sub.add_parser('proof-worker', help='Upgrade and verify stored anchor proofs')
+    proofw.add_argument('--interval', type=float, default=3600)
+    proofw.add_argument('--workers', type=int, help='Max proofs checked at once')
+    proofw.add_argument('--once', action='store_true')
     sub.add_parser('status')
     webp = sub.add_parser('web')
     webp.add_argument('--host', default='127.0.0.1')
     webp.add_argument('--port', type=int, default=1212)
     searchp = sub.add_parser('search')
     searchp.add_argument('query')
+    maskp = sub.add_parser('mask-add', help='Add a volatile-region mask rule for a site')
+    maskp.add_argument('site_id', type=int)
+    maskg = maskp.add_mutually_exclusive_group(required=True)
+    maskg.add_argument('--css', help='CSS selector of elements to drop before extraction')
+    maskg.add_argument('--regex', help='Regex removed from extracted text')
+    maskl = sub.add_parser('mask-list')
+    maskl.add_argument('site_id', type=int)
+    maskr = sub.add_parser('mask-report', help='Dry-run: versions each mask rule would have eliminated')
+    maskr.add_argument('site_id', type=int)
+    hookp = sub.add_parser('webhook-add', help='Register an endpoint that receives batched change notifications')
+    hookp.add_argument('url')
+    hookp.add_argument('--site', type=int, help='Only changes for this site id')
+    hookp.add_argument('--secret', help='HMAC-SHA256 signing secret')
+    hookp.add_argument('--concurrency', type=int, default=2, help='Max in-flight POSTs to this endpoint')
+    sub.add_parser('webhook-list')
+    hookw = sub.add_parser('webhook-worker', help='Drain the webhook outbox')
+    hookw.add_argument('--interval', type=float, default=5)
+    hookw.add_argument('--once', action='store_true')
+    hookr = sub.add_parser('webhook-requeue', help='Retry dead-lettered deliveries')
+    hookr.add_argument('--endpoint', type=int)
+    anchw = sub.add_parser('anchor-worker', help='Anchor queued per-cycle Merkle roots')
+    anchw.add_argument('--interval', type=float, default=60)
+    anchw.add_argument('--concurrency', type=int, help='Max roots stamped at once')
+    anchw.add_argument('--once', action='store_true')
+    anchw.add_argument('--requeue-dead', action='store_true', help='Retry dead-lettered batches first')
+    syncp = sub.add_parser('merkle-sync', help='Anti-entropy: fetch forest nodes a peer has and this node lacks')
+    syncp.add_argument('peer', help='Base URL of the peer web UI, e.g. http://host:1212')
+    syncp.add_argument('site_id', type=int)
+    syncp.add_argument('--remote-site', type=int, help='Site id on the peer (default: same id)')
+    pullp = sub.add_parser('merkle-pull', help='Fetch and apply the deltas a peer recorded after our watermark')
+    pullp.add_argument('peer', help='Base URL of the peer web UI, e.g. http://host:1212')
+    pullp.add_argument('site_id', type=int)
     args = parser.parse_args()
     sw = SiteWatcher()
     if args.cmd == 'add-site':
@@ -43,24 +82,30 @@ def main():
         print('site id', sid)
         return
     if args.cmd == 'status':
-        conn = db.get_conn()
-        cur = conn.cursor()
-        sites = cur.execute('SELECT * FROM Sites').fetchall()
-        for s in sites:
-            pages = cur.execute('SELECT COUNT(*) FROM Pages WHERE site_id=?', (s['id'],)).fetchone()[0]
+        for s in db.site_stats():
             last = s['last_crawled'] or 'never'
-            print(f"{s['id']}: {s['normalized_root']} — pages={pages} — last_crawled={last} — status={s['status']}")
-        conn.close()
+            print(f"{s['id']}: {s['normalized_root']} — pages={s['page_count']} — versions={s['version_count']} — changes={s['change_count']} — last_crawled={last} — status={s['status']}")
         return
     if args.cmd == 'proof-worker':
         from .workers.proof_upgrader import run_loop, run_once
         # run once then run loop with default hourly interval
-        run_once()
+        report = run_once(workers=args.workers)
+        print(f"proofs={report['proofs']} versions={report['versions']} verified={report['verified']} deferred={report['deferred']} errors={report['errors']} {report['proofs_per_second']}/s")
+        if args.once:
+            return
         try:
-            run_loop(interval_seconds=3600)
+            run_loop(interval_seconds=args.interval, workers=args.workers)
         except (KeyboardInterrupt, SystemExit):
             print('Proof worker shutting down')
         return
+    if args.cmd == 'segments':
+        from . import segment_store
+        if args.migrate:
+            print(segment_store.migrate_files())
+        if args.compact:
+            print(segment_store.compact(min_garbage_ratio=args.min_garbage))
+        print(segment_store.stats())
+        return
     if args.cmd == 'archive-index-set':
         from .config import set_archive_index
         set_archive_index(args.path)
@@ -70,6 +115,73 @@ def main():
         from .ui import app
         app.run(host=args.host, port=args.port)
         return
+    if args.cmd == 'mask-add':
+        from . import masking
+        kind, pattern = ('css', args.css) if args.css else ('regex', args.regex)
+        rid = masking.add_rule(args.site_id, kind, pattern)
+        print('mask rule id', rid)
+        return
+    if args.cmd == 'mask-list':
+        from . import masking
+        for r in masking.list_rules(args.site_id):
+            print(f"{r['id']}: {r['kind']} {r['pattern']!r} enabled={r['enabled']}")
+        return
+    if args.cmd == 'mask-report':
+        from . import masking
+        rep = masking.dry_run_report(args.site_id)
+        for r in rep['rules']:
+            if r['evaluable']:
+                print(f"{r['id']}: {r['kind']} {r['pattern']!r} — would eliminate {r['eliminated_versions']} versions")
+            else:
+                print(f"{r['id']}: {r['kind']} {r['pattern']!r} — not evaluable (stored versions keep text only)")
+        print('all regex rules combined:', rep['eliminated_versions_all_regex'])
+        return
+    if args.cmd == 'webhook-add':
+        from .workers import webhook_dispatcher
+        eid = webhook_dispatcher.add_endpoint(args.url, site_id=args.site, secret=args.secret, max_concurrency=args.concurrency)
+        print('webhook endpoint id', eid)
+        return
+    if args.cmd == 'webhook-list':
+        from .workers import webhook_dispatcher
+        for e in webhook_dispatcher.list_endpoints():
+            print(f"{e['id']}: {e['url']} site={e['site_id'] or 'all'} concurrency={e['max_concurrency']} enabled={e['enabled']}")
+        print('outbox:', webhook_dispatcher.outbox_counts())
+        return
+    if args.cmd == 'webhook-worker':
+        from .workers import webhook_dispatcher
+        if args.once:
+            print(webhook_dispatcher.run_once())
+            return
+        try:
+            webhook_dispatcher.run_loop(interval_seconds=args.interval)
+        except (KeyboardInterrupt, SystemExit):
+            print('Webhook worker shutting down')
+        return
+    if args.cmd == 'webhook-requeue':
+        from .workers import webhook_dispatcher
+        print('requeued', webhook_dispatcher.requeue_dead(args.endpoint))
+        return
+    if args.cmd == 'anchor-worker':
+        from .workers import anchor_worker
+        if args.requeue_dead:
+            print('requeued', anchor_worker.requeue_dead())
+        if args.once:
+            print(anchor_worker.run_once(args.concurrency), 'queue:', anchor_worker.queue_counts())
+            return
+        try:
+            anchor_worker.run_loop(interval_seconds=args.interval, concurrency=args.concurrency)
+        except (KeyboardInterrupt, SystemExit):
+            print('Anchor worker shutting down')
+        return
+    if args.cmd == 'merkle-sync':
+        from .merkle_sync import sync_from_peer
+        stats = sync_from_peer(args.peer, args.site_id, remote_site_id=args.remote_site)
+        print(f"rounds={stats['rounds']} prefixes={stats['prefixes']} missing={stats['missing']} fetched={stats['fetched']} rejected={stats['rejected']} bytes={stats['bytes']}")
+        return
+    if args.cmd == 'merkle-pull':
+        from .merkle_sync import pull_from_peer
+        print(pull_from_peer(args.peer, args.site_id))
+        return
     if args.cmd == 'search':
         rows = db.search_page_versions(args.query, limit=20)
         for r in rows:
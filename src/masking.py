@@ -0,0 +1,123 @@
+"""Per-site masking of volatile page regions before hashing and diffing.
+
+Rules live in `SiteMaskRules` (one row per rule, created by `db.init_db`)
+and come in two kinds:
+
+- `css`: a CSS selector; matching elements are removed from the HTML before
+  readability extraction.
+- `regex`: a Python regular expression; matches are removed from the
+  extracted text and lines left empty are dropped.
+
+`load_site_masks(site_id)` compiles a site's enabled rules once per crawl.
+`dry_run_report(site_id)` replays a site's stored versions to estimate how many
+versions each rule would have suppressed. Stored versions keep only the
+extracted text, so only regex rules can be replayed.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional
+from bs4 import BeautifulSoup
+from .db import get_conn
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ('css', 'regex')
+
+
+def add_rule(site_id: int, kind: str, pattern: str) -> int:
+    if kind not in RULE_KINDS:
+        raise ValueError(f'unknown mask rule kind {kind!r}')
+    # fail early on patterns that would never compile at crawl time
+    if kind == 'regex':
+        re.compile(pattern)
+    else:
+        BeautifulSoup('', 'lxml').select(pattern)
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute('INSERT INTO SiteMaskRules (site_id, kind, pattern, enabled, created_at) VALUES (?, ?, ?, 1, ?)', (site_id, kind, pattern, datetime.utcnow().isoformat()))
+    conn.commit()
+    rid = cur.lastrowid
+    conn.close()
+    return rid
+
+
+def list_rules(site_id: int, enabled_only: bool = False) -> List[dict]:
+    conn = get_conn()
+    q = 'SELECT * FROM SiteMaskRules WHERE site_id=?' + (' AND enabled=1' if enabled_only else '') + ' ORDER BY id'
+    rows = [dict(r) for r in conn.execute(q, (site_id,)).fetchall()]
+    conn.close()
+    return rows
+
+
+class SiteMasks:
+    def __init__(self, rules: List[dict]):
+        self.css = []
+        self.regexes = []
+        # identifies the active rule set; empty when there are no rules so raw
+        # digests stay plain hashes of the body
+        self.signature = ''.join(f"{r['kind']}:{r['pattern']}\n" for r in rules)
+        for r in rules:
+            try:
+                if r['kind'] == 'css':
+                    self.css.append(r['pattern'])
+                elif r['kind'] == 'regex':
+                    self.regexes.append(re.compile(r['pattern']))
+            except re.error as e:
+                logger.warning('Skipping invalid mask rule %s: %s', r.get('id'), e)
+
+    def apply_html(self, html: str) -> str:
+        if not self.css or not html:
+            return html
+        soup = BeautifulSoup(html, 'lxml')
+        for sel in self.css:
+            try:
+                for el in soup.select(sel):
+                    el.decompose()
+            except Exception as e:
+                logger.warning('Mask selector %r failed: %s', sel, e)
+        return str(soup)
+
+    def apply_text(self, text: str) -> str:
+        if not self.regexes or not text:
+            return text
+        for rx in self.regexes:
+            text = rx.sub('', text)
+        return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def load_site_masks(site_id: int) -> SiteMasks:
+    return SiteMasks(list_rules(site_id, enabled_only=True))
+
+
+def _suppressed(site_id: int, masks: SiteMasks) -> int:
+    """Count stored versions whose masked text equals the previous kept version's."""
+    conn = get_conn()
+    cur = conn.cursor()
+    suppressed = 0
+    last_page = None
+    last_hash = None
+    for r in cur.execute('SELECT page_id, content_text FROM PageVersions WHERE site_id=? ORDER BY page_id, archived_at, id', (site_id,)):
+        h = utils.hash_text(masks.apply_text(r['content_text'] or ''))
+        if r['page_id'] == last_page and h == last_hash:
+            suppressed += 1
+        else:
+            last_page, last_hash = r['page_id'], h
+    conn.close()
+    return suppressed
+
+
+def dry_run_report(site_id: int, rules: Optional[List[dict]] = None) -> dict:
+    """Estimate how many stored versions each rule (and all rules together) would have eliminated."""
+    rules = rules if rules is not None else list_rules(site_id)
+    baseline = _suppressed(site_id, SiteMasks([]))
+    out = {'site_id': site_id, 'rules': []}
+    for r in rules:
+        entry = {'id': r.get('id'), 'kind': r['kind'], 'pattern': r['pattern'], 'evaluable': r['kind'] == 'regex'}
+        if entry['evaluable']:
+            entry['eliminated_versions'] = _suppressed(site_id, SiteMasks([r])) - baseline
+        out['rules'].append(entry)
+    regex_rules = [r for r in rules if r['kind'] == 'regex']
+    out['eliminated_versions_all_regex'] = _suppressed(site_id, SiteMasks(regex_rules)) - baseline if regex_rules else 0
+    return out
@@ -3,7 +3,7 @@
 Provides deterministic Merkle root computation and simple proof generation.
 """
 import hashlib
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
 def sha256(b: bytes) -> bytes:
@@ -28,35 +28,97 @@ def merkle_root(leaves: List[bytes]) -> bytes:
     return nodes[0]
 
 
-def merkle_proof(leaves: List[bytes], index: int) -> List[bytes]:
-    """Return list of sibling hashes required to prove leaf at index.
+def merkle_levels(leaves: List[bytes]) -> List[List[bytes]]:
+    """Return every level of the tree, leaf hashes first and the root level last.
 
-    Proof order: sibling at each level.
+    An odd node at the end of a level is paired with itself, as in merkle_root.
     """
     if not leaves:
         return []
-    nodes = [sha256(l) for l in leaves]
+    level = [sha256(l) for l in leaves]
+    levels = [level]
+    while len(level) > 1:
+        level = [sha256(level[i] + (level[i+1] if i+1 < len(level) else level[i])) for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+
+def _proof_from_levels(levels: List[List[bytes]], index: int) -> List[bytes]:
     proof = []
     idx = index
-    while len(nodes) > 1:
-        next_nodes = []
-        for i in range(0, len(nodes), 2):
-            a = nodes[i]
-            b = nodes[i+1] if i+1 < len(nodes) else nodes[i]
-            next_nodes.append(sha256(a + b))
-            if i == idx ^ 1 or (i+1 == idx):
-                pass
-        # sibling selection
+    for level in levels[:-1]:
         sibling_index = idx ^ 1
-        if sibling_index < len(nodes):
-            proof.append(nodes[sibling_index])
-        else:
-            proof.append(nodes[idx])
+        proof.append(level[sibling_index] if sibling_index < len(level) else level[idx])
         idx = idx // 2
-        nodes = next_nodes
     return proof
 
 
+def merkle_proof(leaves: List[bytes], index: int) -> List[bytes]:
+    """Return list of sibling hashes required to prove leaf at index.
+
+    Proof order: sibling at each level.
+    """
+    if not leaves:
+        return []
+    return _proof_from_levels(merkle_levels(leaves), index)
+
+
+def merkle_proofs(leaves: List[bytes], indices: Optional[Iterable[int]] = None) -> Dict[int, List[bytes]]:
+    """Proofs for many leaves (all of them by default) from a single tree build.
+
+    Each proof has the same shape as merkle_proof's and verifies with verify_proof.
+    """
+    levels = merkle_levels(leaves)
+    if not levels:
+        return {}
+    indices = range(len(leaves)) if indices is None else indices
+    return {i: _proof_from_levels(levels, i) for i in indices}
+
+
+def _multiproof_walk(leaf_count: int, indices: List[int]):
+    """Yield (level, idx, sibling) for the pairs a multiproof visits, in proof order.
+
+    sibling is None when the sibling is itself known (either requested or
+    computed from below) and idx when the node is paired with itself.
+    """
+    known = sorted(set(indices))
+    size = leaf_count
+    level = 0
+    while size > 1:
+        parents = []
+        i = 0
+        while i < len(known):
+            idx = known[i]
+            sib = idx ^ 1
+            if i + 1 < len(known) and known[i + 1] == sib:
+                yield level, idx, None
+                i += 2
+            else:
+                yield level, idx, (sib if sib < size else idx)
+                i += 1
+            parents.append(idx // 2)
+        known = parents
+        size = (size + 1) // 2
+        level += 1
+
+
+def merkle_multiproof(leaves: List[bytes], indices: Iterable[int]) -> dict:
+    """Compact proof for several leaves at once.
+
+    Siblings shared between paths, or derivable from other proven leaves,
+    are included once or not at all. The result is
+    {'leaf_count', 'indices' (sorted, unique), 'hashes'}. Verify it with
+    verify_multiproof.
+    """
+    levels = merkle_levels(leaves)
+    indices = sorted(set(indices))
+    hashes = []
+    for level, idx, sib in _multiproof_walk(len(leaves), indices):
+        if sib is not None and sib != idx:
+            hashes.append(levels[level][sib])
+    return {'leaf_count': len(leaves), 'indices': indices, 'hashes': hashes}
+
+
 def verify_proof(leaf: bytes, proof: List[bytes], root: bytes, index: int) -> bool:
     h = sha256(leaf)
     idx = index
@@ -67,3 +129,39 @@ def verify_proof(leaf: bytes, proof: List[bytes], root: bytes, index: int) -> bo
             h = sha256(sib + h)
         idx = idx // 2
     return h == root
+
+
+def verify_proofs(leaves: Dict[int, bytes], proofs: Dict[int, List[bytes]], root: bytes) -> bool:
+    """Batch form of verify_proof: leaves and proofs are keyed by leaf index."""
+    return bool(leaves) and leaves.keys() == proofs.keys() and all(verify_proof(leaf, proofs[i], root, i) for i, leaf in leaves.items())
+
+
+def verify_multiproof(leaves: Dict[int, bytes], proof: dict, root: bytes) -> bool:
+    """Check a merkle_multiproof result; `leaves` maps each proven index to its leaf bytes."""
+    indices = proof['indices']
+    if not indices or sorted(leaves.keys()) != indices or not 0 <= indices[0] <= indices[-1] < proof['leaf_count']:
+        return False
+    current = {i: sha256(leaves[i]) for i in indices}
+    supplied = iter(proof['hashes'])
+    nxt = {}
+    last_level = 0
+    try:
+        for level, idx, sib in _multiproof_walk(proof['leaf_count'], indices):
+            if level != last_level:
+                current, nxt, last_level = nxt, {}, level
+            h = current[idx]
+            if sib is None:
+                nxt[idx // 2] = sha256(h + current[idx ^ 1])
+            elif sib == idx:
+                nxt[idx // 2] = sha256(h + h)
+            elif idx % 2 == 0:
+                nxt[idx // 2] = sha256(h + next(supplied))
+            else:
+                nxt[idx // 2] = sha256(next(supplied) + h)
+    except StopIteration:
+        return False
+    if next(supplied, None) is not None:
+        return False
+    if nxt:
+        current = nxt
+    return len(current) == 1 and current.get(0) == root
@@ -11,7 +11,7 @@ from hashlib import sha256
 import json
 from datetime import datetime
 from .db import get_conn
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 def merkle_hash(data: bytes) -> bytes:
@@ -33,26 +33,204 @@ def merkle_root(leaves: List[bytes]) -> bytes:
 
 
 class MerkleForest:
-    """Manage a simple per-site Merkle forest stored in SQLite."""
+    """Manage a per-site Merkle forest stored in SQLite.
+
+    Node payloads live once in `KnowledgeNodes`, keyed by node_hash. Site
+    membership is `ForestLeaves` (see prefix_tree.py). A `MerkleForest` row
+    is a small root snapshot that records `node_count`, the leaf count the
+    root covers. Rows written before this layout carry the whole forest in
+    `tree_blob`. prefix_tree.for_site migrates those on first use.
+    """
     def __init__(self, site_id: int):
         self.site_id = site_id
 
-    def save_tree(self, root: str, tree_blob: dict):
-        conn = get_conn()
+    def save_tree(self, root: str, node_count: int, conn=None):
+        own = conn is None
+        conn = conn or get_conn()
         cur = conn.cursor()
         now = datetime.utcnow().isoformat()
-        cur.execute("INSERT INTO MerkleForest (site_id, tree_root, tree_blob, last_updated) VALUES (?, ?, ?, ?)", (self.site_id, root, json.dumps(tree_blob), now))
-        conn.commit()
-        conn.close()
+        cur.execute("INSERT INTO MerkleForest (site_id, tree_root, node_count, last_updated) VALUES (?, ?, ?, ?)", (self.site_id, root, node_count, now))
+        if own:
+            conn.commit()
+            conn.close()
 
     def latest(self) -> Optional[dict]:
         conn = get_conn()
         cur = conn.cursor()
-        row = cur.execute("SELECT * FROM MerkleForest WHERE site_id=? ORDER BY last_updated DESC LIMIT 1", (self.site_id,)).fetchone()
+        row = cur.execute("SELECT id, site_id, tree_root, node_count, last_updated FROM MerkleForest WHERE site_id=? ORDER BY last_updated DESC, id DESC LIMIT 1", (self.site_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def nodes(self, after: Optional[str] = None) -> Iterator[dict]:
+        """Stream this site's nodes in node_hash order (the merge/root order) without loading them all."""
+        conn = get_conn()
+        q = ("SELECT l.node_hash, k.payload, k.meta FROM ForestLeaves l LEFT JOIN KnowledgeNodes k ON k.node_hash=l.node_hash "
+             "WHERE l.site_id=?" + (" AND l.node_hash > ?" if after is not None else "") + " ORDER BY l.node_hash")
+        try:
+            for r in conn.execute(q, (self.site_id, after) if after is not None else (self.site_id,)):
+                yield _node_from_row(r)
+        finally:
+            conn.close()
+
+    def get_nodes(self, node_hashes: List[str]) -> List[dict]:
+        """Stored nodes for the given hashes, limited to this site's members."""
+        conn = get_conn()
+        out = []
+        hashes = list(node_hashes)
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            q = ("SELECT l.node_hash, k.payload, k.meta FROM ForestLeaves l JOIN KnowledgeNodes k ON k.node_hash=l.node_hash "
+                 "WHERE l.site_id=? AND l.node_hash IN (%s) ORDER BY l.node_hash" % ','.join('?' * len(chunk)))
+            out.extend(_node_from_row(r) for r in conn.execute(q, [self.site_id] + chunk))
         conn.close()
-        if not row:
-            return None
-        return {'id': row['id'], 'site_id': row['site_id'], 'tree_root': row['tree_root'], 'tree_blob': json.loads(row['tree_blob']), 'last_updated': row['last_updated']}
+        return out
+
+    def legacy_nodes(self) -> List[dict]:
+        """Nodes of the newest pre-normalization snapshot (full tree_blob), if any."""
+        conn = get_conn()
+        row = conn.execute("SELECT tree_blob FROM MerkleForest WHERE site_id=? AND tree_blob IS NOT NULL ORDER BY last_updated DESC, id DESC LIMIT 1", (self.site_id,)).fetchone()
+        conn.close()
+        return json.loads(row['tree_blob']).get('nodes', []) if row else []
+
+    def drop_legacy_blobs(self):
+        conn = get_conn()
+        conn.execute("UPDATE MerkleForest SET tree_blob=NULL WHERE site_id=? AND tree_blob IS NOT NULL", (self.site_id,))
+        conn.commit()
+        conn.close()
+
+
+def _node_from_row(r) -> dict:
+    n = {'node_hash': r['node_hash'], 'payload': json.loads(r['payload']) if r['payload'] is not None else None}
+    if r['meta']:
+        n['meta'] = json.loads(r['meta'])
+    return n
+
+
+def load_nodes(node_hashes: List[str], conn=None) -> Dict[str, dict]:
+    """Fetch stored nodes for just the given hashes."""
+    own = conn is None
+    conn = conn or get_conn()
+    out = {}
+    hashes = list(node_hashes)
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        q = "SELECT node_hash, payload, meta FROM KnowledgeNodes WHERE node_hash IN (%s)" % ','.join('?' * len(chunk))
+        for r in conn.execute(q, chunk):
+            out[r['node_hash']] = _node_from_row(r)
+    if own:
+        conn.close()
+    return out
+
+
+def store_nodes(nodes: List[dict], conn=None):
+    """Insert nodes into KnowledgeNodes, keeping any row already stored for a hash.
+
+    Rows are keyed by content hash and shared by every site, so a peer's
+    differing payload for a known hash is a conflict (see merge_forests), not
+    an update.
+    """
+    own = conn is None
+    conn = conn or get_conn()
+    conn.executemany(
+        "INSERT OR IGNORE INTO KnowledgeNodes (node_hash, payload, meta) VALUES (?, ?, ?)",
+        [(n['node_hash'], json.dumps(n.get('payload')), json.dumps(n['meta']) if n.get('meta') else None) for n in nodes])
+    if own:
+        conn.commit()
+        conn.close()
+
+
+def _same_payload(a, b) -> bool:
+    # strings (the usual payload) compare directly, which matches comparing
+    # their JSON encodings without building them; other shapes keep the JSON
+    # comparison so e.g. 1 vs 1.0 or key order still count as different
+    if a is b:
+        return True
+    if type(a) is type(b) and isinstance(a, (str, bytes)):
+        return a == b
+    return json.dumps(a) == json.dumps(b)
+
+
+def _as_int(v) -> int:
+    try:
+        return int(v or 0)
+    except Exception:
+        return 0
+
+
+def _conflict_winner(local_node: dict, remote_context: Optional[dict]) -> str:
+    """Decide winner using remote_context lamport/sequence if available; local by default."""
+    if not remote_context:
+        return 'local'
+    meta = local_node.get('meta') or {}
+    r_lam, l_lam = _as_int(remote_context.get('lamport')), _as_int(meta.get('lamport'))
+    if r_lam > l_lam:
+        return 'remote'
+    # tie-breaker: use sequence if provided
+    if r_lam == l_lam and _as_int(remote_context.get('sequence')) > _as_int(meta.get('sequence')):
+        return 'remote'
+    return 'local'
+
+
+def _runs(nodes: Iterable[dict]) -> Iterator[Tuple[str, List[dict]]]:
+    """Group a node_hash-sorted stream into (node_hash, [nodes with that hash])."""
+    run_hash = None
+    run = []
+    for n in nodes:
+        nh = n.get('node_hash')
+        if run and nh != run_hash:
+            yield run_hash, run
+            run = []
+        run_hash = nh
+        run.append(n)
+    if run:
+        yield run_hash, run
+
+
+def iter_merge(local_nodes: Iterable[dict], remote_nodes: Iterable[dict], remote_context: Optional[dict] = None,
+               on_conflict: Optional[Callable[[dict, dict], None]] = None) -> Iterator[dict]:
+    """Streaming merge of two node streams already sorted by node_hash.
+
+    Yields the merged nodes in node_hash order. Each conflict is passed to
+    `on_conflict(conflict, remote_node)` as soon as it is found. Memory use is bounded by the
+    longest run of equal hashes, not by the forest size. The rules match
+    merge_forests:
+    - A duplicate hash within the local stream keeps the last node.
+    - A remote node whose hash is already present is compared to the node
+      currently held for that hash. When the payloads differ, a conflict is
+      recorded, and the remote node replaces the held one only if it wins.
+    """
+    lit, rit = _runs(local_nodes), _runs(remote_nodes)
+    lh, lrun = next(lit, (None, None))
+    rh, rrun = next(rit, (None, None))
+    while lrun is not None or rrun is not None:
+        if rrun is None or (lrun is not None and lh < rh):
+            yield lrun[-1]
+            lh, lrun = next(lit, (None, None))
+            continue
+        if lrun is not None and lh == rh:
+            current = lrun[-1]
+            remote = rrun
+            lh, lrun = next(lit, (None, None))
+        else:
+            current = rrun[0]
+            remote = rrun[1:]
+        for n in remote:
+            local_payload = current.get('payload')
+            remote_payload = n.get('payload')
+            if not _same_payload(local_payload, remote_payload):
+                winner = _conflict_winner(current, remote_context)
+                if on_conflict is not None:
+                    on_conflict({'node_hash': rh, 'local_payload': local_payload, 'remote_payload': remote_payload, 'winner': winner}, n)
+                if winner == 'remote':
+                    # attach remote meta if present
+                    current = n
+        yield current
+        rh, rrun = next(rit, (None, None))
+
+
+def _sorted_nodes(blob: dict) -> List[dict]:
+    # stable sort keeps the original order among duplicate hashes
+    return sorted(blob.get('nodes', []), key=lambda n: n.get('node_hash'))
 
 
 def merge_forests(local_blob: dict, remote_blob: dict, remote_context: dict = None) -> dict:
@@ -63,53 +241,18 @@ def merge_forests(local_blob: dict, remote_blob: dict, remote_context: dict = No
       in `conflicts` and prefer the local node by default.
     - Return merged blob containing `nodes` (deterministically sorted by node_hash)
       and optional `conflicts` list.
+
+    Blob-in/blob-out wrapper over iter_merge; callers holding sorted streams
+    (e.g. MerkleForest.nodes()) should use iter_merge directly.
     """
-    local_nodes = {n['node_hash']: n for n in local_blob.get('nodes', [])}
+    remote_order = {id(n): i for i, n in enumerate(remote_blob.get('nodes', []))}
     conflicts = []
-    for n in remote_blob.get('nodes', []):
-        nh = n.get('node_hash')
-        if nh in local_nodes:
-            # detect payload mismatch for identical node_hash (very unlikely unless hash collision)
-            local_payload = local_nodes[nh].get('payload')
-            remote_payload = n.get('payload')
-            if json.dumps(local_payload) != json.dumps(remote_payload):
-                # decide winner using remote_context lamport/sequence if available
-                winner = 'local'
-                if remote_context:
-                    try:
-                        r_lam = int(remote_context.get('lamport') or 0)
-                    except Exception:
-                        r_lam = 0
-                    try:
-                        l_lam = int(local_nodes[nh].get('meta', {}).get('lamport') or 0)
-                    except Exception:
-                        l_lam = 0
-                    if r_lam > l_lam:
-                        winner = 'remote'
-                    elif r_lam == l_lam:
-                        # tie-breaker: use sequence if provided
-                        try:
-                            r_seq = int(remote_context.get('sequence') or 0)
-                        except Exception:
-                            r_seq = 0
-                        try:
-                            l_seq = int(local_nodes[nh].get('meta', {}).get('sequence') or 0)
-                        except Exception:
-                            l_seq = 0
-                        if r_seq > l_seq:
-                            winner = 'remote'
-                conflicts.append({'node_hash': nh, 'local_payload': local_payload, 'remote_payload': remote_payload, 'winner': winner})
-                if winner == 'remote':
-                    # attach remote meta if present
-                    local_nodes[nh] = n
-            # else payloads identical => nothing to do
-        else:
-            local_nodes[nh] = n
-    # deterministic ordering: sort by node_hash hex
-    merged_nodes = [local_nodes[k] for k in sorted(local_nodes.keys())]
+    merged_nodes = list(iter_merge(_sorted_nodes(local_blob), _sorted_nodes(remote_blob), remote_context,
+                                   lambda c, n: conflicts.append((remote_order[id(n)], c))))
     merged_blob = {'nodes': merged_nodes, 'merged_at': datetime.utcnow().isoformat()}
     if conflicts:
-        merged_blob['conflicts'] = conflicts
+        # listed in remote input order, as before the streaming merge
+        merged_blob['conflicts'] = [c for _, c in sorted(conflicts, key=lambda x: x[0])]
     return merged_blob
 
 
@@ -0,0 +1,268 @@
+"""Per-site hash tree keyed by knowledge-node hash prefixes.
+
+This replaces full-rebuild roots such as `merkle_distributed.merkle_root`
+and `compute_tree_root_from_blob` for the per-site forest. The tree is a
+16-ary trie over the hex digits of the node hashes, so its shape and root
+depend only on the set of hashes, not on the order deltas arrived in. Two
+peers holding the same nodes always agree on the root.
+
+A prefix holding at most `BUCKET_SIZE` hashes is a bucket:
+digest = H(0x00 || the sorted hashes as raw bytes). A larger prefix is
+split by its next hex digit: digest = H(0x01 || digit || child digest ...)
+over the non-empty children in digit order. The root is the digest of the
+empty prefix, or H(b'') for an empty site to match the legacy empty-forest
+root.
+
+Storage, created by `db.init_db`:
+
+- `ForestLeaves(site_id, node_hash)` is the per-site membership index.
+- `ForestPrefixes(site_id, depth, prefix, count, digest)` holds one row per
+  bucket and split prefix. The empty prefix's row is the cached root and
+  leaf count. Anti-entropy summaries (`summary`) read these rows instead of
+  rescanning the leaves.
+
+Appending k hashes rewrites the rows on their paths: O(k log n) rows, each
+reading at most 16 children or `BUCKET_SIZE` leaves. Reading the root is a
+single row lookup. An inclusion proof is the sibling digests along the path
+plus the hashes of the leaf's bucket.
+"""
+import hashlib
+import re
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional
+from .db import get_conn
+
+# part of the sync protocol: every peer must use the same value
+BUCKET_SIZE = 16
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()
+# upper bound for a prefix range scan: sorts after every character a node hash can contain
+PREFIX_END = '\U0010ffff'
+_NODE_HASH = re.compile(r'[0-9a-f]{64}')
+
+
+def bucket_digest(node_hashes: List[str]) -> bytes:
+    return hashlib.sha256(b'\x00' + b''.join(bytes.fromhex(h) for h in node_hashes)).digest()
+
+
+def split_digest(children: Dict[str, bytes]) -> bytes:
+    return hashlib.sha256(b'\x01' + b''.join(c.encode('ascii') + children[c] for c in sorted(children))).digest()
+
+
+def _check(node_hashes: Iterable[str]) -> List[str]:
+    out = []
+    for h in node_hashes:
+        if not isinstance(h, str) or not _NODE_HASH.fullmatch(h):
+            raise ValueError(f'node hash must be 64 lowercase hex digits: {h!r}')
+        out.append(h)
+    return out
+
+
+class PrefixTree:
+    def __init__(self, site_id: int):
+        self.site_id = site_id
+        self.leaf_count = 0
+        self._root = EMPTY_ROOT
+        self.reload()
+
+    def reload(self, conn=None):
+        own = conn is None
+        conn = conn or get_conn()
+        row = self._row(conn, '')
+        if own:
+            conn.close()
+        if row:
+            self.leaf_count, self._root = row['count'], row['digest'].hex()
+        else:
+            self.leaf_count, self._root = 0, EMPTY_ROOT
+
+    def root(self) -> str:
+        return self._root
+
+    def _row(self, conn, prefix: str):
+        return conn.execute('SELECT count, digest FROM ForestPrefixes WHERE site_id=? AND depth=? AND prefix=?',
+                            (self.site_id, len(prefix), prefix)).fetchone()
+
+    def _members(self, conn, prefix: str) -> List[str]:
+        return [r[0] for r in conn.execute(
+            'SELECT node_hash FROM ForestLeaves WHERE site_id=? AND node_hash >= ? AND node_hash < ? ORDER BY node_hash',
+            (self.site_id, prefix, prefix + PREFIX_END)).fetchall()]
+
+    def _children(self, conn, prefix: str) -> Dict[str, bytes]:
+        return {r['prefix'][-1]: r['digest'] for r in conn.execute(
+            'SELECT prefix, digest FROM ForestPrefixes WHERE site_id=? AND depth=? AND prefix >= ? AND prefix < ?',
+            (self.site_id, len(prefix) + 1, prefix, prefix + PREFIX_END)).fetchall()}
+
+    def missing(self, node_hashes: Iterable[str], conn=None) -> List[str]:
+        """Sorted, de-duplicated hashes from `node_hashes` that are not leaves yet."""
+        wanted = sorted(set(_check(node_hashes)))
+        if not wanted:
+            return []
+        own = conn is None
+        conn = conn or get_conn()
+        present = set()
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i:i + 500]
+            q = 'SELECT node_hash FROM ForestLeaves WHERE site_id=? AND node_hash IN (%s)' % ','.join('?' * len(chunk))
+            present.update(r[0] for r in conn.execute(q, [self.site_id] + chunk).fetchall())
+        if own:
+            conn.close()
+        return [h for h in wanted if h not in present]
+
+    def _update(self, conn, prefix: str, new: List[str], fresh: bool, rows: dict) -> bytes:
+        """Recompute `prefix` with the sorted `new` hashes added; collects the rows to write in `rows`.
+
+        `fresh` means nothing stored under `prefix` counts yet (it is being
+        split out of a bucket, so `new` is its full membership).
+        """
+        old = None if fresh else self._row(conn, prefix)
+        fresh = fresh or old is None
+        count = (0 if fresh else old['count']) + len(new)
+        if count <= BUCKET_SIZE:
+            digest = bucket_digest(new if fresh else sorted(set(self._members(conn, prefix)).union(new)))
+        else:
+            if not fresh and old['count'] <= BUCKET_SIZE:
+                # a bucket outgrowing BUCKET_SIZE: its children are built from scratch
+                new = sorted(set(self._members(conn, prefix)).union(new))
+                fresh = True
+            children = {} if fresh else self._children(conn, prefix)
+            depth = len(prefix)
+            for digit, group in groupby(new, key=lambda h: h[depth]):
+                children[digit] = self._update(conn, prefix + digit, list(group), fresh, rows)
+            digest = split_digest(children)
+        rows[prefix] = (count, digest)
+        return digest
+
+    def _plan(self, conn, new: List[str]) -> dict:
+        rows = {}
+        if new:
+            self._update(conn, '', new, False, rows)
+        return rows
+
+    def preview_root(self, node_hashes: Iterable[str], conn=None) -> str:
+        """Root after adding the new hashes in `node_hashes`, without writing anything."""
+        own = conn is None
+        conn = conn or get_conn()
+        try:
+            rows = self._plan(conn, self.missing(node_hashes, conn))
+        finally:
+            if own:
+                conn.close()
+        return rows[''][1].hex() if rows else self._root
+
+    def append(self, node_hashes: Iterable[str], conn=None) -> str:
+        """Add the new hashes from `node_hashes` and return the new root.
+
+        With `conn`, the writes join the caller's open transaction (which
+        must already hold the write lock) and are not committed here.
+        """
+        node_hashes = list(node_hashes)
+        own = conn is None
+        conn = conn or get_conn()
+        cur = conn.cursor()
+        if own:
+            # take the write lock before reading state so concurrent appenders serialize
+            cur.execute('BEGIN IMMEDIATE')
+        self.reload(conn)
+        new = self.missing(node_hashes, conn)
+        rows = self._plan(conn, new)
+        if rows:
+            cur.executemany('INSERT INTO ForestLeaves (site_id, node_hash) VALUES (?, ?)', [(self.site_id, h) for h in new])
+            cur.executemany('INSERT INTO ForestPrefixes (site_id, depth, prefix, count, digest) VALUES (?, ?, ?, ?, ?) '
+                            'ON CONFLICT(site_id, depth, prefix) DO UPDATE SET count=excluded.count, digest=excluded.digest',
+                            [(self.site_id, len(p), p, c, d) for p, (c, d) in rows.items()])
+            self.leaf_count, self._root = rows[''][0], rows[''][1].hex()
+        if own:
+            conn.commit()
+            conn.close()
+        return self._root
+
+    def summary(self, prefix: str, list_limit: int = 0, conn=None) -> dict:
+        """Count and digest of this site's node hashes starting with `prefix` (anti-entropy).
+
+        The digest is the tree digest of that prefix, so two peers holding the
+        same set under it get the same digest. Bucket and split prefixes are a
+        stored row. Any other prefix lies inside a bucket and is at most
+        BUCKET_SIZE leaves. The hashes are included when there are at most
+        `list_limit`.
+        """
+        own = conn is None
+        conn = conn or get_conn()
+        try:
+            row = self._row(conn, prefix)
+            members = None
+            if row:
+                count, digest = row['count'], row['digest']
+            else:
+                members = self._members(conn, prefix)
+                count, digest = len(members), bucket_digest(members)
+            out = {'prefix': prefix, 'count': count, 'digest': digest.hex()}
+            if count <= list_limit:
+                out['hashes'] = members if members is not None else self._members(conn, prefix)
+        finally:
+            if own:
+                conn.close()
+        return out
+
+    def summaries(self, prefixes: Iterable[str], list_limit: int = 0) -> List[dict]:
+        conn = get_conn()
+        try:
+            return [self.summary(p, list_limit, conn) for p in prefixes]
+        finally:
+            conn.close()
+
+    def proof(self, node_hash: str) -> Optional[dict]:
+        """Inclusion proof for `node_hash`, or None if it is not a leaf of this site.
+
+        'bucket' lists the hashes of the leaf's bucket; 'path' holds, from the
+        bucket's parent up to the root, the digests of the other children.
+        """
+        conn = get_conn()
+        try:
+            if not conn.execute('SELECT 1 FROM ForestLeaves WHERE site_id=? AND node_hash=?', (self.site_id, node_hash)).fetchone():
+                return None
+            path = []
+            depth = 0
+            while True:
+                row = self._row(conn, node_hash[:depth])
+                if row['count'] <= BUCKET_SIZE:
+                    break
+                siblings = self._children(conn, node_hash[:depth])
+                siblings.pop(node_hash[depth])
+                path.append({d: v.hex() for d, v in siblings.items()})
+                depth += 1
+            bucket = self._members(conn, node_hash[:depth])
+        finally:
+            conn.close()
+        return {'bucket': bucket, 'path': path[::-1]}
+
+
+def verify_inclusion(node_hash: str, proof: dict, root: str) -> bool:
+    bucket = proof['bucket']
+    depth = len(proof['path'])
+    if node_hash not in bucket or bucket != sorted(set(bucket)) or any(h[:depth] != node_hash[:depth] for h in bucket):
+        return False
+    try:
+        h = bucket_digest(bucket)
+        for level, siblings in enumerate(proof['path']):
+            children = {d: bytes.fromhex(v) for d, v in siblings.items()}
+            children[node_hash[depth - 1 - level]] = h
+            h = split_digest(children)
+    except (ValueError, TypeError):
+        return False
+    return h.hex() == root
+
+
+def for_site(site_id: int) -> PrefixTree:
+    """Load a site's tree, migrating the latest legacy tree_blob snapshot on first use."""
+    tree = PrefixTree(site_id)
+    if tree.leaf_count:
+        return tree
+    from .merkle_distributed import MerkleForest, store_nodes
+    forest = MerkleForest(site_id)
+    nodes = forest.legacy_nodes()
+    if nodes:
+        store_nodes(nodes)
+        tree.append(n['node_hash'] for n in nodes)
+        forest.save_tree(tree.root(), tree.leaf_count)
+        forest.drop_legacy_blobs()
+    return tree
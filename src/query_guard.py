@@ -0,0 +1,86 @@
+"""Per-request query budgets and per-client concurrency limits for the web API.
+
+`QueryBudget.connection()` hands out a read-only SQLite connection with a
+progress handler that interrupts any statement once the request has used its
+wall-clock or VM-step budget; the interruption is re-raised as
+`QueryBudgetExceeded` so the UI can answer with a structured 503. `ClientLimiter`
+caps how many expensive requests a single client may have in flight so one
+analyst cannot monopolise the DB while the crawler is writing.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from . import db
+
+QUERY_TIME_BUDGET_MS = int(os.environ.get('WPS_QUERY_TIME_BUDGET_MS', '2000'))
+QUERY_STEP_BUDGET = int(os.environ.get('WPS_QUERY_STEP_BUDGET', '50000000'))
+PROGRESS_INTERVAL = 1000
+CLIENT_CONCURRENCY = int(os.environ.get('WPS_CLIENT_CONCURRENCY', '2'))
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, reason: str, elapsed_ms: float, steps: int):
+        super().__init__(f'query budget exceeded ({reason})')
+        self.reason = reason
+        self.elapsed_ms = elapsed_ms
+        self.steps = steps
+
+
+class QueryBudget:
+    def __init__(self, time_budget_ms: Optional[int] = None, step_budget: Optional[int] = None, interval: int = PROGRESS_INTERVAL):
+        self.time_budget = (time_budget_ms if time_budget_ms is not None else QUERY_TIME_BUDGET_MS) / 1000.0
+        self.step_budget = step_budget if step_budget is not None else QUERY_STEP_BUDGET
+        self.interval = interval
+        self.started = time.monotonic()
+        self.steps = 0
+        self.exceeded = None
+
+    def _on_progress(self) -> int:
+        # called by SQLite every `interval` VM instructions; non-zero aborts the statement
+        self.steps += self.interval
+        if self.steps > self.step_budget:
+            self.exceeded = 'steps'
+        elif time.monotonic() - self.started > self.time_budget:
+            self.exceeded = 'time'
+        return 1 if self.exceeded else 0
+
+    @contextmanager
+    def connection(self):
+        conn = db.get_conn()
+        conn.execute('PRAGMA query_only=1')
+        conn.set_progress_handler(self._on_progress, self.interval)
+        try:
+            yield conn
+        except sqlite3.OperationalError:
+            if self.exceeded:
+                raise QueryBudgetExceeded(self.exceeded, (time.monotonic() - self.started) * 1000, self.steps)
+            raise
+        finally:
+            conn.close()
+
+
+class ClientLimiter:
+    """Counting limiter keyed by client id; `acquire` never blocks."""
+    def __init__(self, limit: int = CLIENT_CONCURRENCY):
+        self.limit = limit
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str) -> bool:
+        with self._lock:
+            n = self._inflight.get(client, 0)
+            if n >= self.limit:
+                return False
+            self._inflight[client] = n + 1
+            return True
+
+    def release(self, client: str):
+        with self._lock:
+            n = self._inflight.get(client, 0) - 1
+            if n > 0:
+                self._inflight[client] = n
+            else:
+                self._inflight.pop(client, None)
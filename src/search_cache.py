@@ -0,0 +1,100 @@
+"""In-process LRU/TTL cache for search results.
+
+Entries are keyed by the normalized query, filters and page, and are tagged
+with the `page_versions` watermark that `db.insert_page_version` bumps. A cached
+result is served only while the watermark is unchanged and the entry is
+younger than the TTL. The DB watermark is re-read at most every
+`WATERMARK_POLL_SECONDS` (or immediately after a write from this process), so
+cache hits never touch SQLite.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from . import db
+
+CACHE_SIZE = int(os.environ.get('WPS_SEARCH_CACHE_SIZE', '512'))
+CACHE_TTL = float(os.environ.get('WPS_SEARCH_CACHE_TTL', '60'))
+WATERMARK_POLL_SECONDS = float(os.environ.get('WPS_SEARCH_WATERMARK_POLL', '1'))
+
+
+def normalize_query(q: str) -> str:
+    # collapse whitespace only: FTS5 operators (AND/OR/NOT) are case-sensitive
+    return ' '.join((q or '').split())
+
+
+class SearchCache:
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL, poll_seconds: float = WATERMARK_POLL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.poll_seconds = poll_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._local_bumps = None
+        self._checked_at = 0.0
+
+    def watermark(self) -> int:
+        now = time.monotonic()
+        if (self._watermark is None or self._local_bumps != db.LOCAL_WATERMARK_BUMPS
+                or now - self._checked_at >= self.poll_seconds):
+            self._local_bumps = db.LOCAL_WATERMARK_BUMPS
+            self._watermark = db.get_watermark('page_versions')
+            self._checked_at = now
+        return self._watermark
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], dict]) -> Tuple[dict, bool]:
+        """Return (value, hit). `compute` runs outside the lock on a miss."""
+        wm = self.watermark()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == wm and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2], True
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = (wm, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._watermark = None
+
+
+_cache: Optional[SearchCache] = None
+
+
+def get_cache() -> SearchCache:
+    global _cache
+    if _cache is None:
+        _cache = SearchCache()
+    return _cache
+
+
+def search(q: str, site_id=None, date_from=None, date_to=None, page=1, per_page=10, exact_total=True, budget=None) -> Tuple[dict, bool]:
+    """Cached wrapper around db.search_page_versions_paged. Returns (result, hit).
+
+    On a miss the query runs on a `budget.connection()` when a
+    query_guard.QueryBudget is given. The returned dict is shared with the
+    cache and must not be mutated.
+    """
+    nq = normalize_query(q)
+    key = (nq, site_id, date_from, date_to, int(page or 1), int(per_page or 10), bool(exact_total))
+
+    def compute():
+        kwargs = dict(site_id=site_id, date_from=date_from, date_to=date_to, page=page, per_page=per_page, exact_total=exact_total)
+        if budget is None:
+            return db.search_page_versions_paged(nq, **kwargs)
+        with budget.connection() as conn:
+            return db.search_page_versions_paged(nq, conn=conn, **kwargs)
+    return get_cache().get_or_compute(key, compute)
@@ -0,0 +1,301 @@
+"""Append-only segment files for anchor proofs and anchor records.
+
+Instead of one small file per content hash under `anchors/`, records are
+appended to a few large segment files (`seg-<id>.wps`), and SQLite keeps the
+offset index:
+
+- `Segments`: one row per segment file, with its size and how many of those
+  bytes belong to records that are still current (`live_bytes`).
+- `SegmentRecords`: key -> (segment_id, offset, length, crc) of the current
+  record for that key. Writing a key again supersedes the old record.
+
+Each record is a fixed header (magic, key length, data length, crc32), then
+the key, then the data. Records are readable without the index.
+
+Callers store `ref(key)` (`seg:<key>`) where they used to store a file path,
+e.g. in `proof_path`. Reads go through a cached read-only mmap of the
+segment. `compact` rewrites the live records of segments that are mostly
+superseded, such as proofs replaced after an upgrade, and deletes the old
+files.
+
+Writers serialise on the SQLite write lock (BEGIN IMMEDIATE), so several
+worker processes can share a store.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+from . import db
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_DIR = Path(os.environ.get('WPS_SEGMENT_DIR', os.path.join(os.environ.get('WPS_ANCHOR_DIR', 'anchors'), 'segments')))
+SEGMENT_MAX_BYTES = int(os.environ.get('WPS_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+FSYNC = os.environ.get('WPS_SEGMENT_FSYNC', '1') != '0'
+REF_PREFIX = 'seg:'
+MAGIC = b'WPS1'
+HEADER = struct.Struct('>4sHII')  # magic, key length, data length, crc32 of data
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def ref(key: str) -> str:
+    return REF_PREFIX + key
+
+
+def is_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+def key_of(value: str) -> str:
+    return value[len(REF_PREFIX):] if is_ref(value) else value
+
+
+def segment_path(segment_id: int) -> Path:
+    return SEGMENT_DIR / f'seg-{segment_id:06d}.wps'
+
+
+def _active_segment(cur, need: int):
+    row = cur.execute('SELECT id, size FROM Segments WHERE sealed=0 ORDER BY id DESC LIMIT 1').fetchone()
+    if row and (row['size'] == 0 or row['size'] + need <= SEGMENT_MAX_BYTES):
+        return row['id'], row['size']
+    if row:
+        cur.execute('UPDATE Segments SET sealed=1 WHERE id=?', (row['id'],))
+    cur.execute('INSERT INTO Segments (size, live_bytes, sealed, created_at) VALUES (0, 0, 0, ?)', (datetime.utcnow().isoformat(),))
+    return cur.lastrowid, 0
+
+
+def _append(cur, items: Iterable[Tuple[str, bytes, str]]) -> int:
+    """Append (key, data, kind) records inside the caller's transaction; return the count written."""
+    now = datetime.utcnow().isoformat()
+    written = 0
+    fd = None
+    seg_id = None
+    try:
+        for key, data, kind in items:
+            kb = key.encode('utf-8')
+            crc = zlib.crc32(data)
+            old = cur.execute('SELECT segment_id, offset, length, crc FROM SegmentRecords WHERE key=?', (key,)).fetchone()
+            if old and old['length'] == len(data) and old['crc'] == crc and _read(key, old) == data:
+                continue
+            rec = HEADER.pack(MAGIC, len(kb), len(data), crc) + kb + data
+            sid, size = _active_segment(cur, len(rec))
+            if sid != seg_id:
+                if fd is not None:
+                    if FSYNC:
+                        os.fsync(fd)
+                    os.close(fd)
+                SEGMENT_DIR.mkdir(parents=True, exist_ok=True)
+                fd = os.open(segment_path(sid), os.O_RDWR | os.O_CREAT, 0o644)
+                seg_id = sid
+            # write at the indexed size, not the file end, so a torn tail from a crashed writer is overwritten
+            os.pwrite(fd, rec, size)
+            if old:
+                cur.execute('UPDATE Segments SET live_bytes=live_bytes-? WHERE id=?',
+                            (HEADER.size + len(kb) + old['length'], old['segment_id']))
+            cur.execute('INSERT OR REPLACE INTO SegmentRecords (key, kind, segment_id, offset, length, crc, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, kind, sid, size + HEADER.size + len(kb), len(data), crc, now))
+            cur.execute('UPDATE Segments SET size=size+?, live_bytes=live_bytes+? WHERE id=?', (len(rec), len(rec), sid))
+            written += 1
+        if fd is not None and FSYNC:
+            os.fsync(fd)
+    finally:
+        if fd is not None:
+            os.close(fd)
+    return written
+
+
+def put_many(items: Iterable[Tuple[str, bytes, str]]) -> int:
+    """Store (key, data, kind) records in one transaction; identical rewrites are skipped."""
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        n = _append(cur, items)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return n
+
+
+def put(key: str, data: bytes, kind: str = 'proof') -> str:
+    """Store one record and return the reference to keep in proof_path/witness columns."""
+    put_many([(key, data, kind)])
+    return ref(key)
+
+
+def _map(segment_id: int, end: int):
+    path = str(segment_path(segment_id))
+    with _maps_lock:
+        mm = _maps.get(path)
+        # a grown segment is remapped; the old map is left to the GC since another thread may be slicing it
+        if mm is None or len(mm) < end:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[path] = mm
+        return mm
+
+
+def _drop_map(segment_id: int):
+    with _maps_lock:
+        _maps.pop(str(segment_path(segment_id)), None)
+
+
+def get(key_or_ref: str, conn=None) -> Optional[bytes]:
+    """Return a record's bytes, or None if the key is unknown or the record fails its checksum."""
+    key = key_of(key_or_ref)
+    own = conn is None
+    conn = conn or db.get_conn()
+    row = conn.execute('SELECT segment_id, offset, length, crc FROM SegmentRecords WHERE key=?', (key,)).fetchone()
+    if own:
+        conn.close()
+    return _read(key, row) if row else None
+
+
+def get_many(keys_or_refs: Iterable[str]) -> dict:
+    """{key_or_ref: bytes or None} over one index connection."""
+    conn = db.get_conn()
+    try:
+        return {k: get(k, conn) for k in keys_or_refs}
+    finally:
+        conn.close()
+
+
+def _read(key: str, row) -> Optional[bytes]:
+    try:
+        mm = _map(row['segment_id'], row['offset'] + row['length'])
+        data = mm[row['offset']:row['offset'] + row['length']]
+    except (OSError, ValueError) as e:
+        logger.warning('Segment read failed for %s: %s', key, e)
+        return None
+    if len(data) != row['length'] or zlib.crc32(data) != row['crc']:
+        logger.warning('Segment record %s failed its checksum', key)
+        return None
+    return data
+
+
+def read_or_file(path_or_ref: str) -> Optional[bytes]:
+    """Bytes behind a proof_path, whether it is a segment reference or a legacy file path."""
+    if is_ref(path_or_ref):
+        return get(path_or_ref)
+    try:
+        return Path(path_or_ref).read_bytes()
+    except OSError:
+        return None
+
+
+def scan(segment_id: int):
+    """Yield (key, data) for every record physically in a segment, superseded ones included."""
+    with open(segment_path(segment_id), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pos = 0
+        while pos + HEADER.size <= len(mm):
+            magic, klen, dlen, crc = HEADER.unpack_from(mm, pos)
+            if magic != MAGIC:
+                break
+            start = pos + HEADER.size
+            data = mm[start + klen:start + klen + dlen]
+            if len(data) != dlen or zlib.crc32(data) != crc:
+                break
+            yield mm[start:start + klen].decode('utf-8'), data
+            pos = start + klen + dlen
+    finally:
+        mm.close()
+
+
+def stats() -> dict:
+    conn = db.get_conn()
+    segs = [dict(r) for r in conn.execute('SELECT id, size, live_bytes, sealed FROM Segments ORDER BY id').fetchall()]
+    records = conn.execute('SELECT COUNT(*) FROM SegmentRecords').fetchone()[0]
+    conn.close()
+    size = sum(s['size'] for s in segs)
+    live = sum(s['live_bytes'] for s in segs)
+    return {'segments': len(segs), 'records': records, 'bytes': size, 'live_bytes': live, 'garbage_bytes': size - live}
+
+
+def compact(min_garbage_ratio: float = 0.5) -> dict:
+    """Rewrite live records out of segments whose superseded share is at least min_garbage_ratio.
+
+    Qualifying segments, including the active one, are sealed first, so live
+    records are copied into a fresh segment. Old files are deleted only
+    after the index points away from them.
+    """
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        victims = [r['id'] for r in cur.execute(
+            'SELECT id FROM Segments WHERE live_bytes < size AND (size - live_bytes) >= ? * size ORDER BY id', (min_garbage_ratio,)).fetchall()]
+        reclaimed = moved = 0
+        if victims:
+            marks = ','.join('?' * len(victims))
+            reclaimed = cur.execute(f'SELECT COALESCE(SUM(size - live_bytes), 0) FROM Segments WHERE id IN ({marks})', victims).fetchone()[0]
+            cur.execute(f'UPDATE Segments SET sealed=1 WHERE id IN ({marks})', victims)
+            for sid in victims:
+                copies = []
+                for r in cur.execute('SELECT * FROM SegmentRecords WHERE segment_id=? ORDER BY offset', (sid,)).fetchall():
+                    data = _read(r['key'], r)
+                    if data is None:
+                        raise RuntimeError(f"unreadable live record {r['key']} in segment {sid}")
+                    copies.append((r['key'], data, r['kind']))
+                # drop the old rows first so _append sees no previous record to compare against
+                cur.execute('DELETE FROM SegmentRecords WHERE segment_id=?', (sid,))
+                moved += _append(cur, copies)
+            cur.execute(f'DELETE FROM Segments WHERE id IN ({marks})', victims)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    for sid in victims:
+        _drop_map(sid)
+        try:
+            segment_path(sid).unlink()
+        except FileNotFoundError:
+            pass
+    if victims:
+        logger.info('Compacted %s segments: %s records moved, %s bytes reclaimed', len(victims), moved, reclaimed)
+    return {'segments': len(victims), 'moved': moved, 'reclaimed_bytes': reclaimed}
+
+
+def migrate_files(delete: bool = True) -> dict:
+    """Move file-backed proof_path values (PageVersions, AnchorBatches) into segments.
+
+    Each file is stored under `file/<name>`, every row pointing at it is
+    rewritten to the segment reference, and the file is removed.
+    """
+    conn = db.get_conn()
+    paths = [r[0] for r in conn.execute(
+        "SELECT proof_path FROM PageVersions WHERE proof_path IS NOT NULL AND proof_path != '' AND proof_path NOT LIKE 'seg:%' "
+        "UNION SELECT proof_path FROM AnchorBatches WHERE proof_path IS NOT NULL AND proof_path != '' AND proof_path NOT LIKE 'seg:%'").fetchall()]
+    conn.close()
+    moved = missing = 0
+    for path in paths:
+        data = read_or_file(path)
+        if data is None:
+            missing += 1
+            continue
+        r = put('file/' + Path(path).name, data, kind='proof')
+        conn = db.get_conn()
+        conn.execute('UPDATE PageVersions SET proof_path=? WHERE proof_path=?', (r, path))
+        conn.execute('UPDATE AnchorBatches SET proof_path=? WHERE proof_path=?', (r, path))
+        conn.commit()
+        conn.close()
+        if delete:
+            try:
+                Path(path).unlink()
+            except OSError:
+                pass
+        moved += 1
+    return {'migrated': moved, 'missing': missing}
@@ -1,14 +1,43 @@
-from flask import Flask, render_template_string, abort, request, redirect, url_for, jsonify
-from . import db
+from functools import wraps
+import json
+import queue
+from urllib.parse import urlencode
+from flask import Flask, render_template_string, abort, request, redirect, url_for, jsonify, Response, stream_with_context
+from . import db, search_cache, query_guard, change_bus
 try:
   from prometheus_client import generate_latest, Counter, CollectorRegistry, CONTENT_TYPE_LATEST
   PROM_AVAILABLE = True
   registry = CollectorRegistry()
   SEARCH_COUNTER = Counter('wps_search_requests_total', 'Total search requests', registry=registry)
+  SEARCH_CACHE_HITS = Counter('wps_search_cache_hits_total', 'Search result cache hits', registry=registry)
+  SEARCH_CACHE_MISSES = Counter('wps_search_cache_misses_total', 'Search result cache misses', registry=registry)
+  QUERY_BUDGET_EXCEEDED = Counter('wps_query_budget_exceeded_total', 'Queries interrupted by the per-request budget', registry=registry)
+  CLIENT_THROTTLED = Counter('wps_client_throttled_total', 'Expensive requests rejected by the per-client concurrency limit', registry=registry)
 except Exception:
   PROM_AVAILABLE = False
 
 app = Flask(__name__)
+client_limiter = query_guard.ClientLimiter()
+
+
+def expensive(fn):
+  """Apply the per-client concurrency limit and map budget overruns to a 503."""
+  @wraps(fn)
+  def wrapper(*args, **kwargs):
+    client = request.remote_addr or 'unknown'
+    if not client_limiter.acquire(client):
+      if PROM_AVAILABLE:
+        CLIENT_THROTTLED.inc()
+      return jsonify({'error': 'too-many-concurrent-requests', 'limit': client_limiter.limit}), 429, {'Retry-After': '1'}
+    try:
+      return fn(*args, **kwargs)
+    except query_guard.QueryBudgetExceeded as e:
+      if PROM_AVAILABLE:
+        QUERY_BUDGET_EXCEEDED.inc()
+      return jsonify({'error': 'query-budget-exceeded', 'reason': e.reason, 'elapsed_ms': round(e.elapsed_ms, 1), 'steps': e.steps}), 503, {'Retry-After': '5'}
+    finally:
+      client_limiter.release(client)
+  return wrapper
 
 INDEX_TMPL = '''
 <h1>Watched sites</h1>
@@ -37,6 +66,7 @@ EDIT_TMPL = '''
   <label>Active: <input type="checkbox" name="active" {% if site.active %}checked{% endif %}></label><br>
   <label>User Agent: <input type="text" name="user_agent" value="{{site.user_agent or ''}}" size=60></label><br>
   <label>Crawl Delay (seconds): <input type="number" name="crawl_delay" value="{{site.crawl_delay or 1}}"></label><br>
+  <label>Near-duplicate threshold (0-1, blank disables): <input type="text" name="near_dup_threshold" value="{{site.near_dup_threshold or ''}}" size=6></label><br>
   <input type="submit" value="Save">
 </form>
 <p><a href="/site/{{site.id}}">Back</a></p>
@@ -74,11 +104,11 @@ SEARCH_TMPL = '''
       </ul>
       <div style="margin-top:1rem">
         {% if page>1 %}
-          <a href="/search?q={{q}}&page={{page-1}}&per_page={{per_page}}">Previous</a>
+          <a href="/search?{{page_qs(page-1)}}">Previous</a>
         {% endif %}
         &nbsp; Page {{page}} &nbsp;
         {% if page*per_page < total %}
-          <a href="/search?q={{q}}&page={{page+1}}&per_page={{per_page}}">Next</a>
+          <a href="/search?{{page_qs(page+1)}}">Next</a>
         {% endif %}
       </div>
     </div>
@@ -90,10 +120,7 @@ SEARCH_TMPL = '''
 
 @app.route('/')
 def index():
-    conn = db.get_conn()
-    cur = conn.cursor()
-    sites = cur.execute('SELECT s.id, s.normalized_root, s.last_crawled, COUNT(p.id) as page_count FROM Sites s LEFT JOIN Pages p ON p.site_id=s.id GROUP BY s.id').fetchall()
-    conn.close()
+    sites = db.site_stats()
     return render_template_string(INDEX_TMPL, sites=sites)
 
 
@@ -104,7 +131,7 @@ def site_view(site_id):
     site = cur.execute('SELECT * FROM Sites WHERE id=?', (site_id,)).fetchone()
     if not site:
         abort(404)
-    pages = cur.execute('SELECT p.id, p.normalized_url, p.last_archived, (SELECT COUNT(*) FROM PageVersions pv WHERE pv.page_id=p.id) as versions FROM Pages p WHERE p.site_id=?', (site_id,)).fetchall()
+    pages = cur.execute('SELECT p.id, p.normalized_url, p.last_archived, COALESCE(ps.version_count, 0) as versions FROM Pages p LEFT JOIN PageStats ps ON ps.page_id=p.id WHERE p.site_id=?', (site_id,)).fetchall()
     conn.close()
     return render_template_string(SITE_TMPL, site=site, pages=pages)
 
@@ -123,7 +150,12 @@ def site_edit(site_id):
       crawl_delay = int(request.form.get('crawl_delay') or 1)
     except Exception:
       crawl_delay = 1
-    cur.execute('UPDATE Sites SET active=?, user_agent=?, crawl_delay=? WHERE id=?', (active, user_agent, crawl_delay, site_id))
+    try:
+      near_dup = float(request.form.get('near_dup_threshold'))
+      near_dup = near_dup if 0 < near_dup <= 1 else None
+    except Exception:
+      near_dup = None
+    cur.execute('UPDATE Sites SET active=?, user_agent=?, crawl_delay=?, near_dup_threshold=? WHERE id=?', (active, user_agent, crawl_delay, near_dup, site_id))
     conn.commit()
     conn.close()
     return redirect(url_for('site_view', site_id=site_id))
@@ -131,57 +163,79 @@ def site_edit(site_id):
   return render_template_string(EDIT_TMPL, site=site)
 
 
+def _month_bounds(ym):
+  """Return [start, end) ISO bounds for a 'YYYY-MM' month filter, or (None, None)."""
+  try:
+    year, month = int(ym[:4]), int(ym[5:7])
+  except Exception:
+    return None, None
+  nxt = (year + 1, 1) if month == 12 else (year, month + 1)
+  return f'{year:04d}-{month:02d}', f'{nxt[0]:04d}-{nxt[1]:02d}'
+
+
+def _cached_search(q, args):
+  res, hit = search_cache.search(q, budget=query_guard.QueryBudget(), **args)
+  if PROM_AVAILABLE:
+    SEARCH_COUNTER.inc()
+    (SEARCH_CACHE_HITS if hit else SEARCH_CACHE_MISSES).inc()
+  return res
+
+
+# query-string filters read by _search_args besides page/per_page
+SEARCH_FILTER_ARGS = ('site', 'date', 'from', 'to', 'total')
+
+
+def _search_args():
+  """Parse the shared search query-string into keyword args for db.search_page_versions_paged."""
+  site_filter = request.args.get('site')
+  date_filter = request.args.get('date')
+  date_from = request.args.get('from')
+  date_to = request.args.get('to')
+  if date_filter:
+    date_from, date_to = _month_bounds(date_filter)
+  try:
+    page = int(request.args.get('page') or 1)
+  except Exception:
+    page = 1
+  try:
+    per_page = min(int(request.args.get('per_page') or 10), 100)
+  except Exception:
+    per_page = 10
+  return {
+    'site_id': int(site_filter) if site_filter and site_filter.isdigit() else None,
+    'date_from': date_from,
+    'date_to': date_to,
+    'page': page,
+    'per_page': per_page,
+    'exact_total': request.args.get('total') != 'estimate',
+  }
+
+
 @app.route('/search')
+@expensive
 def search():
   q = request.args.get('q')
-  results = []
-  page = int(request.args.get('page') or 1)
-  per_page = int(request.args.get('per_page') or 10)
+  args = _search_args()
+  res = {'results': [], 'total': 0, 'site_facets': {}, 'date_facets': {}}
+  site_names = {}
   if q:
-    # optional filters
-    site_filter = request.args.get('site')
-    date_filter = request.args.get('date')
     # basic input validation
     if len(q) > 200:
       return render_template_string('<p>Query too long</p>'), 400
-    rows = db.search_page_versions(q, limit=200)
-    # convert sqlite rows to dict-like
-    for r in rows:
-      results.append({
-        'page_version_id': r['page_version_id'],
-        'content_hash': r['content_hash'],
-        'site_id': r['site_id'] if 'site_id' in r.keys() else None,
-        'archived_at': r['archived_at'] if 'archived_at' in r.keys() else None,
-        'snippet': r['snippet'] if 'snippet' in r.keys() else ''
-      })
-    # apply simple filters
-    if site_filter:
-      results = [r for r in results if str(r.get('site_id')) == str(site_filter)]
-    if date_filter:
-      results = [r for r in results if (r.get('archived_at') or '').startswith(date_filter)]
-  total = len(results)
-  # pagination slice
-  start = (page-1) * per_page
-  end = start + per_page
-  paged = results[start:end]
-  # compute simple facets and map site ids to normalized_root for display
-  site_facets = {}
-  date_facets = {}
-  site_names = {}
-  if results:
+    res = _cached_search(q, args)
+  if res['results']:
     conn = db.get_conn()
     cur = conn.cursor()
     srows = cur.execute('SELECT id, normalized_root FROM Sites').fetchall()
     for s in srows:
       site_names[s['id']] = s['normalized_root']
     conn.close()
-  for r in paged:
-    sid = r.get('site_id')
-    site_facets[sid] = site_facets.get(sid, 0) + 1
-    dt = r.get('archived_at') or ''
-    ym = dt[:7] if dt else 'unknown'
-    date_facets[ym] = date_facets.get(ym, 0) + 1
-  return render_template_string(SEARCH_TMPL, q=q, results=paged, site_facets=site_facets, date_facets=date_facets, site_names=site_names, page=page, per_page=per_page, total=total)
+  # keep every filter _search_args reads on pagination links, URL-encoded
+  kept = [(k, request.args[k]) for k in SEARCH_FILTER_ARGS if request.args.get(k)]
+
+  def page_qs(page):
+    return urlencode([('q', q or ''), ('page', page), ('per_page', args['per_page'])] + kept)
+  return render_template_string(SEARCH_TMPL, q=q, results=res['results'], site_facets=res['site_facets'], date_facets=res['date_facets'], site_names=site_names, page=args['page'], per_page=args['per_page'], total=res['total'], page_qs=page_qs)
 
 
 @app.route('/health')
@@ -206,15 +260,8 @@ def metrics():
 
 @app.route('/admin/metrics')
 def admin_metrics():
-    # aggregate counts from DB
-    conn = db.get_conn()
-    cur = conn.cursor()
-    sites = cur.execute('SELECT COUNT(*) as c FROM Sites').fetchone()['c']
-    pages = cur.execute('SELECT COUNT(*) as c FROM Pages').fetchone()['c']
-    pvs = cur.execute('SELECT COUNT(*) as c FROM PageVersions').fetchone()['c']
-    changes = cur.execute('SELECT COUNT(*) as c FROM Changes').fetchone()['c']
-    conn.close()
-    return jsonify({'sites': sites, 'pages': pages, 'page_versions': pvs, 'changes': changes})
+    # trigger-maintained totals (see db.STATS_SCHEMA)
+    return jsonify(db.global_stats())
 
 
 @app.route('/admin/global_preservation_health')
@@ -259,25 +306,78 @@ def admin_crisis_mode():
 
 
 @app.route('/api/search')
+@expensive
 def api_search():
   q = request.args.get('q')
   if not q:
     return {'results': []}
-  rows = db.search_page_versions(q, limit=100)
-  out = []
-  for r in rows:
-    out.append({
-      'page_version_id': r['page_version_id'],
-      'content_hash': r['content_hash'],
-      'site_id': r['site_id'] if 'site_id' in r.keys() else None,
-      'archived_at': r['archived_at'] if 'archived_at' in r.keys() else None,
-      'snippet': r['snippet'] if 'snippet' in r.keys() else ''
-    })
-  return {'results': out}
+  res = _cached_search(q, _search_args())
+  # JSON object keys must be strings; copy so the cached result is left intact
+  return dict(res, site_facets={str(k): v for k, v in res['site_facets'].items()})
+
+
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def _sse(ev):
+  return f"id: {ev['id']}\nevent: change\ndata: {json.dumps(ev)}\n\n"
+
+
+@app.route('/api/changes/stream')
+def api_changes_stream():
+  """Server-sent events for new Changes rows; resumable via Last-Event-ID."""
+  site_id = request.args.get('site', type=int)
+  resume = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+  bus = change_bus.get_bus()
+  # subscribe before replaying so nothing committed in between is missed
+  sub = bus.subscribe(site_id)
+  cursor = int(resume) if resume and resume.isdigit() else bus.last_id
+
+  def replay(after):
+    while True:
+      rows = db.changes_since(after, site_id=site_id, limit=change_bus.BATCH)
+      for ev in rows:
+        after = ev['id']
+        yield ev
+      if len(rows) < change_bus.BATCH:
+        return
+
+  def gen():
+    last = cursor
+    try:
+      yield 'retry: 3000\n\n'
+      for ev in replay(last):
+        last = ev['id']
+        yield _sse(ev)
+      while True:
+        if sub.lagged:
+          # queue overflowed while this client was slow; catch up from the DB
+          sub.lagged = False
+          for ev in replay(last):
+            last = ev['id']
+            yield _sse(ev)
+        try:
+          ev = sub.queue.get(timeout=SSE_KEEPALIVE_SECONDS)
+        except queue.Empty:
+          yield ': keepalive\n\n'
+          continue
+        if sub.lagged:
+          # overflowed while we waited: ev may come after dropped events, so
+          # drop it too and let the replay above deliver everything in order
+          continue
+        if ev['id'] <= last:
+          continue
+        last = ev['id']
+        yield _sse(ev)
+    finally:
+      bus.unsubscribe(sub)
+
+  return Response(stream_with_context(gen()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/merkle/push', methods=['POST'])
 def api_merkle_push():
+    """Apply one signed delta; same rules as the bulk push (merkle_sync.apply_delta_batch)."""
     data = request.get_json(force=True)
     if not data:
         return {'error': 'no data'}, 400
@@ -285,54 +385,148 @@ def api_merkle_push():
     signature = data.get('signature')
     if not delta or not signature:
         return {'error': 'delta and signature required'}, 400
-    # verify and check sequence ordering
-    from .merkle_sync import verify_delta, store_delta, apply_delta
-    try:
-        ok = verify_delta(delta, signature)
-    except Exception as e:
-        return {'error': 'verify-failed', 'detail': str(e)}, 400
-    if not ok:
+    if not isinstance(delta, dict) or 'site_id' not in delta:
+        return {'error': 'delta must be an object with site_id'}, 400
+    from .merkle_sync import apply_delta_batch
+    # verify, order-check, apply and record in one transaction; only applied deltas are stored
+    res = apply_delta_batch([(delta, signature)])[0]
+    status = res['status']
+    if status == 'invalid_signature':
         return {'error': 'invalid signature'}, 400
-    # simple ordering checks: validate lamport and sequence if present
-    seq = delta.get('sequence') or 0
-    lam = delta.get('lamport') or 0
-    site_id = delta.get('site_id')
-    if seq or lam:
-        conn = db.get_conn()
-        cur = conn.cursor()
-        row = cur.execute('SELECT MAX(sequence) as m, MAX(lamport) as lm FROM MerkleDeltas WHERE site_id=?', (site_id,)).fetchone()
-        conn.close()
-        current = row['m'] or 0
-        current_lam = row['lm'] or 0
-        # reject obvious replays
-        if seq and seq <= current:
-            return {'error': 'obsolete sequence', 'current': current}, 409
-        if lam and lam <= current_lam:
-            return {'error': 'obsolete lamport', 'current_lam': current_lam}, 409
-    # store delta
-    try:
-        vid = store_delta(delta, signature)
-    except Exception as e:
-        return {'error': 'store-failed', 'detail': str(e)}, 500
-    # apply delta (best-effort)
-    applied = False
+    if status == 'obsolete':
+        seq = delta.get('sequence') or 0
+        if seq and seq <= res['current']:
+            return {'error': 'obsolete sequence', 'current': res['current']}, 409
+        return {'error': 'obsolete lamport', 'current_lam': res['current_lam']}, 409
+    if status == 'root_mismatch':
+        # this node's forest is not at the delta's base; catch up first
+        return {'error': 'root mismatch', 'applied': False, 'hint': 'use /api/merkle/ranges'}, 409
+    if status == 'error':
+        return {'error': 'apply-failed', 'detail': res['detail']}, 500
+    return {'stored_id': res['stored_id'], 'applied': True, 'root': res['root']}
+
+
+@app.route('/api/merkle/push/bulk', methods=['POST'])
+def api_merkle_push_bulk():
+  """NDJSON in, NDJSON out: one {"delta", "signature"} per line, one result per line.
+
+  Lines are read and applied in batches of merkle_sync.BULK_BATCH_SIZE
+  (one transaction each) and results are streamed back as batches finish,
+  followed by a {"summary": {...}} line.
+  """
+  from .merkle_sync import apply_delta_batch, BULK_BATCH_SIZE
+  stream = request.stream
+
+  def gen():
+    summary = {}
+    batch = []
+
+    def flush():
+      # malformed lines ride along as ready-made results so output stays in input order
+      results = iter(apply_delta_batch([(d, s) for _, d, s in batch if d is not None]))
+      for index, d, s in batch:
+        res = next(results) if d is not None else s
+        summary[res['status']] = summary.get(res['status'], 0) + 1
+        yield json.dumps(dict(res, index=index)) + '\n'
+      batch.clear()
+
+    index = 0
+    for raw in stream:
+      line = raw.strip()
+      if not line:
+        continue
+      try:
+        item = json.loads(line)
+        delta, signature = item['delta'], item['signature']
+        if not isinstance(delta, dict) or 'site_id' not in delta:
+          raise ValueError('delta must be an object with site_id')
+      except Exception as e:
+        delta, signature = None, {'status': 'invalid', 'detail': str(e)}
+      batch.append((index, delta, signature))
+      index += 1
+      if len(batch) >= BULK_BATCH_SIZE:
+        yield from flush()
+    if batch:
+      yield from flush()
+    yield json.dumps({'summary': summary}) + '\n'
+
+  return Response(stream_with_context(gen()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/merkle/ranges', methods=['POST'])
+def api_merkle_ranges():
+    """Anti-entropy step: count + digest per node-hash prefix (see merkle_sync.reconcile).
+
+    Each summary is one stored row, or at most a bucket of leaves, so a
+    request costs O(len(prefixes)) whatever the forest size.
+    """
+    from .prefix_tree import PrefixTree
+    from .merkle_sync import HEX_DIGITS, SYNC_LIST_LIMIT, SYNC_MAX_PREFIXES
+    data = request.get_json(silent=True) or {}
+    site = data.get('site')
+    prefixes = data.get('prefixes') or ['']
+    if not isinstance(site, int) or not isinstance(prefixes, list) or len(prefixes) > SYNC_MAX_PREFIXES:
+        return {'error': f'site and at most {SYNC_MAX_PREFIXES} prefixes required'}, 400
+    if not all(isinstance(p, str) and len(p) <= 64 and all(c in HEX_DIGITS for c in p) for p in prefixes):
+        return {'error': 'prefixes must be lowercase hex strings of at most 64 digits'}, 400
     try:
-        applied = apply_delta(delta)
-    except Exception:
-        applied = False
-    return {'stored_id': vid, 'applied': bool(applied)}
+        list_limit = min(int(data.get('list_limit') or SYNC_LIST_LIMIT), SYNC_LIST_LIMIT)
+    except (TypeError, ValueError):
+        return {'error': 'list_limit must be an integer'}, 400
+    return {'site_id': site, 'ranges': PrefixTree(site).summaries(prefixes, max(list_limit, 0))}
+
+
+@app.route('/api/merkle/nodes', methods=['POST'])
+def api_merkle_nodes():
+    from .merkle_distributed import MerkleForest
+    from .merkle_sync import SYNC_FETCH_BATCH
+    data = request.get_json(silent=True) or {}
+    site = data.get('site')
+    hashes = data.get('hashes') or []
+    if not isinstance(site, int) or not isinstance(hashes, list) or len(hashes) > SYNC_FETCH_BATCH:
+        return {'error': f'site and at most {SYNC_FETCH_BATCH} hashes required'}, 400
+    return {'site_id': site, 'nodes': MerkleForest(site).get_nodes([str(h) for h in hashes])}
+
+
+def _json_maybe_gzip(payload):
+    """JSON response, gzip-compressed when the client accepts it."""
+    body = json.dumps(payload).encode('utf-8')
+    resp = Response(body, mimetype='application/json')
+    if 'gzip' in (request.headers.get('Accept-Encoding') or '') and len(body) > 1024:
+        import gzip
+        resp.set_data(gzip.compress(body, compresslevel=5))
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
 
 
 @app.route('/api/merkle/pull')
 def api_merkle_pull():
-    site = request.args.get('site')
+    """Full forest, or with since_sequence/since_root only the deltas recorded after that point (paged)."""
+    site = request.args.get('site', type=int)
     if not site:
         return {'error': 'site required'}, 400
-    conn = db.get_conn()
-    cur = conn.cursor()
-    row = cur.execute('SELECT * FROM MerkleForest WHERE site_id=? ORDER BY last_updated DESC LIMIT 1', (site,)).fetchone()
-    conn.close()
-    if not row:
+    since_sequence = request.args.get('since_sequence', type=int)
+    since_root = request.args.get('since_root')
+    if since_sequence is not None or since_root:
+        from .merkle_sync import deltas_since, sequence_for_root, PULL_PAGE_SIZE
+        if since_sequence is None:
+            since_sequence = sequence_for_root(site, since_root)
+            if since_sequence is None:
+                # root never recorded here (diverged or too old): fall back to anti-entropy
+                return {'error': 'unknown root', 'hint': 'use /api/merkle/ranges'}, 404
+        return _json_maybe_gzip(deltas_since(site, since_sequence, request.args.get('limit', PULL_PAGE_SIZE, type=int)))
+    from . import prefix_tree
+    from .merkle_distributed import MerkleForest
+    forest = prefix_tree.for_site(site)
+    if not forest.leaf_count:
         return {'site_id': site, 'root': '', 'tree_blob': {}}
-    import json
-    return {'site_id': row['site_id'], 'root': row['tree_root'], 'tree_blob': json.loads(row['tree_blob'])}
+
+    def gen():
+        # same JSON document as before, written node by node instead of built in memory
+        yield json.dumps({'site_id': site, 'root': forest.root()})[:-1] + ', "tree_blob": {"nodes": ['
+        for i, n in enumerate(MerkleForest(site).nodes()):
+            yield (', ' if i else '') + json.dumps(n)
+        yield ']}}'
+
+    return Response(stream_with_context(gen()), mimetype='application/json')
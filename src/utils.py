@@ -51,28 +51,28 @@ def hash_text(text: str) -> str:
     h.update(text)
     return h.hexdigest()
 
-def extract_image_urls(html: str, base_url: str) -> list:
+def extract_image_srcs(html: str) -> list:
+    """Return the raw (unresolved) img src values in document order."""
     soup = BeautifulSoup(html, 'lxml')
-    imgs = []
-    for img in soup.find_all('img'):
-        src = img.get('src')
-        if not src:
-            continue
-        full = urljoin(base_url, src)
-        imgs.append(full)
-    # dedupe
-    return list(dict.fromkeys(imgs))
+    return [img.get('src') for img in soup.find_all('img') if img.get('src')]
+
+def resolve_image_urls(srcs: list, base_url: str) -> list:
+    # dedupe after resolving so relative and absolute forms collapse
+    return list(dict.fromkeys(urljoin(base_url, src) for src in srcs))
+
+def extract_image_urls(html: str, base_url: str) -> list:
+    return resolve_image_urls(extract_image_srcs(html), base_url)
 
 def compute_diff(old_text: str, new_text: str) -> (str, str):
-    import difflib
-    old_lines = old_text.splitlines()
-    new_lines = new_text.splitlines()
-    diff = list(difflib.unified_diff(old_lines, new_lines, lineterm=''))
+    """Return (added, removed) lines joined by newlines.
+
+    Uses the interned-line Myers engine in `line_diff`; callers that need
+    positions should use `line_diff.diff_texts` directly.
+    """
+    from .line_diff import diff_texts
     added = []
     removed = []
-    for line in diff:
-        if line.startswith('+') and not line.startswith('+++'):
-            added.append(line[1:])
-        elif line.startswith('-') and not line.startswith('---'):
-            removed.append(line[1:])
+    for hunk in diff_texts(old_text, new_text)['hunks']:
+        added.extend(hunk['added'])
+        removed.extend(hunk['removed'])
     return '\n'.join(added), '\n'.join(removed)
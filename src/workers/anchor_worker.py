@@ -0,0 +1,130 @@
+"""Anchoring worker.
+
+`anchor_batch.enqueue_pending` stores one `AnchorQueue` row per crawl-cycle
+batch, in the same transaction as the batch's proofs. This worker anchors the
+queued roots out of band, so OTS and OTSD latency stays off the crawl path.
+
+- Due rows are claimed by pushing their `next_attempt_at` out by a lease. A
+  crashed worker's rows become due again once the lease expires.
+- At most `concurrency` roots are stamped at once, each with one
+  `anchor.anchor_hash` call.
+- A stamp that raises, or that returns no witness while an OTS backend is
+  configured (see `anchor_ots.has_backend`), is retried with exponential
+  backoff plus jitter. After `MAX_ATTEMPTS` failed attempts the row is
+  marked `dead` and left for inspection or `requeue_dead`.
+
+On success the witness and proof path are written to the batch and to every
+`PageVersions` row in it.
+"""
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+from .. import anchor, anchor_batch, anchor_ots, db
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.environ.get('WPS_ANCHOR_CONCURRENCY', '4'))
+MAX_ATTEMPTS = int(os.environ.get('WPS_ANCHOR_MAX_ATTEMPTS', '10'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('WPS_ANCHOR_BACKOFF_BASE', '30'))
+BACKOFF_MAX_SECONDS = float(os.environ.get('WPS_ANCHOR_BACKOFF_MAX', '21600'))
+LEASE_SECONDS = float(os.environ.get('WPS_ANCHOR_LEASE_SECONDS', '300'))
+CLAIM_LIMIT = 500
+
+
+def queue_counts() -> dict:
+    conn = db.get_conn()
+    out = {r['status']: r['n'] for r in conn.execute('SELECT status, COUNT(*) AS n FROM AnchorQueue GROUP BY status').fetchall()}
+    conn.close()
+    return out
+
+
+def requeue_dead() -> int:
+    """Give dead-lettered batches a fresh set of attempts."""
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE AnchorQueue SET status='pending', attempts=0, next_attempt_at=? WHERE status='dead'",
+                (datetime.utcnow().isoformat(),))
+    conn.commit()
+    n = cur.rowcount
+    conn.close()
+    return n
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim(now: datetime, limit: int = CLAIM_LIMIT) -> List[dict]:
+    conn = db.get_conn()
+    cur = conn.cursor()
+    # BEGIN IMMEDIATE takes the write lock up front so two workers cannot claim the same rows
+    cur.execute('BEGIN IMMEDIATE')
+    rows = [dict(r) for r in cur.execute(
+        "SELECT q.id, q.batch_id, q.attempts, b.root FROM AnchorQueue q JOIN AnchorBatches b ON b.id=q.batch_id "
+        "WHERE q.status='pending' AND q.next_attempt_at <= ? ORDER BY q.id LIMIT ?",
+        (now.isoformat(), limit)).fetchall()]
+    lease = (now + timedelta(seconds=LEASE_SECONDS)).isoformat()
+    cur.executemany('UPDATE AnchorQueue SET next_attempt_at=? WHERE id=?', [(lease, r['id']) for r in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def _stamp(row: dict) -> dict:
+    try:
+        witness, proof_path = anchor.anchor_hash(row['root'])
+        if witness is None and anchor_ots.has_backend():
+            raise RuntimeError('OTS backend returned no witness')
+        return dict(row, witness=witness, proof_path=proof_path, error=None)
+    except Exception as e:
+        logger.warning('Anchoring batch %s (root %s) failed: %s', row['batch_id'], row['root'], e)
+        return dict(row, error=str(e)[:500] or type(e).__name__)
+
+
+def _settle(results: List[dict]):
+    now = datetime.utcnow()
+    conn = db.get_conn()
+    cur = conn.cursor()
+    failed = []
+    for r in results:
+        if r['error'] is None:
+            anchor_batch.record_anchor(cur, r['batch_id'], r['witness'], r['proof_path'])
+            cur.execute("UPDATE AnchorQueue SET status='done', attempts=attempts+1, anchored_at=?, last_error=NULL WHERE id=?",
+                        (now.isoformat(), r['id']))
+        else:
+            attempts = r['attempts'] + 1
+            status = 'dead' if attempts >= MAX_ATTEMPTS else 'pending'
+            failed.append((status, attempts, (now + timedelta(seconds=backoff_seconds(attempts))).isoformat(), r['error'], r['id']))
+    cur.executemany('UPDATE AnchorQueue SET status=?, attempts=?, next_attempt_at=?, last_error=? WHERE id=?', failed)
+    conn.commit()
+    conn.close()
+
+
+def run_once(concurrency: Optional[int] = None) -> dict:
+    """Claim every due batch, anchor it, and return {'anchored': n, 'failed': n} (counted in batches)."""
+    rows = _claim(datetime.utcnow())
+    stats = {'anchored': 0, 'failed': 0}
+    if not rows:
+        return stats
+    with ThreadPoolExecutor(max_workers=max(1, concurrency or CONCURRENCY)) as pool:
+        results = list(pool.map(_stamp, rows))
+    _settle(results)
+    for r in results:
+        stats['anchored' if r['error'] is None else 'failed'] += 1
+    return stats
+
+
+def run_loop(interval_seconds: float = 60, concurrency: Optional[int] = None):
+    while True:
+        try:
+            stats = run_once(concurrency)
+            if stats['anchored'] or stats['failed']:
+                logger.info('Anchoring: %s', stats)
+        except Exception as e:
+            logger.exception('Anchor worker pass failed: %s', e)
+        time.sleep(interval_seconds)
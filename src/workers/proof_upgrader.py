@@ -3,62 +3,162 @@
 Scans PageVersions for stored proofs (proof_path) that are not yet verified
 and attempts to upgrade/verify them using `src/anchor_ots` helpers. Marks
 `proof_verified=1` in DB when verification succeeds.
+
+- Each distinct proof_path is checked once per pass, however many versions
+  share it (one per anchor batch, see anchor_batch.py).
+- Checks run on a bounded thread pool, since each is one or more `ots`
+  subprocesses or OTSD HTTP calls.
+- A proof that cannot be verified yet is not retried until `next_check_at`,
+  which backs off exponentially with `proof_attempts`.
+- Results are written in one transaction per pass, and `run_once` returns a
+  throughput report.
+
+Proofs in the segment store (`seg:` proof paths) are upgraded through a
+temp copy and written back under the same key.
 """
+import os
+import random
+import tempfile
 import time
-from .db import get_conn
-from ..src.anchor_ots import upgrade_ots, verify_ots, fetch_proof
-from ..src.anchor_ots import stamp_hash
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
 import logging
+from .. import anchor_ots, db, segment_store
 
 logger = logging.getLogger(__name__)
 
+WORKERS = int(os.environ.get('WPS_PROOF_WORKERS', '4'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('WPS_PROOF_BACKOFF_BASE', '600'))
+BACKOFF_MAX_SECONDS = float(os.environ.get('WPS_PROOF_BACKOFF_MAX', '86400'))
+CLAIM_LIMIT = 1000
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _due(now: datetime, limit: int):
+    conn = db.get_conn()
+    rows = [dict(r) for r in conn.execute(
+        "SELECT proof_path, MAX(witness_tx_id) AS witness, MAX(COALESCE(proof_attempts, 0)) AS attempts, COUNT(*) AS versions FROM PageVersions "
+        "WHERE proof_verified=0 AND proof_path IS NOT NULL AND proof_path != '' "
+        "AND (next_check_at IS NULL OR next_check_at <= ?) GROUP BY proof_path ORDER BY MIN(id) LIMIT ?",
+        (now.isoformat(), limit)).fetchall()]
+    conn.close()
+    return rows
+
+
+def _check_segment(out: dict):
+    """_check for proofs kept in the segment store.
+
+    The ots tools work on files, so the proof is copied to a temp file. An
+    upgraded or refetched proof is written back under the same key, which
+    supersedes the old record (reclaimed by segment_store.compact).
+    """
+    key = segment_store.key_of(out['proof_path'])
+    with tempfile.TemporaryDirectory() as d:
+        tmp = Path(d) / (Path(key).name + '.ots')
+        data = segment_store.get(key)
+        if data is not None:
+            tmp.write_bytes(data)
+            if anchor_ots.verify_ots(str(tmp)):
+                out['verified'] = True
+                return
+            if anchor_ots.upgrade_ots(str(tmp)) and anchor_ots.verify_ots(str(tmp)):
+                segment_store.put(key, tmp.read_bytes())
+                out['verified'] = True
+                return
+        fetched = anchor_ots.fetch_proof(out['witness'], Path(d)) if out['witness'] else None
+        if fetched:
+            segment_store.put(key, fetched)
+            tmp.write_bytes(fetched)
+            out['verified'] = anchor_ots.verify_ots(str(tmp))
 
-def run_once(anchor_dir: Path = Path('anchors')):
-    conn = get_conn()
+
+def _check(row: dict, anchor_dir: Path) -> dict:
+    """verify, else upgrade and re-verify, else fetch from OTSD and verify the copy."""
+    ppath = row['proof_path']
+    out = dict(row, verified=False, new_path=None, error=None)
+    try:
+        if segment_store.is_ref(ppath):
+            _check_segment(out)
+            return out
+        if anchor_ots.verify_ots(ppath):
+            out['verified'] = True
+            return out
+        if anchor_ots.upgrade_ots(ppath) and anchor_ots.verify_ots(ppath):
+            out['verified'] = True
+            return out
+        # legacy file-backed proof: a fetched copy goes into the segment store
+        fetched = anchor_ots.fetch_proof(ppath, anchor_dir)
+        if fetched:
+            out['new_path'] = segment_store.put('file/' + Path(ppath).name, fetched)
+            with tempfile.TemporaryDirectory() as d:
+                tmp = Path(d) / Path(ppath).name
+                tmp.write_bytes(fetched)
+                out['verified'] = anchor_ots.verify_ots(str(tmp))
+    except Exception as e:
+        logger.exception('Error processing proof %s: %s', ppath, e)
+        out['error'] = str(e)[:500]
+    return out
+
+
+def _settle(results, now: datetime):
+    conn = db.get_conn()
     cur = conn.cursor()
-    rows = cur.execute("SELECT id, proof_path FROM PageVersions WHERE proof_path IS NOT NULL AND proof_path != '' AND proof_verified=0").fetchall()
-    for r in rows:
-        vid = r['id']
-        ppath = r['proof_path']
-        try:
-            # try verify first
-            ok = verify_ots(ppath)
-            if ok:
-                cur.execute('UPDATE PageVersions SET proof_verified=1 WHERE id=?', (vid,))
-                conn.commit()
-                logger.info('Verified proof for PageVersion id=%s', vid)
-                continue
-            # attempt upgrade then re-verify
-            upgraded = upgrade_ots(ppath)
-            if upgraded:
-                ok = verify_ots(ppath)
-                if ok:
-                    cur.execute('UPDATE PageVersions SET proof_verified=1 WHERE id=?', (vid,))
-                    conn.commit()
-                    logger.info('Upgraded and verified proof for PageVersion id=%s', vid)
-                    continue
-            # if proof not found locally, try fetching from OTSD
-            fetched = fetch_proof(ppath, anchor_dir)
-            if fetched:
-                # write fetched proof to anchors dir
-                anchor_dir.mkdir(parents=True, exist_ok=True)
-                fname = anchor_dir / Path(ppath).name
-                fname.write_bytes(fetched)
-                cur.execute('UPDATE PageVersions SET proof_path=? WHERE id=?', (str(fname), vid))
-                conn.commit()
-                ok = verify_ots(str(fname))
-                if ok:
-                    cur.execute('UPDATE PageVersions SET proof_verified=1 WHERE id=?', (vid,))
-                    conn.commit()
-                    logger.info('Fetched and verified proof for PageVersion id=%s', vid)
-                    continue
-        except Exception as e:
-            logger.exception('Error processing proof for PageVersion id=%s: %s', vid, e)
+    moved = [(r['new_path'], r['proof_path']) for r in results if r['new_path']]
+    cur.executemany('UPDATE PageVersions SET proof_path=? WHERE proof_path=?', moved)
+    cur.executemany('UPDATE AnchorBatches SET proof_path=? WHERE proof_path=?', moved)
+    cur.executemany('UPDATE PageVersions SET proof_verified=1, next_check_at=NULL WHERE proof_path=? AND proof_verified=0',
+                    [(r['new_path'] or r['proof_path'],) for r in results if r['verified']])
+    retry = []
+    for r in results:
+        if not r['verified']:
+            attempts = r['attempts'] + 1
+            retry.append((attempts, (now + timedelta(seconds=backoff_seconds(attempts))).isoformat(), r['new_path'] or r['proof_path']))
+    cur.executemany('UPDATE PageVersions SET proof_attempts=?, next_check_at=? WHERE proof_path=? AND proof_verified=0', retry)
+    conn.commit()
     conn.close()
 
 
-def run_loop(interval_seconds: int = 3600, anchor_dir: Path = Path('anchors')):
+def run_once(anchor_dir: Path = Path('anchors'), workers: Optional[int] = None, limit: int = CLAIM_LIMIT) -> dict:
+    """Check every due proof once and return a throughput report.
+
+    The report has 'proofs', 'versions', 'verified', 'deferred', 'errors',
+    'seconds' and 'proofs_per_second'.
+    """
+    t0 = time.perf_counter()
+    now = datetime.utcnow()
+    rows = _due(now, limit)
+    results = []
+    if rows:
+        with ThreadPoolExecutor(max_workers=max(1, workers or WORKERS)) as pool:
+            results = list(pool.map(lambda r: _check(r, anchor_dir), rows))
+        _settle(results, now)
+    elapsed = time.perf_counter() - t0
+    report = {
+        'proofs': len(results),
+        'versions': sum(r['versions'] for r in results),
+        'verified': sum(1 for r in results if r['verified']),
+        'deferred': sum(1 for r in results if not r['verified']),
+        'errors': sum(1 for r in results if r['error']),
+        'seconds': round(elapsed, 3),
+        'proofs_per_second': round(len(results) / elapsed, 1) if results and elapsed else 0.0,
+    }
+    if results:
+        logger.info('Proof pass: %s', report)
+    return report
+
+
+def run_loop(interval_seconds: int = 3600, anchor_dir: Path = Path('anchors'), workers: Optional[int] = None):
     while True:
-        run_once(anchor_dir=anchor_dir)
+        try:
+            run_once(anchor_dir=anchor_dir, workers=workers)
+            # drop proofs superseded by this pass's upgrades once a segment is mostly garbage
+            segment_store.compact()
+        except Exception as e:
+            logger.exception('Proof worker pass failed: %s', e)
         time.sleep(interval_seconds)
@@ -0,0 +1,179 @@
+"""Webhook delivery worker.
+
+`db.insert_change` writes one `WebhookOutbox` row per matching endpoint in the
+same transaction as the `Changes` row. This worker drains the outbox out of
+band, so the crawl loop never waits on downstream HTTP.
+
+- Due rows are claimed by pushing their `next_attempt_at` out by a lease. A
+  crashed worker's rows become due again once the lease expires.
+- Each endpoint gets up to `BATCH_SIZE` changes per POST, as
+  `{"changes": [...]}`. Events use the `db.changes_since` shape.
+- At most `max_concurrency` POSTs are in flight per endpoint. Work for
+  different endpoints runs in parallel.
+- A non-2xx response or a network error reschedules the batch with
+  exponential backoff plus jitter. After `MAX_ATTEMPTS` failed attempts the
+  rows are marked `dead` and left for inspection or `requeue_dead`.
+
+If an endpoint has a secret, the body is signed with HMAC-SHA256 in
+`X-WPS-Signature: sha256=<hex>`.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+import requests
+from .. import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.environ.get('WPS_WEBHOOK_BATCH_SIZE', '100'))
+MAX_ATTEMPTS = int(os.environ.get('WPS_WEBHOOK_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('WPS_WEBHOOK_BACKOFF_BASE', '5'))
+BACKOFF_MAX_SECONDS = float(os.environ.get('WPS_WEBHOOK_BACKOFF_MAX', '3600'))
+LEASE_SECONDS = float(os.environ.get('WPS_WEBHOOK_LEASE_SECONDS', '120'))
+TIMEOUT_SECONDS = float(os.environ.get('WPS_WEBHOOK_TIMEOUT', '10'))
+CLAIM_LIMIT = 5000
+
+
+def add_endpoint(url: str, site_id: Optional[int] = None, secret: Optional[str] = None, max_concurrency: int = 2) -> int:
+    conn = db.get_conn()
+    cur = conn.cursor()
+    cur.execute('INSERT INTO WebhookEndpoints (url, site_id, secret, max_concurrency, enabled, created_at) VALUES (?, ?, ?, ?, 1, ?)',
+                (url, site_id, secret, max(1, max_concurrency), datetime.utcnow().isoformat()))
+    conn.commit()
+    eid = cur.lastrowid
+    conn.close()
+    return eid
+
+
+def list_endpoints() -> List[dict]:
+    conn = db.get_conn()
+    rows = [dict(r) for r in conn.execute('SELECT * FROM WebhookEndpoints ORDER BY id').fetchall()]
+    conn.close()
+    return rows
+
+
+def outbox_counts() -> dict:
+    conn = db.get_conn()
+    out = {r['status']: r['n'] for r in conn.execute('SELECT status, COUNT(*) AS n FROM WebhookOutbox GROUP BY status').fetchall()}
+    conn.close()
+    return out
+
+
+def requeue_dead(endpoint_id: Optional[int] = None) -> int:
+    """Give dead-lettered rows a fresh set of attempts."""
+    conn = db.get_conn()
+    cur = conn.cursor()
+    q = "UPDATE WebhookOutbox SET status='pending', attempts=0, next_attempt_at=? WHERE status='dead'"
+    params = [datetime.utcnow().isoformat()]
+    if endpoint_id is not None:
+        q += ' AND endpoint_id=?'
+        params.append(endpoint_id)
+    cur.execute(q, params)
+    conn.commit()
+    n = cur.rowcount
+    conn.close()
+    return n
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim(now: datetime, limit: int = CLAIM_LIMIT) -> List[dict]:
+    conn = db.get_conn()
+    cur = conn.cursor()
+    # BEGIN IMMEDIATE takes the write lock up front so two workers cannot claim the same rows
+    cur.execute('BEGIN IMMEDIATE')
+    rows = [dict(r) for r in cur.execute(
+        "SELECT o.id, o.endpoint_id, o.change_id, o.attempts, e.url, e.secret, e.max_concurrency "
+        "FROM WebhookOutbox o JOIN WebhookEndpoints e ON e.id=o.endpoint_id "
+        "WHERE o.status='pending' AND o.next_attempt_at <= ? AND e.enabled=1 ORDER BY o.id LIMIT ?",
+        (now.isoformat(), limit)).fetchall()]
+    lease = (now + timedelta(seconds=LEASE_SECONDS)).isoformat()
+    cur.executemany('UPDATE WebhookOutbox SET next_attempt_at=? WHERE id=?', [(lease, r['id']) for r in rows])
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def _post(url: str, secret: Optional[str], events: List[dict]):
+    body = json.dumps({'changes': events}).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-WPS-Signature'] = 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    r = requests.post(url, data=body, headers=headers, timeout=TIMEOUT_SECONDS)
+    if not 200 <= r.status_code < 300:
+        raise RuntimeError(f'HTTP {r.status_code}')
+
+
+def _settle(batch: List[dict], error: Optional[str]):
+    now = datetime.utcnow()
+    conn = db.get_conn()
+    cur = conn.cursor()
+    if error is None:
+        cur.executemany("UPDATE WebhookOutbox SET status='delivered', attempts=attempts+1, delivered_at=?, last_error=NULL WHERE id=?",
+                        [(now.isoformat(), r['id']) for r in batch])
+    else:
+        updates = []
+        for r in batch:
+            attempts = r['attempts'] + 1
+            status = 'dead' if attempts >= MAX_ATTEMPTS else 'pending'
+            updates.append((status, attempts, (now + timedelta(seconds=backoff_seconds(attempts))).isoformat(), error, r['id']))
+        cur.executemany('UPDATE WebhookOutbox SET status=?, attempts=?, next_attempt_at=?, last_error=? WHERE id=?', updates)
+    conn.commit()
+    conn.close()
+
+
+def _deliver(batch: List[dict], gate: threading.Semaphore) -> bool:
+    ep = batch[0]
+    events = db.changes_by_ids([r['change_id'] for r in batch])
+    with gate:
+        try:
+            _post(ep['url'], ep['secret'], events)
+            error = None
+        except Exception as e:
+            error = str(e)[:500]
+            logger.warning('Webhook %s failed for %d changes: %s', ep['url'], len(batch), error)
+    _settle(batch, error)
+    return error is None
+
+
+def run_once(batch_size: Optional[int] = None, max_workers: int = 8) -> dict:
+    """Claim everything due, deliver it, and return {'delivered': n, 'failed': n} (counted in changes)."""
+    batch_size = batch_size or BATCH_SIZE
+    rows = _claim(datetime.utcnow())
+    by_endpoint = {}
+    for r in rows:
+        by_endpoint.setdefault(r['endpoint_id'], []).append(r)
+    jobs = []
+    for ep_rows in by_endpoint.values():
+        gate = threading.Semaphore(max(1, ep_rows[0]['max_concurrency'] or 1))
+        for i in range(0, len(ep_rows), batch_size):
+            jobs.append((ep_rows[i:i + batch_size], gate))
+    stats = {'delivered': 0, 'failed': 0}
+    if not jobs:
+        return stats
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for (batch, _), ok in zip(jobs, pool.map(lambda j: _deliver(*j), jobs)):
+            stats['delivered' if ok else 'failed'] += len(batch)
+    return stats
+
+
+def run_loop(interval_seconds: float = 5):
+    while True:
+        try:
+            stats = run_once()
+            if stats['delivered'] or stats['failed']:
+                logger.info('Webhook delivery: %s', stats)
+        except Exception as e:
+            logger.exception('Webhook worker pass failed: %s', e)
+        time.sleep(interval_seconds)
@@ -0,0 +1,95 @@
+import sys, os, importlib.util, socket, threading
+from werkzeug.serving import make_server
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, anchor, anchor_batch, anchor_ots, segment_store
+from src.workers import anchor_worker
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _otsd_sim(data_dir, monkeypatch):
+    """Serve the bundled services/otsd-sim app on a free local port."""
+    monkeypatch.setenv('OTSD_DATA_DIR', str(data_dir))
+    spec = importlib.util.spec_from_file_location('otsd_sim', os.path.join(ROOT, 'services', 'otsd-sim', 'app.py'))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    server = make_server('127.0.0.1', 0, mod.app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def _closed_port_url():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return f'http://127.0.0.1:{port}'
+
+
+def _seed(n):
+    sid = db.add_site('https://example.com', 'https://example.com')
+    pid = db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    items = []
+    for i in range(n):
+        h = f'{i:064x}'
+        items.append((db.insert_page_version(sid, pid, f'2025-01-01T00:00:{i:02d}', f't{i}', h, []), h))
+    return items
+
+
+def test_worker_retries_then_anchors_against_otsd_sim(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(anchor, 'ANCHOR_DIR', tmp_path / 'anchors')
+    monkeypatch.setattr(segment_store, 'SEGMENT_DIR', tmp_path / 'anchors' / 'segments')
+    monkeypatch.setattr(anchor_ots, '_has_ots_cli', lambda: False)
+    monkeypatch.setattr(anchor_worker, 'BACKOFF_BASE_SECONDS', 0)
+    db.init_db()
+    _seed(5)
+    [bid] = anchor_batch.enqueue_pending()
+    assert anchor_worker.queue_counts() == {'pending': 1}
+
+    # OTSD down: the failure is recorded and retried, not swallowed
+    monkeypatch.setenv('OTSD_URL', _closed_port_url())
+    assert anchor_worker.run_once() == {'anchored': 0, 'failed': 1}
+    conn = db.get_conn()
+    q = conn.execute('SELECT * FROM AnchorQueue WHERE batch_id=?', (bid,)).fetchone()
+    conn.close()
+    assert q['status'] == 'pending' and q['attempts'] == 1 and 'no witness' in q['last_error']
+
+    server, url = _otsd_sim(tmp_path / 'otsd', monkeypatch)
+    try:
+        monkeypatch.setenv('OTSD_URL', url)
+        assert anchor_worker.run_once(concurrency=2) == {'anchored': 1, 'failed': 0}
+        assert anchor_worker.run_once() == {'anchored': 0, 'failed': 0}
+        conn = db.get_conn()
+        batch = conn.execute('SELECT * FROM AnchorBatches WHERE id=?', (bid,)).fetchone()
+        versions = conn.execute('SELECT id, witness_tx_id, proof_path FROM PageVersions').fetchall()
+        conn.close()
+        assert batch['witness_tx_id'].startswith(str(tmp_path / 'otsd' / batch['root']))
+        assert {(v['witness_tx_id'], v['proof_path']) for v in versions} == {(batch['witness_tx_id'], batch['proof_path'])}
+        assert anchor_ots.verify_ots(batch['witness_tx_id'])
+        assert segment_store.is_ref(batch['proof_path'])
+        assert segment_store.get(batch['proof_path']) == open(batch['witness_tx_id'], 'rb').read()
+        assert all(anchor_batch.verify_version(v['id']) for v in versions)
+        assert anchor_worker.queue_counts() == {'done': 1}
+    finally:
+        server.shutdown()
+
+
+def test_exhausted_batches_are_dead_lettered_and_requeued(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(anchor_worker, 'BACKOFF_BASE_SECONDS', 0)
+    monkeypatch.setattr(anchor_worker, 'MAX_ATTEMPTS', 2)
+    db.init_db()
+    _seed(3)
+    anchor_batch.enqueue_pending()
+
+    def down(h):
+        raise ConnectionError('otsd unreachable')
+    monkeypatch.setattr(anchor, 'anchor_hash', down)
+    anchor_worker.run_once()
+    anchor_worker.run_once()
+    assert anchor_worker.queue_counts() == {'dead': 1}
+    assert anchor_worker.run_once() == {'anchored': 0, 'failed': 0}
+    monkeypatch.setattr(anchor, 'anchor_hash', lambda h: ('wit', 'proof'))
+    assert anchor_worker.requeue_dead() == 1
+    assert anchor_worker.run_once() == {'anchored': 1, 'failed': 0}
@@ -0,0 +1,99 @@
+import sys, os, json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, change_bus
+
+
+def _seed(tmp_path, monkeypatch, n=3):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(change_bus, '_bus', None)
+    db.init_db()
+    sid = db.add_site('https://example.com', 'https://example.com')
+    pid = db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    vids = [db.insert_page_version(sid, pid, f'2025-01-0{i + 1}T00:00:00', f'text {i}', f'h{i}', []) for i in range(n + 1)]
+    cids = [db.insert_change(vids[i], vids[i + 1], f'text {i + 1}', f'text {i}', []) for i in range(n)]
+    return sid, pid, vids, cids
+
+
+def _events(resp, count, max_chunks=None):
+    out = []
+    for n, chunk in enumerate(resp.response):
+        if max_chunks is not None and n >= max_chunks:
+            break
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('id: '):
+            out.append(json.loads(chunk.split('data: ', 1)[1]))
+            if len(out) == count:
+                break
+    resp.close()
+    return out
+
+
+def test_stream_resumes_from_last_event_id(tmp_path, monkeypatch):
+    from src.ui import app
+    sid, pid, vids, cids = _seed(tmp_path, monkeypatch)
+    client = app.test_client()
+    resp = client.get(f'/api/changes/stream?site={sid}', headers={'Last-Event-ID': str(cids[0])}, buffered=False)
+    assert resp.mimetype == 'text/event-stream'
+    evs = _events(resp, 2)
+    assert [e['id'] for e in evs] == cids[1:]
+    assert evs[0]['url'] == 'https://example.com/' and evs[0]['site_id'] == sid
+
+
+def test_slow_subscriber_is_marked_lagged(tmp_path, monkeypatch):
+    sid, pid, vids, cids = _seed(tmp_path, monkeypatch, n=1)
+    bus = change_bus.get_bus()
+    sub = bus.subscribe(sid)
+    other = bus.subscribe(sid + 1)
+    sub.queue.maxsize = 2
+    for i in range(3):
+        vids.append(db.insert_page_version(sid, pid, f'2025-02-0{i + 1}T00:00:00', f'more {i}', f'm{i}', []))
+        db.insert_change(vids[-2], vids[-1], f'more {i}', '', [])
+    assert sub.lagged and sub.queue.empty()
+    assert other.queue.empty() and not other.lagged
+    # the reader recovers from the DB starting at the last id it delivered
+    assert [e['id'] for e in db.changes_since(cids[0], site_id=sid)] == [bus.last_id - 2, bus.last_id - 1, bus.last_id]
+    bus.unsubscribe(sub)
+    bus.unsubscribe(other)
+
+
+def test_resubscribe_starts_from_current_tail(tmp_path, monkeypatch):
+    sid, pid, vids, cids = _seed(tmp_path, monkeypatch, n=1)
+    bus = change_bus.get_bus()
+    bus.unsubscribe(bus.subscribe(sid))
+    # written while nobody is connected, so pump() never advances last_id
+    for i in range(3):
+        vids.append(db.insert_page_version(sid, pid, f'2025-03-0{i + 1}T00:00:00', f'idle {i}', f'i{i}', []))
+        db.insert_change(vids[-2], vids[-1], f'idle {i}', '', [])
+    sub = bus.subscribe(sid)
+    assert bus.last_id == db.max_change_id() == cids[0] + 3
+    assert sub.queue.empty()
+    bus.unsubscribe(sub)
+
+
+def test_overflow_during_get_is_replayed_in_order(tmp_path, monkeypatch):
+    from src import ui
+    sid, pid, vids, cids = _seed(tmp_path, monkeypatch, n=1)
+    monkeypatch.setattr(ui, 'SSE_KEEPALIVE_SECONDS', 0.05)
+    bus = change_bus.get_bus()
+    subscribe = bus.subscribe
+    added = []
+
+    def racy_subscribe(site_id=None):
+        sub = subscribe(site_id)
+        sub.queue.maxsize = 1
+        get = sub.queue.get
+
+        def get_after_overflow(timeout=None):
+            if not added:
+                # the publisher overflows (dropping c1, c2) and then buffers c3,
+                # all after the reader's lagged check
+                for i in range(3):
+                    vids.append(db.insert_page_version(sid, pid, f'2025-03-0{i + 1}T00:00:00', f'late {i}', f'l{i}', []))
+                    added.append(db.insert_change(vids[-2], vids[-1], f'late {i}', '', []))
+                assert sub.lagged
+            return get(timeout=timeout)
+        sub.queue.get = get_after_overflow
+        return sub
+    monkeypatch.setattr(bus, 'subscribe', racy_subscribe)
+    resp = ui.app.test_client().get(f'/api/changes/stream?site={sid}', headers={'Last-Event-ID': str(cids[0])}, buffered=False)
+    assert [e['id'] for e in _events(resp, 3, max_chunks=20)] == added
@@ -0,0 +1,169 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, crawler, anchor, crypto_asym
+
+
+PAGE = '<html><body><article><h1>Title</h1><p>{body}</p><img src="/a.png"></article></body></html>'
+
+
+def _watcher(tmp_path, monkeypatch, pages):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(crawler, 'parse_sitemap_urls', lambda root: [])
+    monkeypatch.setattr(crawler, 'archive_url', lambda url: {})
+    monkeypatch.setattr(crawler.time, 'sleep', lambda s: None)
+    monkeypatch.setattr(anchor, 'anchor_hash', lambda h: (None, None))
+    monkeypatch.setattr(crypto_asym, 'sign_bytes', lambda data: 'sig')
+
+    def fake_get(url, headers=None, etag=None, last_modified=None, retries=3, timeout=15):
+        body = pages.get(url.rstrip('/'))
+        if body is None:
+            return 404, {}, ''
+        return 200, {'ETag': 'W/"%d"' % len(body)}, body
+    monkeypatch.setattr(crawler, 'http_get', fake_get)
+    sw = crawler.SiteWatcher()
+    sid = db.add_site('https://example.com', 'https://example.com')
+    db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    return sw, sid
+
+
+def _site(sid):
+    conn = db.get_conn()
+    row = conn.execute('SELECT * FROM Sites WHERE id=?', (sid,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_crawl_detects_change_once(tmp_path, monkeypatch):
+    pages = {'https://example.com': PAGE.format(body='first version of the page')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    sw.crawl_site(_site(sid))
+    sw.crawl_site(_site(sid))
+    assert db.global_stats()['page_versions'] == 1
+    pages['https://example.com'] = PAGE.format(body='second version of the page')
+    sw.crawl_site(_site(sid))
+    stats = db.global_stats()
+    assert stats['page_versions'] == 2 and stats['changes'] == 1
+    latest = db.latest_versions_for_site(sid)
+    (entry,) = latest.values()
+    assert entry['etag'] and entry['images_digest'] == db.images_digest(['https://example.com/a.png'])
+    conn = db.get_conn()
+    ch = conn.execute('SELECT * FROM Changes').fetchone()
+    conn.close()
+    assert 'second' in ch['added_text'] and 'first' in ch['removed_text']
+
+
+def test_near_duplicate_is_logged_as_minor(tmp_path, monkeypatch):
+    words = ' '.join(f'word{i}' for i in range(400))
+    pages = {'https://example.com': PAGE.format(body=words + ' views 101')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    conn = db.get_conn()
+    conn.execute('UPDATE Sites SET near_dup_threshold=0.9 WHERE id=?', (sid,))
+    conn.commit()
+    conn.close()
+    sw.crawl_site(_site(sid))
+    pages['https://example.com'] = PAGE.format(body=words + ' views 102')
+    sw.crawl_site(_site(sid))
+    assert db.global_stats()['page_versions'] == 1
+    conn = db.get_conn()
+    minor = conn.execute('SELECT * FROM MinorChanges').fetchall()
+    conn.close()
+    assert len(minor) == 1 and minor[0]['similarity'] >= 0.9
+    pages['https://example.com'] = PAGE.format(body='an entirely different article about something else')
+    sw.crawl_site(_site(sid))
+    assert db.global_stats()['page_versions'] == 2
+
+
+def test_mask_rules_suppress_volatile_regions(tmp_path, monkeypatch):
+    from src import masking
+    page = '<html><body><article><p>Stable story text that matters.</p><p>Updated {ts}</p></article><div class="ticker">{ts}</div></body></html>'
+    pages = {'https://example.com': page.format(ts='10:01')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    pid = db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    # history recorded before any mask existed: two versions differing only by timestamp
+    db.insert_page_version(sid, pid, '2025-01-01T00:00:00', 'Stable story text\nUpdated 09:00', 'x1', [])
+    db.insert_page_version(sid, pid, '2025-01-02T00:00:00', 'Stable story text\nUpdated 09:30', 'x2', [])
+    masking.add_rule(sid, 'regex', r'Updated \d\d:\d\d')
+    masking.add_rule(sid, 'css', '.ticker')
+    rep = masking.dry_run_report(sid)
+    assert rep['rules'][0]['eliminated_versions'] == 1
+    assert rep['rules'][1]['evaluable'] is False
+    sw.crawl_site(_site(sid))
+    before = db.global_stats()['page_versions']
+    pages['https://example.com'] = page.format(ts='10:02')
+    sw.crawl_site(_site(sid))
+    assert db.global_stats()['page_versions'] == before
+
+
+def test_unchanged_raw_body_skips_extraction(tmp_path, monkeypatch):
+    from src import utils
+    pages = {'https://example.com': PAGE.format(body='static page body')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    calls = []
+    real = utils.extract_readable_text
+    monkeypatch.setattr(utils, 'extract_readable_text', lambda html: calls.append(1) or real(html))
+    sw.crawl_site(_site(sid))
+    sw.crawl_site(_site(sid))
+    sw.crawl_site(_site(sid))
+    assert len(calls) == 1
+    conn = db.get_conn()
+    row = conn.execute('SELECT raw_digest FROM Pages').fetchone()
+    conn.close()
+    assert row['raw_digest'] == utils.hash_text(pages['https://example.com'])
+
+
+def test_cycle_anchors_one_root_with_offline_proofs(tmp_path, monkeypatch):
+    from src import anchor_batch
+    from src.workers import anchor_worker
+    pages = {'https://example.com': PAGE.format(body='home page'),
+             'https://example.com/a': PAGE.format(body='page a'),
+             'https://example.com/b': PAGE.format(body='page b')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    for path in ('/a', '/b'):
+        db.upsert_page(sid, 'https://example.com' + path, 'https://example.com' + path)
+    anchored = []
+    monkeypatch.setattr(anchor, 'anchor_hash', lambda h: anchored.append(h) or ('wit-1', 'anchors/batch.ots'))
+    sw.run_cycle()
+    assert db.global_stats()['page_versions'] == 3
+    # the crawl only queues the batch; the worker anchors it
+    assert anchored == []
+    assert anchor_worker.run_once() == {'anchored': 1, 'failed': 0}
+    conn = db.get_conn()
+    rows = conn.execute('SELECT id, content_hash, witness_tx_id, anchor_batch_id FROM PageVersions').fetchall()
+    batch = conn.execute('SELECT * FROM AnchorBatches').fetchone()
+    conn.close()
+    assert len(anchored) == 1 and anchored[0] == batch['root'] and batch['leaf_count'] == 3
+    assert {r['witness_tx_id'] for r in rows} == {'wit-1'} and {r['anchor_batch_id'] for r in rows} == {batch['id']}
+    for r in rows:
+        assert anchor_batch.verify_version(r['id'])
+        proof = anchor_batch.version_proof(r['id'])
+        assert not anchor_batch.verify_inclusion('0' * 64, proof)
+    # nothing new next cycle: nothing queued
+    sw.run_cycle()
+    assert anchor_worker.run_once() == {'anchored': 0, 'failed': 0} and len(anchored) == 1
+
+
+def test_failed_anchor_queueing_is_retried_next_cycle(tmp_path, monkeypatch):
+    from src import anchor_batch
+    pages = {'https://example.com': PAGE.format(body='home page')}
+    sw, sid = _watcher(tmp_path, monkeypatch, pages)
+    real = anchor_batch._enqueue
+
+    def boom(cur, items, now):
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(anchor_batch, '_enqueue', boom)
+    sw.run_cycle()
+    assert db.global_stats()['page_versions'] == 1
+    conn = db.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM AnchorBatches').fetchone()[0] == 0
+    conn.close()
+    # a fresh watcher (as after a restart) still finds the version and batches it
+    monkeypatch.setattr(anchor_batch, '_enqueue', real)
+    pages['https://example.com'] = PAGE.format(body='home page, second edition')
+    crawler.SiteWatcher().run_cycle()
+    conn = db.get_conn()
+    rows = conn.execute('SELECT anchor_batch_id FROM PageVersions').fetchall()
+    batches = conn.execute('SELECT leaf_count FROM AnchorBatches').fetchall()
+    conn.close()
+    assert len(rows) == 2 and len({r['anchor_batch_id'] for r in rows}) == 1 and rows[0]['anchor_batch_id']
+    assert [b['leaf_count'] for b in batches] == [2]
+    assert crawler.SiteWatcher().flush_anchors() == []
@@ -0,0 +1,62 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db
+
+
+def test_stats_tables_track_inserts_and_deletes(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('http://a.example', 'a.example')
+    p1 = db.upsert_page(sid, 'http://a.example/', 'http://a.example/')
+    p2 = db.upsert_page(sid, 'http://a.example/x', 'http://a.example/x')
+    db.upsert_page(sid, 'http://a.example/x', 'http://a.example/x')
+    v1 = db.insert_page_version(sid, p1, '2025-01-01T00:00:00', 'one', 'h1', [])
+    v2 = db.insert_page_version(sid, p1, '2025-02-01T00:00:00', 'two', 'h2', [])
+    db.insert_page_version(sid, p2, '2025-01-15T00:00:00', 'three', 'h3', [])
+    db.insert_change(v1, v2, 'two', 'one', [])
+
+    assert db.global_stats() == {'sites': 1, 'pages': 2, 'page_versions': 3, 'changes': 1}
+    row = db.site_stats()[0]
+    assert (row['page_count'], row['version_count'], row['change_count']) == (2, 3, 1)
+    assert row['last_version_at'] == '2025-02-01T00:00:00'
+
+    conn = db.get_conn()
+    conn.execute('DELETE FROM Changes')
+    conn.execute('DELETE FROM PageVersions WHERE page_id=?', (p2,))
+    conn.execute('DELETE FROM Pages WHERE id=?', (p2,))
+    conn.commit()
+    ps = conn.execute('SELECT version_count FROM PageStats WHERE page_id=?', (p1,)).fetchone()[0]
+    conn.close()
+    assert ps == 2
+    assert db.global_stats() == {'sites': 1, 'pages': 1, 'page_versions': 2, 'changes': 0}
+
+    incremental = [dict(r) for r in db.site_stats()]
+    db.rebuild_stats()
+    assert [dict(r) for r in db.site_stats()] == incremental
+
+
+def test_deleting_the_latest_version_moves_last_version_at_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('http://a.example', 'a.example')
+    p1 = db.upsert_page(sid, 'http://a.example/', 'http://a.example/')
+    p2 = db.upsert_page(sid, 'http://a.example/x', 'http://a.example/x')
+    db.insert_page_version(sid, p1, '2025-01-01T00:00:00', 'one', 'h1', [])
+    v2 = db.insert_page_version(sid, p1, '2025-03-01T00:00:00', 'two', 'h2', [])
+    v3 = db.insert_page_version(sid, p2, '2025-02-01T00:00:00', 'three', 'h3', [])
+    conn = db.get_conn()
+    conn.execute('DELETE FROM PageVersions WHERE id=?', (v2,))
+    conn.commit()
+    pages = dict(conn.execute('SELECT page_id, last_version_at FROM PageStats').fetchall())
+    assert pages == {p1: '2025-01-01T00:00:00', p2: '2025-02-01T00:00:00'}
+    assert db.site_stats()[0]['last_version_at'] == '2025-02-01T00:00:00'
+    conn.execute('DELETE FROM PageVersions WHERE id=?', (v3,))
+    conn.commit()
+    pages = dict(conn.execute('SELECT page_id, last_version_at FROM PageStats').fetchall())
+    conn.close()
+    assert pages == {p1: '2025-01-01T00:00:00', p2: None}
+    row = db.site_stats()[0]
+    assert (row['version_count'], row['last_version_at']) == (1, '2025-01-01T00:00:00')
+    incremental = [dict(r) for r in db.site_stats()]
+    db.rebuild_stats()
+    assert [dict(r) for r in db.site_stats()] == incremental
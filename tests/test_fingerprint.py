@@ -0,0 +1,25 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import fingerprint
+
+
+def test_simhash_similarity_tracks_edit_size():
+    base = ' '.join(f'token{i}' for i in range(300))
+    a = fingerprint.simhash(base + ' visitors 100')
+    b = fingerprint.simhash(base + ' visitors 101')
+    c = fingerprint.simhash(' '.join(f'other{i}' for i in range(300)))
+    assert fingerprint.similarity(a, b) > 0.9
+    assert fingerprint.similarity(a, c) < 0.8
+    assert fingerprint.similarity(a, None) == 0.0
+
+
+def test_block_hashes_locate_changed_blocks():
+    old = 'Intro\nSection one\nSection two\nFooter'
+    new = 'Intro\nSection one (revised)\nSection two\nNew note\nFooter'
+    ob, nb = fingerprint.block_hashes(old), fingerprint.block_hashes(new)
+    assert len(ob) == 4 * fingerprint.BLOCK_HASH_SIZE
+    assert fingerprint.changed_blocks(ob, nb) == [
+        {'old_start': 1, 'old_count': 1, 'new_start': 1, 'new_count': 1},
+        {'old_start': 3, 'old_count': 0, 'new_start': 3, 'new_count': 1},
+    ]
+    assert fingerprint.changed_blocks(ob, ob) == []
@@ -0,0 +1,52 @@
+import random
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import line_diff, utils
+
+
+def _apply(old, hunks):
+    out, pos = [], 0
+    for h in hunks:
+        out.extend(old[pos:h['old_start']])
+        assert old[h['old_start']:h['old_start'] + h['old_count']] == h['removed']
+        out.extend(h['added'])
+        pos = h['old_start'] + h['old_count']
+    out.extend(old[pos:])
+    return out
+
+
+def test_myers_hunks_reconstruct_new_text():
+    rnd = random.Random(7)
+    vocab = ['nav', 'home', 'about', 'row', 'row', 'footer'] + [f'line {i}' for i in range(20)]
+    for _ in range(200):
+        old = [rnd.choice(vocab) for _ in range(rnd.randint(0, 40))]
+        new = list(old)
+        for _ in range(rnd.randint(0, 6)):
+            op = rnd.random()
+            if op < 0.4 and new:
+                del new[rnd.randrange(len(new))]
+            elif op < 0.8:
+                new.insert(rnd.randint(0, len(new)), rnd.choice(vocab))
+            elif new:
+                new[rnd.randrange(len(new))] = 'changed'
+        res = line_diff.diff_lines(old, new)
+        assert res['mode'] == 'myers'
+        assert _apply(old, res['hunks']) == new
+
+
+def test_positions_and_set_fallback():
+    old = ['a', 'b', 'c', 'd']
+    new = ['a', 'x', 'c', 'd', 'e']
+    hunks = line_diff.diff_lines(old, new)['hunks']
+    assert hunks[0] == {'old_start': 1, 'old_count': 1, 'new_start': 1, 'new_count': 1, 'removed': ['b'], 'added': ['x']}
+    assert hunks[1]['old_start'] == 4 and hunks[1]['added'] == ['e']
+    res = line_diff.diff_lines(old, new, max_lines=1)
+    assert res['mode'] == 'set'
+    assert sorted(l for h in res['hunks'] for l in h['added']) == ['e', 'x']
+    assert [l for h in res['hunks'] for l in h['removed']] == ['b']
+
+
+def test_compute_diff_keeps_text_interface():
+    added, removed = utils.compute_diff('a\nb\nc', 'a\nB\nc\nd')
+    assert added == 'B\nd'
+    assert removed == 'b'
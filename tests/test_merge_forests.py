@@ -39,3 +39,18 @@ def test_merge_conflict_reported():
     assert 'aa' in hashes
     node = [n for n in merged2['nodes'] if n['node_hash']=='aa'][0]
     assert node['payload'] == 'different'
+
+
+def test_iter_merge_streams_sorted_inputs():
+    from src.merkle_distributed import iter_merge
+    local = ({'node_hash': f'{i:08x}', 'payload': f'p{i}'} for i in range(0, 1000, 2))
+    remote = ({'node_hash': f'{i:08x}', 'payload': f'p{i}' if i % 10 else 'changed'} for i in range(0, 1000, 3))
+    conflicts = []
+    merged = iter_merge(local, remote, {'lamport': 1}, lambda c, n: conflicts.append(c['node_hash']))
+    assert next(merged)['node_hash'] == '00000000'
+    rest = list(merged)
+    hashes = ['00000000'] + [n['node_hash'] for n in rest]
+    assert hashes == sorted({f'{i:08x}' for i in range(0, 1000, 2)} | {f'{i:08x}' for i in range(0, 1000, 3)})
+    # hashes in both streams whose remote payload differs; remote lamport wins
+    assert conflicts == [f'{i:08x}' for i in range(0, 1000, 30)]
+    assert all(n['payload'] == 'changed' for n in rest if n['node_hash'] in conflicts)
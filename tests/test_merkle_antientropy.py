@@ -0,0 +1,99 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, prefix_tree
+from src.merkle_distributed import MerkleForest, store_nodes
+from src.merkle_sync import reconcile, node_hash
+
+
+def _seed(site_id, payloads):
+    nodes = [{'node_hash': node_hash(p), 'payload': p} for p in payloads]
+    store_nodes(nodes)
+    prefix_tree.PrefixTree(site_id).append(n['node_hash'] for n in nodes)
+
+
+def test_reconcile_transfers_only_the_difference(tmp_path, monkeypatch):
+    from src.ui import app
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    # two sites in one DB stand in for the same site on two peers
+    local = db.add_site('https://a.example', 'https://a.example')
+    remote = db.add_site('https://b.example', 'https://b.example')
+    shared = [f'node {i}' for i in range(2000)]
+    _seed(remote, shared + ['remote only 1', 'remote only 2'])
+    _seed(local, shared[:1995] + ['local only'])
+    client = app.test_client()
+    sent = {'summaries': 0, 'nodes': 0}
+
+    def fetch_summaries(prefixes, list_limit):
+        sent['summaries'] += len(prefixes)
+        return client.post('/api/merkle/ranges', json={'site': remote, 'prefixes': prefixes, 'list_limit': list_limit}).get_json()['ranges']
+
+    def fetch_nodes(hashes):
+        nodes = client.post('/api/merkle/nodes', json={'site': remote, 'hashes': hashes}).get_json()['nodes']
+        sent['nodes'] += len(nodes)
+        return nodes
+
+    stats = reconcile(local, fetch_summaries, fetch_nodes)
+    assert stats['missing'] == stats['fetched'] == sent['nodes'] == 7
+    assert sent['summaries'] < 200
+    have = {n['node_hash'] for n in MerkleForest(local).nodes()}
+    assert {n['node_hash'] for n in MerkleForest(remote).nodes()} <= have
+    assert node_hash('local only') in have
+    # 'local only' keeps the roots apart until the peer pulls it back
+    assert not stats['in_sync']
+    # a second pass finds nothing to transfer
+    again = reconcile(local, fetch_summaries, fetch_nodes)
+    assert again['missing'] == 0
+    back = reconcile(remote, lambda prefixes, limit: prefix_tree.PrefixTree(local).summaries(prefixes, limit),
+                     lambda hashes: MerkleForest(local).get_nodes(hashes))
+    assert back['fetched'] == 1 and back['in_sync']
+    assert prefix_tree.for_site(local).root() == prefix_tree.for_site(remote).root()
+    assert MerkleForest(local).latest()['tree_root'] == MerkleForest(remote).latest()['tree_root']
+
+
+def test_reconcile_into_a_subset_reaches_the_peer_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    local = db.add_site('https://a.example', 'https://a.example')
+    remote = db.add_site('https://b.example', 'https://b.example')
+    payloads = [f'node {i}' for i in range(500)]
+    # the peer got the same nodes in a different order and grouping
+    for i in range(0, 500, 50):
+        _seed(remote, payloads[i:i + 50])
+    _seed(local, payloads[::-3])
+    peer = prefix_tree.PrefixTree(remote)
+    stats = reconcile(local, peer.summaries, lambda hashes: MerkleForest(remote).get_nodes(hashes))
+    assert stats['in_sync']
+    assert prefix_tree.for_site(local).root() == peer.root()
+
+
+def test_ranges_endpoint_validates_input(tmp_path, monkeypatch):
+    from src.ui import app
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('https://a.example', 'https://a.example')
+    _seed(sid, [f'node {i}' for i in range(40)])
+    client = app.test_client()
+    assert client.post('/api/merkle/ranges', json={'site': sid, 'list_limit': 'lots'}).status_code == 400
+    assert client.post('/api/merkle/ranges', json={'site': sid, 'prefixes': ['zz']}).status_code == 400
+    assert client.post('/api/merkle/ranges', json={'site': sid, 'prefixes': ['0'] * 257}).status_code == 400
+    body = client.post('/api/merkle/ranges', json={'site': sid, 'prefixes': ['', 'a'], 'list_limit': '4'}).get_json()
+    whole, part = body['ranges']
+    assert whole['count'] == 40 and whole['digest'] == prefix_tree.PrefixTree(sid).root() and 'hashes' not in whole
+    under_a = sorted(h for h in (node_hash(f'node {i}') for i in range(40)) if h.startswith('a'))
+    assert part['count'] == len(under_a) and part.get('hashes', under_a) == under_a
+    assert ('hashes' in part) == (len(under_a) <= 4)
+
+
+def test_reconcile_rejects_nodes_that_do_not_match_their_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('https://a.example', 'https://a.example')
+    fake = node_hash('genuine')
+
+    def fetch_summaries(prefixes, list_limit):
+        return [{'prefix': p, 'count': 1, 'digest': 'x', 'hashes': [fake]} for p in prefixes]
+
+    stats = reconcile(sid, fetch_summaries, lambda hashes: [{'node_hash': fake, 'payload': 'forged'}])
+    assert stats['rejected'] == 1 and stats['fetched'] == 0
+    assert prefix_tree.PrefixTree(sid).leaf_count == 0
@@ -0,0 +1,103 @@
+import sys, os, json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, prefix_tree, merkle_sync
+from src.merkle_sync import create_delta, apply_delta, sign_delta
+
+
+def _peer_deltas(target_site, peer_site, n):
+    """Signed, sequenced deltas as a peer mirroring `target_site` would produce them."""
+    lines = []
+    for i in range(n):
+        d = create_delta(peer_site, [{'payload': f'node {i}'}])
+        assert apply_delta(d)
+        d = dict(d, site_id=target_site, sequence=i + 1, lamport=i + 1)
+        lines.append({'delta': d, 'signature': sign_delta(d)})
+    return lines
+
+
+def test_bulk_push_streams_per_delta_results(tmp_path, monkeypatch):
+    from src.ui import app
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(merkle_sync, 'BULK_BATCH_SIZE', 7)
+    db.init_db()
+    target = db.add_site('https://a.example', 'https://a.example')
+    peer = db.add_site('https://b.example', 'https://b.example')
+    lines = _peer_deltas(target, peer, 20)
+    tampered = dict(lines[20 - 1], signature='00' * 64)
+    body = [json.dumps(l) for l in lines[:10]]
+    body += [json.dumps(lines[3]), 'not json', json.dumps(tampered)]
+    body += [json.dumps(l) for l in lines[10:]]
+    resp = app.test_client().post('/api/merkle/push/bulk', data='\n'.join(body) + '\n', content_type='application/x-ndjson')
+    out = [json.loads(l) for l in resp.get_data(as_text=True).splitlines()]
+    summary = out.pop()['summary']
+    assert [r['index'] for r in out] == list(range(len(body)))
+    status = {r['index']: r['status'] for r in out}
+    assert status[10] == 'obsolete' and status[11] == 'invalid' and status[12] == 'invalid_signature'
+    assert summary == {'applied': 20, 'obsolete': 1, 'invalid': 1, 'invalid_signature': 1}
+    assert prefix_tree.for_site(target).root() == prefix_tree.for_site(peer).root()
+    assert merkle_sync.delta_watermark(target) == (20, 20)
+    # replaying the whole stream is rejected by the stored watermark
+    resp = app.test_client().post('/api/merkle/push/bulk', data='\n'.join(json.dumps(l) for l in lines), content_type='application/x-ndjson')
+    assert json.loads(resp.get_data(as_text=True).splitlines()[-1])['summary'] == {'obsolete': 20}
+
+
+def test_failing_delta_is_rolled_back_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    target = db.add_site('https://a.example', 'https://a.example')
+    peer = db.add_site('https://b.example', 'https://b.example')
+    lines = _peer_deltas(target, peer, 3)
+    broken = []
+    for nodes in (['not a node'], [{'payload': 'no hash'}], [{'node_hash': 'XYZ', 'payload': 'bad hash'}]):
+        d = dict(lines[1]['delta'], added_nodes=nodes)
+        broken.append((d, sign_delta(d)))
+    items = [(l['delta'], l['signature']) for l in lines]
+    results = merkle_sync.apply_delta_batch(items[:1] + broken + items[1:])
+    # nodes whose payload does not hash to node_hash are refused before anything is written
+    assert [r['status'] for r in results] == ['applied', 'error', 'root_mismatch', 'root_mismatch', 'applied', 'applied']
+    assert prefix_tree.for_site(target).root() == prefix_tree.for_site(peer).root()
+    assert merkle_sync.delta_watermark(target) == (3, 3)
+
+
+def test_delta_failing_after_its_writes_leaves_nothing_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    target = db.add_site('https://a.example', 'https://a.example')
+    peer = db.add_site('https://b.example', 'https://b.example')
+    lines = _peer_deltas(target, peer, 3)
+    store_delta = merkle_sync.store_delta
+
+    def flaky(delta, signature, conn=None):
+        if delta['sequence'] == 2:
+            raise RuntimeError('disk full')
+        return store_delta(delta, signature, conn)
+    monkeypatch.setattr(merkle_sync, 'store_delta', flaky)
+    results = merkle_sync.apply_delta_batch([(l['delta'], l['signature']) for l in lines])
+    # delta 2's nodes and tree rows were written before store_delta failed
+    assert [r['status'] for r in results] == ['applied', 'error', 'root_mismatch']
+    tree = prefix_tree.for_site(target)
+    assert tree.leaf_count == 1 and tree.root() == lines[0]['delta']['new_root']
+    conn = db.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM ForestLeaves WHERE site_id=?', (target,)).fetchone()[0] == 1
+    conn.close()
+    assert merkle_sync.delta_watermark(target) == (1, 1)
+
+
+def test_root_mismatch_is_not_stored_by_either_push(tmp_path, monkeypatch):
+    from src.ui import app
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    target = db.add_site('https://a.example', 'https://a.example')
+    peer = db.add_site('https://b.example', 'https://b.example')
+    lines = _peer_deltas(target, peer, 3)
+    client = app.test_client()
+    # the target never saw delta 1, so deltas 2 and 3 do not lead to their new_root
+    resp = client.post('/api/merkle/push', json=lines[1])
+    assert resp.status_code == 409 and resp.get_json()['error'] == 'root mismatch'
+    resp = client.post('/api/merkle/push/bulk', data=json.dumps(lines[2]) + '\n', content_type='application/x-ndjson')
+    assert json.loads(resp.get_data(as_text=True).splitlines()[-1])['summary'] == {'root_mismatch': 1}
+    assert merkle_sync.delta_watermark(target) == (0, 0)
+    resp = client.post('/api/merkle/push', json=lines[0])
+    assert resp.status_code == 200 and resp.get_json()['applied'] and resp.get_json()['stored_id']
+    assert client.post('/api/merkle/push', json=lines[1]).status_code == 200
+    assert merkle_sync.delta_watermark(target) == (2, 2)
@@ -0,0 +1,31 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import merkle
+
+
+def test_batch_proofs_match_single_proofs():
+    for n in (1, 2, 5, 8, 13):
+        leaves = [f'leaf-{i}'.encode() for i in range(n)]
+        root = merkle.merkle_root(leaves)
+        assert merkle.merkle_levels(leaves)[-1][0] == root
+        proofs = merkle.merkle_proofs(leaves)
+        assert proofs == {i: merkle.merkle_proof(leaves, i) for i in range(n)}
+        assert merkle.verify_proofs(dict(enumerate(leaves)), proofs, root)
+        bad = dict(enumerate(leaves))
+        bad[0] = b'tampered'
+        assert not merkle.verify_proofs(bad, proofs, root)
+
+
+def test_multiproof_dedupes_siblings_and_verifies():
+    leaves = [f'leaf-{i}'.encode() for i in range(13)]
+    root = merkle.merkle_root(leaves)
+    for idx in ([0], [12], [0, 1], [2, 3, 4], [1, 6, 9, 12], list(range(13))):
+        mp = merkle.merkle_multiproof(leaves, idx)
+        assert merkle.verify_multiproof({i: leaves[i] for i in idx}, mp, root)
+        singles = sum(len(merkle.merkle_proof(leaves, i)) for i in idx)
+        assert len(mp['hashes']) <= singles
+    assert merkle.merkle_multiproof(leaves, range(13))['hashes'] == []
+    mp = merkle.merkle_multiproof(leaves, [1, 6])
+    assert not merkle.verify_multiproof({1: leaves[1], 6: b'x'}, mp, root)
+    assert not merkle.verify_multiproof({1: leaves[1]}, mp, root)
+    assert not merkle.verify_multiproof({1: leaves[1], 6: leaves[6]}, dict(mp, hashes=mp['hashes'][:-1]), root)
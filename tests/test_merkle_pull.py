@@ -0,0 +1,56 @@
+import sys, os, json, gzip
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, merkle_sync
+from src.merkle_sync import create_delta, attach_sequence_and_sign, apply_delta
+
+
+def test_pull_since_sequence_and_root_pages_deltas(tmp_path, monkeypatch):
+    from src.ui import app
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('https://example.com', 'https://example.com')
+    roots = []
+    for i in range(12):
+        d = create_delta(sid, [{'payload': f'node {i} ' + 'x' * 200}])
+        signed = attach_sequence_and_sign(d)
+        assert apply_delta(d)
+        roots.append(signed['delta']['new_root'])
+    client = app.test_client()
+    page = client.get(f'/api/merkle/pull?site={sid}&since_sequence=4&limit=5').get_json()
+    assert [d['sequence'] for d in page['deltas']] == [5, 6, 7, 8, 9]
+    assert page['has_more'] and page['next_since_sequence'] == 9
+    last = client.get(f'/api/merkle/pull?site={sid}&since_sequence=9&limit=5').get_json()
+    assert [d['sequence'] for d in last['deltas']] == [10, 11, 12] and not last['has_more']
+    # since_root resumes after the delta that produced that root
+    by_root = client.get(f'/api/merkle/pull?site={sid}&since_root={roots[9]}').get_json()
+    assert [d['sequence'] for d in by_root['deltas']] == [11, 12]
+    assert merkle_sync.verify_delta(by_root['deltas'][0]['delta'], by_root['deltas'][0]['signature'])
+    assert client.get(f'/api/merkle/pull?site={sid}&since_root=beef').status_code == 404
+    resp = client.get(f'/api/merkle/pull?site={sid}&since_sequence=0', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(resp.data))['deltas']) == 12
+    conn = db.get_conn()
+    plan = ' '.join(r[-1] for r in conn.execute('EXPLAIN QUERY PLAN SELECT id FROM MerkleDeltas WHERE site_id=? AND sequence > ? ORDER BY sequence, id', (sid, 0)))
+    conn.close()
+    assert 'idx_merkle_deltas_site_seq' in plan
+
+
+def test_unsequenced_pushes_are_pulled(tmp_path, monkeypatch):
+    from src.ui import app
+    from src.merkle_sync import sign_delta
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    target = db.add_site('https://a.example', 'https://a.example')
+    peer = db.add_site('https://b.example', 'https://b.example')
+    client = app.test_client()
+    for i in range(3):
+        d = create_delta(peer, [{'payload': f'node {i}'}])
+        assert apply_delta(d)
+        d = dict(d, site_id=target)
+        assert 'sequence' not in d
+        assert client.post('/api/merkle/push', json={'delta': d, 'signature': sign_delta(d)}).status_code == 200
+    assert merkle_sync.delta_watermark(target)[0] == 3
+    page = client.get(f'/api/merkle/pull?site={target}&since_sequence=0').get_json()
+    assert [d['sequence'] for d in page['deltas']] == [1, 2, 3]
+    assert [d['delta']['added_nodes'][0]['payload'] for d in page['deltas']] == ['node 0', 'node 1', 'node 2']
+    assert client.get(f'/api/merkle/pull?site={target}&since_sequence=2').get_json()['deltas'][0]['sequence'] == 3
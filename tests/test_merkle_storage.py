@@ -0,0 +1,72 @@
+import sys, os, json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, prefix_tree
+from src.merkle_distributed import MerkleForest
+from src.merkle_sync import create_delta, apply_delta, node_hash
+
+
+def _db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    return db.add_site('https://example.com', 'https://example.com')
+
+
+def test_deltas_store_nodes_once_and_small_snapshots(tmp_path, monkeypatch):
+    sid = _db(tmp_path, monkeypatch)
+    assert apply_delta(create_delta(sid, [{'payload': 'one', 'meta': {'lamport': 1}}, {'payload': 'two'}]))
+    assert apply_delta(create_delta(sid, [{'payload': 'two'}, {'payload': 'three'}]))
+    conn = db.get_conn()
+    snaps = conn.execute('SELECT tree_blob, node_count FROM MerkleForest WHERE site_id=? ORDER BY id', (sid,)).fetchall()
+    stored = conn.execute('SELECT COUNT(*) FROM KnowledgeNodes').fetchone()[0]
+    conn.close()
+    assert [s['node_count'] for s in snaps] == [2, 3] and all(s['tree_blob'] is None for s in snaps)
+    assert stored == 3
+    nodes = list(MerkleForest(sid).nodes())
+    assert [n['node_hash'] for n in nodes] == sorted(node_hash(p) for p in ('one', 'two', 'three'))
+    assert {n['payload'] for n in nodes} == {'one', 'two', 'three'}
+    assert [n for n in nodes if n['payload'] == 'one'][0]['meta'] == {'lamport': 1}
+    first = nodes[0]['node_hash']
+    assert [n['node_hash'] for n in MerkleForest(sid).nodes(after=first)] == [n['node_hash'] for n in nodes[1:]]
+    assert MerkleForest(sid).latest()['tree_root'] == prefix_tree.for_site(sid).root()
+
+
+def test_legacy_blob_is_migrated(tmp_path, monkeypatch):
+    from src.ui import app
+    sid = _db(tmp_path, monkeypatch)
+    blob = {'nodes': [{'node_hash': node_hash(p), 'payload': p} for p in ('x', 'y')]}
+    conn = db.get_conn()
+    conn.execute('INSERT INTO MerkleForest (site_id, tree_root, tree_blob, last_updated) VALUES (?, ?, ?, ?)', (sid, 'legacy', json.dumps(blob), '2025-01-01'))
+    conn.commit()
+    conn.close()
+    resp = app.test_client().get(f'/api/merkle/pull?site={sid}')
+    body = resp.get_json()
+    assert body['root'] == prefix_tree.for_site(sid).root() != 'legacy'
+    assert sorted(n['payload'] for n in body['tree_blob']['nodes']) == ['x', 'y']
+    conn = db.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM MerkleForest WHERE tree_blob IS NOT NULL').fetchone()[0] == 0
+    conn.close()
+
+
+def test_conflicting_payload_never_overwrites_a_stored_node(tmp_path, monkeypatch):
+    from src.ui import app
+    sid = _db(tmp_path, monkeypatch)
+    assert apply_delta(create_delta(sid, [{'payload': 'genuine'}]))
+    other = db.add_site('https://b.example', 'https://b.example')
+    # a newer delta for another site reuses the hash with a different payload
+    forged = create_delta(other, [{'payload': 'genuine'}])
+    forged['added_nodes'][0]['payload'] = 'forged'
+    assert not apply_delta(dict(forged, lamport=99, sequence=99))
+    assert apply_delta(create_delta(other, [{'payload': 'genuine'}]))
+    # a forged payload for a hash nobody stored yet cannot claim it either
+    fresh = create_delta(other, [{'payload': 'fresh'}])
+    assert not apply_delta(dict(fresh, added_nodes=[dict(fresh['added_nodes'][0], payload='forged')]))
+    assert apply_delta(fresh)
+    conn = db.get_conn()
+    rows = conn.execute('SELECT payload FROM KnowledgeNodes ORDER BY payload').fetchall()
+    conn.close()
+    assert [json.loads(r['payload']) for r in rows] == ['fresh', 'genuine']
+    resp = app.test_client().get(f'/api/merkle/pull?site={other}')
+    assert resp.is_streamed
+    body = json.loads(resp.get_data(as_text=True))
+    assert body['root'] == prefix_tree.for_site(other).root()
+    assert sorted(n['payload'] for n in body['tree_blob']['nodes']) == ['fresh', 'genuine']
@@ -0,0 +1,113 @@
+import sys, os
+import pytest
+from hashlib import sha256
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, prefix_tree
+from src.merkle_sync import create_delta, apply_delta
+
+
+def _naive_digest(hashes, prefix=''):
+    # rebuild from scratch straight from the definition
+    members = sorted(h for h in hashes if h.startswith(prefix))
+    if len(members) <= prefix_tree.BUCKET_SIZE:
+        return prefix_tree.bucket_digest(members)
+    digits = sorted({h[len(prefix)] for h in members})
+    return prefix_tree.split_digest({d: _naive_digest(members, prefix + d) for d in digits})
+
+
+def _hashes(n):
+    # half clustered under a long shared prefix (deep splits), half spread out
+    return [f'{i:064x}' for i in range(n // 2)] + [sha256(str(i).encode()).hexdigest() for i in range(n - n // 2)]
+
+
+def test_incremental_root_and_proofs(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    hashes = _hashes(150)
+    r = prefix_tree.PrefixTree(1)
+    assert r.root() == prefix_tree.EMPTY_ROOT
+    for i in range(0, len(hashes), 7):
+        chunk = hashes[i:i + 7]
+        preview = r.preview_root(chunk + hashes[:i])
+        assert r.append(chunk) == preview == _naive_digest(hashes[:i + len(chunk)]).hex()
+    # state survives a reload and re-appending existing leaves is a no-op
+    r2 = prefix_tree.PrefixTree(1)
+    assert r2.root() == r.root() and r2.leaf_count == 150
+    assert r2.append(hashes[:10]) == r.root()
+    for h in hashes:
+        p = r2.proof(h)
+        assert len(p['bucket']) <= prefix_tree.BUCKET_SIZE
+        assert prefix_tree.verify_inclusion(h, p, r2.root())
+    p = r2.proof(hashes[3])
+    assert not prefix_tree.verify_inclusion(hashes[-1], p, r2.root())
+    others = [h for h in p['bucket'] if h != hashes[3]]
+    assert not prefix_tree.verify_inclusion(hashes[3], dict(p, bucket=sorted(others[1:] + [hashes[3]])), r2.root())
+    assert r2.proof('f' * 64) is None
+    with pytest.raises(ValueError):
+        r2.append(['not-a-hash'])
+
+
+def test_root_depends_only_on_the_node_set(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    a = db.add_site('https://a.example', 'https://a.example')
+    b = db.add_site('https://b.example', 'https://b.example')
+    batches = [[{'payload': f'p{i}'} for i in range(k, k + 12)] for k in range(0, 36, 12)]
+    for batch in batches:
+        assert apply_delta(create_delta(a, batch))
+    for batch in reversed(batches):
+        assert apply_delta(create_delta(b, batch[::-1]))
+    assert prefix_tree.for_site(a).root() == prefix_tree.for_site(b).root()
+    # so the next delta from one applies cleanly on the other
+    d = create_delta(a, [{'payload': 'next'}])
+    assert d['prev_root'] == prefix_tree.for_site(b).root()
+    assert apply_delta(dict(d, site_id=b))
+    assert apply_delta(d)
+    assert prefix_tree.for_site(a).root() == prefix_tree.for_site(b).root() == d['new_root']
+
+
+def test_delta_roundtrip_uses_tree_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('https://example.com', 'https://example.com')
+    d1 = create_delta(sid, [{'payload': 'b'}, {'payload': 'a'}])
+    assert d1['prev_root'] == ''
+    assert apply_delta(d1)
+    forest = prefix_tree.for_site(sid)
+    assert forest.root() == d1['new_root'] and forest.leaf_count == 2
+    d2 = create_delta(sid, [{'payload': 'a'}, {'payload': 'c'}])
+    assert d2['prev_root'] == d1['new_root']
+    assert apply_delta(d2)
+    assert prefix_tree.for_site(sid).leaf_count == 3
+    stale = dict(d2, new_root='00' * 32)
+    assert not apply_delta(stale)
+
+
+def test_apply_delta_is_atomic_and_uses_indexed_watermark(tmp_path, monkeypatch):
+    from src.merkle_distributed import MerkleForest
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    sid = db.add_site('https://example.com', 'https://example.com')
+    assert apply_delta(create_delta(sid, [{'payload': 'a'}]))
+    d = create_delta(sid, [{'payload': 'b'}, {'payload': 'c'}])
+
+    save_tree = MerkleForest.save_tree
+
+    def boom(self, root, node_count, conn=None):
+        raise RuntimeError('disk full')
+    # fails after the nodes and tree rows were written in the same transaction
+    monkeypatch.setattr(MerkleForest, 'save_tree', boom)
+    with pytest.raises(RuntimeError):
+        apply_delta(d)
+    conn = db.get_conn()
+    assert conn.execute('SELECT COUNT(*) FROM KnowledgeNodes').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM MerkleForest').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM ForestLeaves').fetchone()[0] == 1
+    conn.close()
+    assert prefix_tree.for_site(sid).leaf_count == 1
+    monkeypatch.setattr(MerkleForest, 'save_tree', save_tree)
+    assert apply_delta(d) and prefix_tree.for_site(sid).leaf_count == 3
+    conn = db.get_conn()
+    plan = ' '.join(r[-1] for r in conn.execute('EXPLAIN QUERY PLAN SELECT MAX(sequence) FROM MerkleDeltas WHERE site_id=?', (sid,)).fetchall())
+    conn.close()
+    assert 'idx_merkle_deltas_site_seq' in plan
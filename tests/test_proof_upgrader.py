@@ -0,0 +1,53 @@
+import sys, os, threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db
+from src.workers import proof_upgrader
+
+
+def _seed(n, batches):
+    sid = db.add_site('https://example.com', 'https://example.com')
+    pid = db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    vids = [db.insert_page_version(sid, pid, f'2025-01-01T00:00:{i:02d}', f't{i}', f'{i:064x}', []) for i in range(n)]
+    conn = db.get_conn()
+    for vid, path in zip(vids, batches):
+        conn.execute('UPDATE PageVersions SET proof_path=? WHERE id=?', (path, vid))
+    conn.commit()
+    conn.close()
+
+
+def test_shared_proofs_checked_once_with_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    # three versions share one batch proof; one legacy per-version proof is not upgradable yet
+    _seed(4, ['a.ots', 'a.ots', 'a.ots', 'b.ots'])
+    calls = []
+    lock = threading.Lock()
+
+    def verify(path):
+        with lock:
+            calls.append(path)
+        return path == 'a.ots'
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'verify_ots', verify)
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'upgrade_ots', lambda path: False)
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'fetch_proof', lambda path, d: None)
+
+    report = proof_upgrader.run_once(anchor_dir=tmp_path / 'anchors', workers=2)
+    assert report['proofs'] == 2 and report['versions'] == 4
+    assert report['verified'] == 1 and report['deferred'] == 1 and report['errors'] == 0
+    assert sorted(calls) == ['a.ots', 'b.ots']
+    conn = db.get_conn()
+    rows = {r['proof_path']: r for r in conn.execute('SELECT proof_path, proof_verified, proof_attempts, next_check_at FROM PageVersions').fetchall()}
+    conn.close()
+    assert rows['a.ots']['proof_verified'] == 1 and rows['a.ots']['next_check_at'] is None
+    assert rows['b.ots']['proof_verified'] == 0 and rows['b.ots']['proof_attempts'] == 1 and rows['b.ots']['next_check_at']
+
+    # backed off: the next pass does not touch the deferred proof
+    assert proof_upgrader.run_once(anchor_dir=tmp_path / 'anchors')['proofs'] == 0
+    assert len(calls) == 2
+    conn = db.get_conn()
+    conn.execute("UPDATE PageVersions SET next_check_at='2000-01-01' WHERE proof_path='b.ots'")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'upgrade_ots', lambda path: True)
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'verify_ots', lambda path: True)
+    assert proof_upgrader.run_once(anchor_dir=tmp_path / 'anchors')['verified'] == 1
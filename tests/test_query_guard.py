@@ -0,0 +1,30 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, query_guard, search_cache
+from src.ui import app
+
+
+def test_search_over_budget_returns_structured_503(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(search_cache, '_cache', search_cache.SearchCache())
+    db.init_db()
+    sid = db.add_site('http://a.example', 'a.example')
+    pid = db.upsert_page(sid, 'http://a.example/', 'http://a.example/')
+    for i in range(300):
+        db.insert_page_version(sid, pid, f'2025-01-01T00:{i // 60:02d}:{i % 60:02d}', f'word{i} common text', f'h{i}', [])
+    client = app.test_client()
+    assert client.get('/api/search?q=common').get_json()['total'] == 300
+    monkeypatch.setattr(query_guard, 'QUERY_STEP_BUDGET', 1000)
+    r = client.get('/api/search?q=common OR text&page=2')
+    assert r.status_code == 503
+    j = r.get_json()
+    assert j['error'] == 'query-budget-exceeded' and j['reason'] == 'steps'
+
+
+def test_client_limiter_caps_inflight_requests():
+    lim = query_guard.ClientLimiter(limit=2)
+    assert lim.acquire('a') and lim.acquire('a')
+    assert not lim.acquire('a')
+    assert lim.acquire('b')
+    lim.release('a')
+    assert lim.acquire('a')
@@ -0,0 +1,72 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db
+
+
+def _seed(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    db.init_db()
+    s1 = db.add_site('http://a.example', 'a.example')
+    s2 = db.add_site('http://b.example', 'b.example')
+    p1 = db.upsert_page(s1, 'http://a.example/', 'http://a.example/')
+    p2 = db.upsert_page(s2, 'http://b.example/', 'http://b.example/')
+    for i in range(15):
+        db.insert_page_version(s1, p1, f'2025-10-{i+1:02d}T00:00:00', f'archive text {i}', f'h1-{i}', [])
+    for i in range(10):
+        db.insert_page_version(s2, p2, f'2025-11-{i+1:02d}T00:00:00', f'archive other {i}', f'h2-{i}', [])
+    return s1, s2
+
+
+def test_paged_search_totals_and_facets_cover_full_match_set(tmp_path, monkeypatch):
+    s1, s2 = _seed(tmp_path, monkeypatch)
+    res = db.search_page_versions_paged('archive', page=1, per_page=10)
+    assert res['total'] == 25
+    assert len(res['results']) == 10
+    assert res['site_facets'] == {s1: 15, s2: 10}
+    assert res['date_facets'] == {'2025-11': 10, '2025-10': 15}
+    page3 = db.search_page_versions_paged('archive', page=3, per_page=10)
+    assert len(page3['results']) == 5
+    seen = set()
+    for p in (1, 2, 3):
+        seen.update(r['page_version_id'] for r in db.search_page_versions_paged('archive', page=p, per_page=10)['results'])
+    assert len(seen) == 25
+
+
+def test_paged_search_filters_in_sql(tmp_path, monkeypatch):
+    s1, s2 = _seed(tmp_path, monkeypatch)
+    res = db.search_page_versions_paged('archive', site_id=s2)
+    assert res['total'] == 10
+    assert all(r['site_id'] == s2 for r in res['results'])
+    res = db.search_page_versions_paged('archive', date_from='2025-10-05', date_to='2025-10-08')
+    assert res['total'] == 3
+    est = db.search_page_versions_paged('archive', exact_total=False)
+    assert est['total'] == 25 and not est['total_estimated']
+
+
+def test_search_cache_hits_until_watermark_bumps(tmp_path, monkeypatch):
+    from src import search_cache
+    s1, s2 = _seed(tmp_path, monkeypatch)
+    cache = search_cache.SearchCache(maxsize=8, ttl=60, poll_seconds=60)
+    monkeypatch.setattr(search_cache, '_cache', cache)
+    res, hit = search_cache.search('archive  text', site_id=s1)
+    assert not hit and res['total'] == 15
+    res, hit = search_cache.search('archive text', site_id=s1)
+    assert hit and res['total'] == 15
+    p1 = db.upsert_page(s1, 'http://a.example/', 'http://a.example/')
+    db.insert_page_version(s1, p1, '2025-12-01T00:00:00', 'archive text new', 'h1-new', [])
+    res, hit = search_cache.search('archive text', site_id=s1)
+    assert not hit and res['total'] == 16
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_search_page_links_keep_every_filter_encoded(tmp_path, monkeypatch):
+    import html, re
+    from urllib.parse import parse_qs
+    from src.ui import app
+    s1, s2 = _seed(tmp_path, monkeypatch)
+    args = {'q': 'archive', 'site': str(s1), 'from': '2025-10-01', 'to': '2025-10-31&x#y', 'total': 'estimate', 'per_page': '5', 'page': '2'}
+    page = app.test_client().get('/search', query_string=args).get_data(as_text=True)
+    links = {m.group(2): parse_qs(html.unescape(m.group(1))) for m in re.finditer(r'href="/search\?([^"]*)">(Previous|Next)<', page)}
+    assert set(links) == {'Previous', 'Next'}
+    assert links['Next'] == {k: [v] for k, v in dict(args, page='3').items()}
+    assert links['Previous']['page'] == ['1'] and links['Previous']['to'] == ['2025-10-31&x#y']
@@ -0,0 +1,81 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db, anchor, anchor_ots, segment_store
+from src.workers import proof_upgrader
+
+
+def _store(tmp_path, monkeypatch, max_bytes=4096):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(segment_store, 'SEGMENT_DIR', tmp_path / 'segments')
+    monkeypatch.setattr(segment_store, 'SEGMENT_MAX_BYTES', max_bytes)
+    monkeypatch.setattr(segment_store, 'FSYNC', False)
+    db.init_db()
+
+
+def test_put_get_supersede_and_compact(tmp_path, monkeypatch):
+    _store(tmp_path, monkeypatch)
+    refs = [segment_store.put(f'ots/{i:064x}', b'proof-%d' % i * 20) for i in range(60)]
+    assert all(segment_store.get(r) == b'proof-%d' % i * 20 for i, r in enumerate(refs))
+    st = segment_store.stats()
+    assert st['segments'] > 1 and st['records'] == 60 and st['garbage_bytes'] == 0
+    assert segment_store.get('seg:missing') is None
+    # identical rewrite is a no-op; upgrades supersede the old record
+    assert segment_store.put_many([(segment_store.key_of(refs[0]), b'proof-0' * 20, 'proof')]) == 0
+    for i, r in enumerate(refs[:40]):
+        segment_store.put(segment_store.key_of(r), b'upgraded-%d' % i * 20)
+    assert segment_store.stats()['garbage_bytes'] > 0
+    files_before = set(os.listdir(tmp_path / 'segments'))
+    out = segment_store.compact(min_garbage_ratio=0.5)
+    assert out['segments'] >= 1 and out['reclaimed_bytes'] > 0
+    assert files_before - set(os.listdir(tmp_path / 'segments'))
+    for i, r in enumerate(refs):
+        assert segment_store.get(r) == (b'upgraded-%d' % i if i < 40 else b'proof-%d' % i) * 20
+    st = segment_store.stats()
+    assert st['records'] == 60 and st['garbage_bytes'] < out['reclaimed_bytes']
+    # records are self-describing: a segment can be read back without the index
+    keys = {k for sid in (r['id'] for r in db.get_conn().execute('SELECT id FROM Segments').fetchall()) for k, _ in segment_store.scan(sid)}
+    assert keys == {segment_store.key_of(r) for r in refs}
+
+
+def test_corrupt_record_is_rejected(tmp_path, monkeypatch):
+    _store(tmp_path, monkeypatch)
+    r = segment_store.put('ots/abc', b'x' * 100)
+    path = segment_store.segment_path(1)
+    raw = bytearray(path.read_bytes())
+    raw[-1] ^= 0xff
+    path.write_bytes(bytes(raw))
+    segment_store._drop_map(1)
+    assert segment_store.get(r) is None
+
+
+def test_anchor_records_and_migration_leave_no_per_hash_files(tmp_path, monkeypatch):
+    _store(tmp_path, monkeypatch)
+    monkeypatch.setattr(anchor, 'ANCHOR_DIR', tmp_path / 'anchors')
+    monkeypatch.setattr(anchor_ots, '_has_ots_cli', lambda: False)
+    monkeypatch.delenv('OTSD_URL', raising=False)
+    (tmp_path / 'anchors').mkdir()
+    witness, proof_path = anchor.anchor_hash('ab' * 32)
+    assert witness is None and segment_store.is_ref(proof_path)
+    assert segment_store.get(proof_path).startswith(b'anchor:' + b'ab' * 32)
+    assert os.listdir(tmp_path / 'anchors') == []
+
+    sid = db.add_site('https://example.com', 'https://example.com')
+    pid = db.upsert_page(sid, 'https://example.com/', 'https://example.com/')
+    legacy = tmp_path / 'anchors' / 'ots.remote.cafe.1.ots'
+    legacy.write_bytes(b'legacy proof')
+    vid = db.insert_page_version(sid, pid, '2025-01-01', 't', 'cafe', [], proof_path=str(legacy))
+    assert segment_store.migrate_files() == {'migrated': 1, 'missing': 0}
+    assert not legacy.exists()
+    ref = db.get_page_version(vid)['proof_path']
+    assert ref == 'seg:file/ots.remote.cafe.1.ots' and segment_store.get(ref) == b'legacy proof'
+
+    # the upgrader works on a temp copy and writes the upgraded proof back under the same key
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'verify_ots', lambda p: open(p, 'rb').read().endswith(b'upgraded'))
+    monkeypatch.setattr(proof_upgrader.anchor_ots, 'upgrade_ots', lambda p: open(p, 'ab').write(b'\nupgraded') > 0)
+    report = proof_upgrader.run_once(anchor_dir=tmp_path / 'anchors')
+    assert report['proofs'] == 1 and report['verified'] == 1
+    assert segment_store.get(ref) == b'legacy proof\nupgraded'
+    assert segment_store.stats()['garbage_bytes'] > 0
+    assert segment_store.compact()['segments'] == 0
+    assert segment_store.compact(min_garbage_ratio=0.1)['segments'] == 1
+    assert segment_store.stats()['garbage_bytes'] == 0 and segment_store.get(ref) == b'legacy proof\nupgraded'
@@ -0,0 +1,81 @@
+import sys, os, threading, time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import crypto_asym
+
+
+def _keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(crypto_asym, 'KEY_DIR', tmp_path / 'keys')
+    monkeypatch.setattr(crypto_asym, 'SK_PATH', tmp_path / 'keys' / 'ed25519_sk.hex')
+    monkeypatch.setattr(crypto_asym, 'VK_PATH', tmp_path / 'keys' / 'ed25519_vk.hex')
+    monkeypatch.delenv('WPS_KMS_KEY_ID', raising=False)
+    monkeypatch.delenv('AWS_KMS_KEY_ID', raising=False)
+    crypto_asym.reset_signer()
+
+
+class SlowKMS:
+    """Stand-in for a remote KMS: fixed latency per call, fails on one message."""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def sign(self, key_id, data):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if data == b'reject':
+            raise RuntimeError('throttled')
+        return b'kms:' + data
+
+    def verify(self, key_id, data, signature):
+        return signature == b'kms:' + data
+
+
+def test_signer_loads_keys_and_provider_once(tmp_path, monkeypatch):
+    _keys(tmp_path, monkeypatch)
+    loads = []
+    real = crypto_asym.ensure_keypair
+    monkeypatch.setattr(crypto_asym, 'ensure_keypair', lambda: loads.append(1) or real())
+    lookups = []
+    monkeypatch.setattr(crypto_asym, '_get_kms_provider', lambda: lookups.append(1))
+    sigs = [crypto_asym.sign_bytes(b'msg-%d' % i) for i in range(5)]
+    assert all(crypto_asym.verify_bytes(b'msg-%d' % i, s) for i, s in enumerate(sigs))
+    assert not crypto_asym.verify_bytes(b'other', sigs[0])
+    assert crypto_asym.sign_many(b'msg-%d' % i for i in range(5)) == sigs
+    assert crypto_asym.verify_with_public_key(b'msg-0', sigs[0], crypto_asym.get_public_key_bytes())
+    assert len(loads) == 1 and lookups == []
+    crypto_asym.reset_signer()
+    crypto_asym.sign_bytes(b'x')
+    assert len(loads) == 2
+    crypto_asym.reset_signer()
+
+
+def test_sign_many_pipelines_provider_calls_with_local_fallback(tmp_path, monkeypatch):
+    _keys(tmp_path, monkeypatch)
+    kms = SlowKMS()
+    lookups = []
+    monkeypatch.setattr(crypto_asym, '_get_kms_provider', lambda: lookups.append(1) or kms)
+    monkeypatch.setenv('WPS_KMS_KEY_ID', 'k1')
+    crypto_asym.reset_signer()
+    items = [b'm%d' % i for i in range(40)] + [b'reject']
+    sigs = crypto_asym.get_signer().sign_many(items, concurrency=8)
+    assert sigs[:40] == [(b'kms:' + d).hex() for d in items[:40]]
+    assert sigs[40] == crypto_asym.get_signer()._sign_local(b'reject')
+    assert 1 < kms.peak <= 8 and kms.calls == 41 and lookups == [1]
+    assert crypto_asym.verify_bytes(b'm3', sigs[3])
+
+    class BatchKMS(SlowKMS):
+        def sign_many(self, key_id, items):
+            self.calls += 1
+            return [b'kms:' + d for d in items]
+    batch = BatchKMS()
+    signer = crypto_asym.Signer(batch, 'k1')
+    assert signer.sign_many(items[:40]) == sigs[:40] and batch.calls == 1
+    crypto_asym.reset_signer()
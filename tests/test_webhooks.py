@@ -0,0 +1,90 @@
+import sys, os, json, threading, hmac, hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import db
+from src.workers import webhook_dispatcher as wd
+
+
+class Receiver:
+    """Local stand-in for a downstream system; fails the first `fail` requests."""
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.bodies = []
+        self.headers = []
+        rec = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if rec.fail:
+                    rec.fail -= 1
+                    self.send_response(503)
+                else:
+                    rec.bodies.append(json.loads(body))
+                    rec.headers.append((dict(self.headers), body))
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *a):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hook'
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _seed_changes(sid, n):
+    pid = db.upsert_page(sid, f'https://example.com/{sid}', f'https://example.com/{sid}')
+    vids = [db.insert_page_version(sid, pid, f'2025-01-01T00:00:{i:02d}', f't{i}', f'h{sid}-{i}', []) for i in range(n + 1)]
+    return [db.insert_change(vids[i], vids[i + 1], 'a', 'r', []) for i in range(n)]
+
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, 'DB_PATH', tmp_path / 'watcher.db')
+    monkeypatch.setattr(wd, 'BACKOFF_BASE_SECONDS', 0)
+    db.init_db()
+    return db.add_site('https://example.com', 'https://example.com'), db.add_site('https://other.org', 'https://other.org')
+
+
+def test_outbox_batches_and_filters_by_site(tmp_path, monkeypatch):
+    sid, other = _setup(tmp_path, monkeypatch)
+    rec = Receiver()
+    try:
+        wd.add_endpoint(rec.url, site_id=sid, secret='s3cret')
+        cids = _seed_changes(sid, 5)
+        _seed_changes(other, 2)
+        assert wd.outbox_counts() == {'pending': 5}
+        stats = wd.run_once(batch_size=3)
+        assert stats == {'delivered': 5, 'failed': 0}
+        assert sorted(len(b['changes']) for b in rec.bodies) == [2, 3]
+        assert sorted(e['id'] for b in rec.bodies for e in b['changes']) == cids
+        headers, body = rec.headers[0]
+        assert headers['X-WPS-Signature'] == 'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+        assert wd.run_once() == {'delivered': 0, 'failed': 0}
+    finally:
+        rec.close()
+
+
+def test_retry_then_dead_letter(tmp_path, monkeypatch):
+    sid, _ = _setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(wd, 'MAX_ATTEMPTS', 3)
+    rec = Receiver(fail=1)
+    try:
+        wd.add_endpoint(rec.url)
+        _seed_changes(sid, 2)
+        assert wd.run_once() == {'delivered': 0, 'failed': 2}
+        assert wd.run_once() == {'delivered': 2, 'failed': 0}
+        rec.fail = 10
+        _seed_changes(sid, 1)
+        for _ in range(3):
+            wd.run_once()
+        assert wd.outbox_counts() == {'delivered': 2, 'dead': 1}
+        rec.fail = 0
+        assert wd.requeue_dead() == 1
+        assert wd.run_once() == {'delivered': 1, 'failed': 0}
+    finally:
+        rec.close()